@@ -0,0 +1,477 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from time import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+import gif_encoder
+
+# Archive of every session's GIF, with a retention policy for the card.
+# GIFs are stored under their content hash (the first 16 hex digits of their
+# SHA-256, e.g. 3f2a9c0e5b7d41c1.gif), so a GIF archived twice -- a resumed
+# session, a re-encode that comes out the same -- is only stored once. Each
+# archive entry maps a collision-free id (the session's timestamp, with -2, -3
+# and so on for another session in the same second) to its GIF. The entries
+# are held in memory, oldest first, and mirrored to a JSON manifest, so listing
+# the archive or finding a session's GIF never scans the directory. The
+# directory is only scanned if there's no manifest, adopting GIFs named the old
+# way (by timestamp) as it goes.
+#
+# The Compactor keeps everything the booth stores (archived GIFs plus the sets'
+# JPEGs and raw frames) within a byte budget, and the card above a free-space
+# watermark, from a background thread while the booth is idle. Cheapest loss
+# first, and only as far down the list as it needs to go, it:
+#
+#   1. drops older sets that already have an archived GIF
+#   2. re-encodes older GIFs with a smaller encoder profile (from the GIF itself)
+#   3. drops older sets that never got a GIF
+#   4. deletes the oldest archived GIFs
+#
+# The newest `keep_sets` sets and `keep_gifs` GIFs are never touched.
+#
+#   python archive_store.py gif_archive archive.json                 # what's in it
+#   python archive_store.py gif_archive archive.json --budget-mb 500 --compact
+
+HASH_LENGTH = 16  # Hex digits of the SHA-256 kept in a GIF's file name
+BLOB_PATTERN = re.compile(r'[0-9a-f]{%d}\.gif$' % HASH_LENGTH)
+PART_SUFFIX = '.part'
+ORPHAN_AGE = 3600  # Seconds before a GIF no entry refers to is swept (it may be waiting to be added)
+ID_FORMAT = '%Y%m%d-%H%M%S'
+
+
+def profile_size(profile):
+    # For ordering profiles by how big their GIFs come out; None (unknown) counts as the biggest
+    settings = gif_encoder.PROFILES.get(profile)
+    return (float('inf'), float('inf')) if settings is None else (settings['max_width'], settings['colors'])
+
+
+class ArchiveStore:
+    def __init__(self, root, manifest_path, on_change=None):
+        self.root = str(root)
+        self.manifest_path = str(manifest_path)
+        self.on_change = on_change  # on_change(entry id, new GIF path) when an entry's GIF is replaced
+        self._entries = OrderedDict()  # id -> {'id', 'blob', 'bytes', 'profile', 'created'}, oldest first
+        self._refs = {}  # blob name -> number of entries using it
+        self._blob_bytes = {}  # blob name -> size, each stored GIF counted once
+        self._reserved = set()  # Ids handed out by new_id() this run
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # One save at a time, so the newest snapshot is the one left on disk
+        self.version = 0  # Bumped on every change, for caches of the listing
+        self.deduplicated = 0
+        self.removed = 0
+        os.makedirs(self.root, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def digest(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()[:HASH_LENGTH]
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest + '.gif')
+
+    def _public(self, entry):
+        return dict(entry, path=os.path.join(self.root, entry['blob']))
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                entries = json.load(f)['entries']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"No usable archive manifest at {self.manifest_path} ({e}), scanning {self.root}...")
+            self.rebuild()
+            return
+        with self._lock:
+            self._entries = OrderedDict()
+            self._refs, self._blob_bytes = {}, {}
+            for entry in entries:
+                self._insert(entry)
+        print(f"Loaded {len(entries)} archived GIFs from {self.manifest_path}")
+
+    def rebuild(self):
+        # One-off scan of the archive, oldest first; GIFs named by timestamp are renamed to their hash
+        gifs = sorted((e for e in os.scandir(self.root) if e.name.endswith('.gif') and e.is_file()),
+                      key=lambda e: e.stat().st_mtime)
+        with self._lock:
+            self._entries = OrderedDict()
+            self._refs, self._blob_bytes = {}, {}
+            for gif in gifs:
+                created = gif.stat().st_mtime
+                digest = self.digest(gif.path)
+                blob_path = self.blob_path(digest)
+                if gif.path != blob_path:
+                    if os.path.exists(blob_path):
+                        os.remove(gif.path)  # A duplicate of one already adopted
+                        self.deduplicated += 1
+                    else:
+                        os.replace(gif.path, blob_path)
+                base = gif.name[:-len('.gif')] if not BLOB_PATTERN.match(gif.name) else \
+                    datetime.fromtimestamp(created).strftime(ID_FORMAT)
+                self._insert({'id': self._unused_id(base), 'blob': os.path.basename(blob_path),
+                              'bytes': os.path.getsize(blob_path), 'profile': None, 'created': created})
+        self.save()
+
+    def save(self):
+        # Write the manifest to a temporary file and rename it into place. The flusher, GIF callbacks
+        # and the compactor all save; taking the snapshot under the save lock keeps them in order.
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps({'entries': list(self._entries.values())}, indent=1)
+            part_path = self.manifest_path + PART_SUFFIX
+            with open(part_path, 'w') as f:
+                f.write(data)
+            os.replace(part_path, self.manifest_path)
+
+    # With the lock held
+    def _insert(self, entry):
+        self._entries[entry['id']] = entry
+        self._refs[entry['blob']] = self._refs.get(entry['blob'], 0) + 1
+        self._blob_bytes[entry['blob']] = entry['bytes']
+        self.version += 1
+
+    def _release(self, blob):
+        # Drop a reference to a blob; returns its path if nothing uses it any more
+        self._refs[blob] -= 1
+        if self._refs[blob]:
+            return None
+        del self._refs[blob]
+        del self._blob_bytes[blob]
+        return os.path.join(self.root, blob)
+
+    def _unused_id(self, base, taken=None):
+        entry_id, n = base, 2
+        while entry_id in self._entries or entry_id in self._reserved or (taken is not None and taken(entry_id)):
+            entry_id, n = f'{base}-{n}', n + 1
+        return entry_id
+
+    def new_id(self, base=None, taken=None):
+        # A session id nothing else has: `base` (the time, by default), then base-2, base-3...
+        # `taken(id)` can rule out ids in use elsewhere (the set index)
+        base = base or datetime.now().strftime(ID_FORMAT)
+        with self._lock:
+            entry_id = self._unused_id(base, taken)
+            self._reserved.add(entry_id)
+            return entry_id
+
+    def add(self, entry_id, path, digest=None, profile=None):
+        # Archive the GIF at `path` as `entry_id`, copying it in unless that GIF is already stored
+        # (`path` may already be its blob, written there by the caller; anything else in the archive
+        # directory is moved, not copied). Replaces the entry's old GIF.
+        digest = digest or self.digest(path)
+        blob_path = self.blob_path(digest)
+        if os.path.abspath(path) != os.path.abspath(blob_path):
+            if os.path.exists(blob_path):
+                if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root):
+                    os.remove(path)
+            elif os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root):
+                os.replace(path, blob_path)
+            else:
+                part_path = blob_path + PART_SUFFIX
+                with open(path, 'rb') as source, open(part_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.replace(part_path, blob_path)
+        blob = os.path.basename(blob_path)
+        with self._lock:
+            old = self._entries.get(entry_id)
+            unused = self._release(old['blob']) if old is not None else None
+            if blob in self._refs:
+                self.deduplicated += 1  # Another session's GIF came out the same
+            entry = {'id': entry_id, 'blob': blob, 'bytes': os.path.getsize(blob_path), 'profile': profile,
+                     'created': old['created'] if old is not None else time()}
+            self._insert(entry)  # A replaced entry keeps its place in the order
+        self.save()
+        if unused and unused != blob_path:
+            os.remove(unused)
+        if old is not None and old['blob'] != blob and self.on_change is not None:
+            self.on_change(entry_id, blob_path)
+        return self._public(entry)
+
+    def remove(self, entry_id):
+        with self._lock:
+            entry = self._entries.pop(entry_id, None)
+            if entry is None:
+                return None
+            unused = self._release(entry['blob'])
+            self.version += 1
+        self.save()
+        if unused:
+            os.remove(unused)
+        self.removed += 1
+        return self._public(entry)
+
+    def sweep(self, min_age=ORPHAN_AGE):
+        # Remove stored GIFs no entry refers to (left by a crash between copying one in and adding it)
+        now, swept = time(), 0
+        for e in os.scandir(self.root):
+            if not BLOB_PATTERN.match(e.name) or now - e.stat().st_mtime < min_age:
+                continue
+            with self._lock:
+                orphan = e.name not in self._refs
+            if orphan:
+                os.remove(e.path)
+                swept += 1
+        return swept
+
+    def get(self, entry_id):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            return self._public(entry) if entry is not None else None
+
+    def recent(self, count=None):
+        # The `count` newest entries (all of them by default), newest first
+        with self._lock:
+            entries = list(reversed(self._entries.values()))
+        return [self._public(entry) for entry in entries[:count]]
+
+    @property
+    def bytes(self):
+        with self._lock:
+            return sum(self._blob_bytes.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'gifs': len(self._blob_bytes),
+                'bytes': sum(self._blob_bytes.values()),
+                'deduplicated': self.deduplicated,
+                'removed': self.removed,
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Archive: {s['entries']} sessions in {s['gifs']} GIFs ({s['bytes'] / (1024 * 1024):.1f} MB), "
+              f"{s['deduplicated']} duplicates stored once, {s['removed']} removed")
+
+
+def gif_frames(path):
+    # An archived GIF's frames as one (n, h, w, 3) stack, and its frame duration in milliseconds
+    with Image.open(path) as gif:
+        duration = gif.info.get('duration', 500)
+        frames = np.stack([np.asarray(frame.convert('RGB')) for frame in ImageSequence.Iterator(gif)])
+    return frames, duration
+
+
+class Compactor:
+    def __init__(self, store, sets, budget_bytes, min_free_bytes, keep_sets=5, keep_gifs=50,
+                 small_profile='size', interval=60.0, idle=None, on_drop_set=None):
+        self.store = store
+        self.sets = sets  # A SetIndex
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.keep_sets = keep_sets  # Newest sets never dropped (view mode plays them)
+        self.keep_gifs = keep_gifs  # Newest GIFs never shrunk or deleted (the gallery lists them)
+        self.small_profile = small_profile
+        self.interval = interval  # Seconds between checks, unless kicked
+        self.idle = idle  # idle() -> whether the booth is quiet enough to compact now
+        self.on_drop_set = on_drop_set  # on_drop_set(record) before a set's files are deleted
+        self._set_bytes = {}  # (set id, path) -> bytes on disk
+        self._unshrinkable = set()  # GIFs that didn't get any smaller
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='archive-compactor', daemon=True)
+        self.passes = 0
+        self.actions = {'drop_set': 0, 'shrink_gif': 0, 'drop_unarchived_set': 0, 'delete_gif': 0}
+        self.freed = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def kick(self):
+        # Check now rather than at the next interval (after each session, say)
+        self._wake.set()
+
+    def close(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        self.store.sweep()
+        while not self._stop:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop:
+                return
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting the archive: {e}")
+
+    # Usage
+    def _sets_oldest_first(self):
+        return list(reversed(self.sets.recent(len(self.sets))))
+
+    def _size_of_set(self, record):
+        key = (record['id'], record['path'])
+        if key not in self._set_bytes:
+            try:
+                self._set_bytes[key] = sum(e.stat().st_size for e in os.scandir(record['path']) if e.is_file())
+            except OSError:
+                self._set_bytes[key] = 0
+        return self._set_bytes[key]
+
+    def usage(self):
+        # Bytes the booth has stored: archived GIFs plus the sets' files
+        return self.store.bytes + sum(self._size_of_set(record) for record in self._sets_oldest_first())
+
+    def free(self):
+        return shutil.disk_usage(self.store.root).free
+
+    def over(self):
+        return self.usage() > self.budget_bytes or self.free() < self.min_free_bytes
+
+    def _busy(self):
+        return self.idle is not None and not self.idle()
+
+    # Steps
+    def compact(self):
+        # One pass down the list; returns the bytes freed
+        if not self.over():
+            return 0
+        self.passes += 1
+        before = self.usage()
+        for step in (self._drop_sets_with_gifs, self._shrink_gifs, self._drop_sets_without_gifs, self._delete_gifs):
+            if self._busy():
+                break
+            step()
+            if not self.over():
+                break
+        else:
+            if self.over():
+                print(f"Archive is still over budget after compacting: {self.usage() / (1024 * 1024):.0f} MB used, "
+                      f"{self.free() / (1024 * 1024):.0f} MB free")
+        freed = max(0, before - self.usage())
+        self.freed += freed
+        return freed
+
+    def _drop_set(self, record, action):
+        self.sets.discard(record['id'])
+        if self.on_drop_set is not None:
+            self.on_drop_set(record)
+        shutil.rmtree(record['path'], ignore_errors=True)
+        self._set_bytes.pop((record['id'], record['path']), None)
+        self.actions[action] += 1
+
+    def _drop_sets(self, with_gifs, action):
+        for record in self._sets_oldest_first()[:-self.keep_sets or None]:
+            if bool(record.get('gif')) == with_gifs:
+                self._drop_set(record, action)
+                if not self.over() or self._busy():
+                    return
+
+    def _drop_sets_with_gifs(self):
+        self._drop_sets(True, 'drop_set')
+
+    def _drop_sets_without_gifs(self):
+        self._drop_sets(False, 'drop_unarchived_set')
+
+    def _shrink_gifs(self):
+        small = profile_size(self.small_profile)
+        for entry in reversed(self.store.recent()[self.keep_gifs:]):
+            if profile_size(entry['profile']) <= small or entry['blob'] in self._unshrinkable:
+                continue
+            self.shrink(entry)
+            if not self.over() or self._busy():
+                return
+
+    def shrink(self, entry):
+        # Re-encode an archived GIF with the small profile; kept as it is if that's no smaller
+        frames, duration = gif_frames(entry['path'])
+        output = io.BytesIO()
+        gif_encoder.encode(frames, output, duration, self.small_profile)
+        if output.tell() >= entry['bytes']:
+            self._unshrinkable.add(entry['blob'])
+            return False
+        part_path = os.path.join(self.store.root, f"{entry['id']}.shrink{PART_SUFFIX}")
+        with open(part_path, 'wb') as f:
+            f.write(output.getvalue())
+        try:
+            self.store.add(entry['id'], part_path, profile=self.small_profile)  # Moved into place
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        self.actions['shrink_gif'] += 1
+        return True
+
+    def _delete_gifs(self):
+        for entry in reversed(self.store.recent()[self.keep_gifs:]):
+            print(f"Deleting archived GIF {entry['id']} to make room")
+            self.store.remove(entry['id'])
+            self.actions['delete_gif'] += 1
+            if not self.over():
+                return
+
+    def stats(self):
+        return dict(self.actions, passes=self.passes, freed=self.freed, usage=self.usage(), free=self.free())
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Compactor: {s['passes']} passes freed {s['freed'] / (1024 * 1024):.1f} MB "
+              f"({s['drop_set']} sets with GIFs dropped, {s['shrink_gif']} GIFs shrunk, "
+              f"{s['drop_unarchived_set']} sets without GIFs dropped, {s['delete_gif']} GIFs deleted); "
+              f"{s['usage'] / (1024 * 1024):.0f} MB used of {self.budget_bytes / (1024 * 1024):.0f} MB, "
+              f"{s['free'] / (1024 * 1024):.0f} MB free on the card")
+
+
+class NoSets:
+    # Stands in for a SetIndex when only the archive is being compacted
+    def recent(self, count):
+        return []
+
+    def __len__(self):
+        return 0
+
+    def discard(self, set_id):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or compact the booth\'s GIF archive.')
+    parser.add_argument('archive', help='Archive directory (GIFs named by content hash)')
+    parser.add_argument('manifest', help='Archive manifest (built from the directory if missing)')
+    parser.add_argument('--sets', help='Set directory and its manifest, SETS_DIR:MANIFEST, to count and compact too')
+    parser.add_argument('--budget-mb', type=float, default=float('inf'), help='Byte budget for --compact')
+    parser.add_argument('--min-free-mb', type=float, default=0, help='Free space to leave on the card for --compact')
+    parser.add_argument('--keep-gifs', type=int, default=50, help='Newest GIFs left alone')
+    parser.add_argument('--compact', action='store_true', help='Compact down to the budget now')
+    args = parser.parse_args()
+
+    store = ArchiveStore(args.archive, args.manifest)
+    if args.sets:
+        from set_index import SetIndex
+        sets_path, _, sets_manifest = args.sets.partition(':')
+        sets = SetIndex(sets_path, sets_manifest)
+    else:
+        sets = NoSets()
+    compactor = Compactor(store, sets, args.budget_mb * 1024 * 1024, args.min_free_mb * 1024 * 1024,
+                          keep_gifs=args.keep_gifs)
+    store.print_stats()
+    if args.compact:
+        freed = compactor.compact()
+        print(f"Freed {freed / (1024 * 1024):.1f} MB")
+        store.print_stats()
+    compactor.print_stats()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+from time import time
+
+import pygame
+
+import raw_frames
+
+# Fast cold start for the booth scripts.
+# After a power blip the booth should be showing its idle screen as soon as
+# the display is up, not once everything else has loaded. The scripts open the
+# display first, show the idle screen from the AssetCache, and only then load
+# the rest, with the slow parts (the sound card, the camera settling, the
+# gallery server's HTTP stack) started as Deferred work on background threads
+# and only waited for when they're first needed.
+#
+# The AssetCache keeps full-screen images (the instruction screen, the
+# processing screen) already scaled and in the display's pixel format, as
+# raw_frames files keyed on the source file (path, size and mtime) and the
+# screen size. A hit is a memory map with no decode and no scaling; a miss
+# loads and scales the source as before and writes the cache entry on a
+# background thread, replacing any stale entry for the same source.
+#
+# StartupTimer records milestones in seconds since the process started (from
+# /proc, so the interpreter starting and the imports are counted too) and
+# prints them as a report, flagging a first frame over the boot budget.
+# Milestones reached after the report are printed as they happen.
+
+CACHE_KEY_LENGTH = 12  # Hex digits of the key in a cache entry's name
+
+
+def process_start_time():
+    # When this process started, as a time() value, or None where /proc can't tell us
+    try:
+        with open('/proc/self/stat') as f:
+            started_ticks = int(f.read().rsplit(')', 1)[1].split()[19])  # Field 22, counting from the pid
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time() - (uptime - started_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = process_start_time() or time()
+        self.milestones = []  # (name, seconds since the process started), in the order reached
+        self.reported = False
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        seconds = time() - self.start
+        with self._lock:
+            self.milestones.append((name, seconds))
+            late = self.reported
+        if late:
+            print(f"Startup: {name} at {seconds:.2f}s")
+        return seconds
+
+    def report(self, budget=None, first_frame='first_frame'):
+        # Print the milestones so far; returns {name: seconds}
+        with self._lock:
+            milestones = list(self.milestones)
+            self.reported = True
+        print("Startup timing (seconds since the process started):")
+        previous = 0.0
+        for name, seconds in milestones:
+            print(f"  {name:<16} {seconds:6.2f}s  (+{seconds - previous:.2f}s)")
+            previous = seconds
+        times = dict(milestones)
+        if budget is not None and first_frame in times:
+            verdict = 'within' if times[first_frame] <= budget else 'OVER'
+            print(f"  {first_frame} {verdict} the {budget:.1f}s boot budget")
+        return times
+
+
+class Deferred:
+    # Runs fn() on a background thread straight away; get() waits for its result (or re-raises its error)
+    def __init__(self, fn, name, timer=None):
+        self.name = name
+        self.timer = timer
+        self._fn = fn
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        threading.Thread(target=self._run, name=f'deferred-{name}', daemon=True).start()
+
+    def _run(self):
+        try:
+            self._result = self._fn()
+        except Exception as e:
+            self._error = e
+            print(f"Error starting {self.name} in the background: {e}")
+        finally:
+            self._done.set()
+            if self.timer is not None:
+                self.timer.mark(self.name)
+
+    def ready(self):
+        return self._done.is_set()
+
+    @property
+    def failed(self):
+        return self._done.is_set() and self._error is not None
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} still isn't ready after {timeout}s")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class AssetCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = str(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._writers = []
+
+    def path(self, source_path, size):
+        # The cache entry for a source at a screen size; a new or edited source gets a new entry
+        stat = os.stat(source_path)
+        key = f'{os.path.abspath(source_path)}:{stat.st_size}:{stat.st_mtime_ns}:{size[0]}x{size[1]}'
+        digest = hashlib.sha1(key.encode()).hexdigest()[:CACHE_KEY_LENGTH]
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        return raw_frames.raw_path(os.path.join(self.cache_dir, f'{stem}-{digest}'), size)
+
+    def load(self, source_path, size, display):
+        # The image at source_path scaled to `size`, in the display's format (display must be open)
+        size = tuple(size)
+        cached_path = self.path(source_path, size)
+        surface = raw_frames.load_frame(cached_path)
+        if surface is not None and surface.get_size() == size:
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = pygame.transform.scale(pygame.image.load(source_path).convert(), size)
+        fmt = raw_frames.pixel_format(display)
+        if fmt is not None:
+            writer = threading.Thread(target=self._store, args=(source_path, cached_path, surface, fmt),
+                                      name='asset-cache-writer', daemon=True)
+            writer.start()
+            self._writers.append(writer)
+        return surface
+
+    def wait(self):
+        # Wait for cache entries still being written (e.g. before forking worker processes)
+        while self._writers:
+            self._writers.pop().join()
+
+    def _store(self, source_path, cached_path, surface, fmt):
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        suffix = cached_path[cached_path.rindex('.', 0, len(cached_path) - len('.raw')):]  # .<w>x<h>.raw
+        try:
+            for name in os.listdir(self.cache_dir):
+                # Entries for earlier versions of the source at this size
+                if name.startswith(stem + '-') and name.endswith(suffix) and name != os.path.basename(cached_path):
+                    os.remove(os.path.join(self.cache_dir, name))
+            raw_frames.write_frame(cached_path, surface, fmt)
+        except OSError as e:
+            print(f"Error caching {source_path}: {e}")
+
+    def print_stats(self):
+        print(f"Asset cache: {self.hits} hits, {self.misses} misses")
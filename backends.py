@@ -0,0 +1,242 @@
+import glob
+import os
+import threading
+import time
+
+# Hardware backends for the booth scripts.
+# The 'pi' backend wraps RPi.GPIO, picamera and a fullscreen pygame window.
+# The 'fake' backend replays JPEGs from disk as camera frames, drives button and
+# switch edges from a scripted timeline and renders to SDL's dummy video driver,
+# so the whole pipeline can be run and timed on any Linux box.
+#
+# Pick one with the GIFBOOTH_BACKEND environment variable (default 'pi').
+# The fake camera reads frames from GIFBOOTH_FAKE_FRAMES (default gbooth_temp).
+
+BACKEND_ENV = 'GIFBOOTH_BACKEND'
+FAKE_FRAMES_ENV = 'GIFBOOTH_FAKE_FRAMES'
+DEFAULT_FAKE_FRAMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gbooth_temp')
+
+
+class PiBackend:
+    name = 'pi'
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.gpio = GPIO
+
+    def configure(self):
+        # Called before pygame.init(); the Pi uses the real video and audio drivers
+        pass
+
+    def open_display(self, pygame, size=None, flags=0, vsync=False):
+        if size is None:
+            screen_info = pygame.display.Info()
+            size = (screen_info.current_w, screen_info.current_h)
+        return pygame.display.set_mode(size, pygame.FULLSCREEN | flags, vsync=int(vsync))
+
+    def open_camera(self):
+        from picamera import PiCamera
+        return PiCamera()
+
+
+class FakeGPIO:
+    # Enough of the RPi.GPIO API for the booth scripts, with scriptable pin levels
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self._detects = {}  # pin -> (edge, callback, bouncetime in seconds)
+        self._last_edge = {}
+        self._lock = threading.Lock()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=0):
+        self.levels[pin] = 1 if pull_up_down == self.PUD_UP else initial
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def output(self, pin, value):
+        self.levels[pin] = value
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        self._detects[pin] = (edge, callback, bouncetime / 1000.0)
+
+    def remove_event_detect(self, pin):
+        self._detects.pop(pin, None)
+
+    def cleanup(self):
+        self._detects.clear()
+
+    def set_level(self, pin, level):
+        # Drive a pin and fire its edge callback, as the RPi.GPIO event thread would
+        with self._lock:
+            old = self.levels.get(pin, 0)
+            self.levels[pin] = level
+        if old == level or pin not in self._detects:
+            return
+
+        edge, callback, bouncetime = self._detects[pin]
+        if edge == self.RISING and not level or edge == self.FALLING and level:
+            return
+        now = time.monotonic()
+        if now - self._last_edge.get(pin, -bouncetime) < bouncetime:
+            return
+        self._last_edge[pin] = now
+        if callback is not None:
+            callback(pin)
+
+    def press(self, pin, hold=0.05, chatter=0):
+        # Press and release a button: raise the pin, hold, then drop it again.
+        # With chatter, each change bounces that many times first, like a real contact.
+        self.bounce(pin, 1, chatter)
+        time.sleep(hold)
+        self.bounce(pin, 0, chatter)
+
+    def bounce(self, pin, level, chatter=0, spacing=0.001):
+        for _ in range(chatter):
+            self.set_level(pin, level)
+            time.sleep(spacing)
+            self.set_level(pin, 1 - level)
+            time.sleep(spacing)
+        self.set_level(pin, level)
+
+    def play(self, timeline):
+        # timeline is a list of (seconds from now, pin, level), e.g. a trace recorded by
+        # input_layer.InputLayer and read back with input_layer.load_trace(); returns the player thread
+        def run():
+            start = time.monotonic()
+            for at, pin, level in sorted(timeline, key=lambda event: event[0]):
+                delay = start + at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.set_level(pin, level)
+
+        thread = threading.Thread(target=run, name='fake-gpio-timeline', daemon=True)
+        thread.start()
+        return thread
+
+
+class FakeCamera:
+    # Stands in for PiCamera, handing out JPEGs from a directory in turn
+    def __init__(self, frames_path=DEFAULT_FAKE_FRAMES, capture_delay=0.0):
+        self.frame_paths = sorted(glob.glob(os.path.join(frames_path, '**', '*.jpg'), recursive=True))
+        if not self.frame_paths:
+            raise ValueError(f"No JPEGs to replay in {frames_path}")
+        self.capture_delay = capture_delay
+        self.resolution = None
+        self.iso = 0
+        self.hflip = False
+        self.exposure_speed = 16000  # What the camera's auto exposure has settled on, in microseconds
+        self.shutter_speed = 0
+        self.exposure_mode = 'auto'
+        self.awb_mode = 'auto'
+        self.awb_gains = (1.5, 1.25)
+        self.stall = 0.0  # Seconds the next capture hangs for, to exercise the camera watchdog
+        self.captures = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_frame(self):
+        path = self.frame_paths[self.captures % len(self.frame_paths)]
+        self.captures += 1
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def capture(self, output, format=None, use_video_port=False, **options):
+        if self.closed:
+            raise RuntimeError("Camera is closed")
+        if self.stall:
+            stall, self.stall = self.stall, 0.0
+            time.sleep(stall)
+        if self.capture_delay:
+            time.sleep(self.capture_delay)
+        data = self._next_frame()
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, 'wb') as f:
+                f.write(data)
+        else:
+            output.write(data)
+
+    def capture_sequence(self, outputs, format='jpeg', use_video_port=False, **options):
+        for output in outputs:
+            self.capture(output, format=format, use_video_port=use_video_port)
+
+    def start_preview(self, **options):
+        pass
+
+    def stop_preview(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBackend:
+    name = 'fake'
+
+    def __init__(self, frames_path=None, screen_size=(1920, 1080), capture_delay=0.0):
+        self.gpio = FakeGPIO()
+        self.frames_path = frames_path or os.environ.get(FAKE_FRAMES_ENV, DEFAULT_FAKE_FRAMES)
+        self.screen_size = screen_size
+        self.capture_delay = capture_delay
+        self.camera = None
+
+    def configure(self):
+        # Must run before pygame.init() so SDL picks up the headless drivers
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+    def open_display(self, pygame, size=None, flags=0, vsync=False):
+        if vsync:
+            # There's no refresh to sync to off the Pi (SDL would fall back to a slow software renderer)
+            raise pygame.error("the fake display has no vsync")
+        return pygame.display.set_mode(size or self.screen_size, flags)
+
+    def open_camera(self):
+        self.camera = FakeCamera(self.frames_path, capture_delay=self.capture_delay)
+        return self.camera
+
+
+BACKENDS = {
+    'pi': PiBackend,
+    'fake': FakeBackend,
+}
+
+_backend = None
+
+
+def get_backend(name=None):
+    # Returns the process-wide backend, creating it on first use
+    global _backend
+    if _backend is None:
+        name = name or os.environ.get(BACKEND_ENV, 'pi')
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown backend '{name}', expected one of {', '.join(BACKENDS)}")
+        _backend = BACKENDS[name]()
+        print(f"Using '{name}' backend.")
+    return _backend
+
+
+def set_backend(backend):
+    # Install a backend (e.g. a configured FakeBackend) before a booth script is imported
+    global _backend
+    _backend = backend
+    return backend
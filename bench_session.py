@@ -0,0 +1,294 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+import backends
+import playlist
+from input_layer import load_trace
+
+# End-to-end session benchmark.
+# Imports new_booth_11-5.py on the fake backend with GIFBOOTH_HOME pointing at
+# a scratch directory and presses the button N times. Each stage is timed from
+# the button press, so the report shows where button-to-GIF-ready latency goes.
+#
+#   python bench_session.py --sessions 5
+#   python bench_session.py --disk --json results.json
+#   python bench_session.py --trace edges.json   # replay GPIO edges recorded with GIFBOOTH_INPUT_TRACE
+#   python bench_session.py --view 10            # then 10 s of view mode, reporting playlist stalls
+#   python bench_session.py --mosaic 10          # then 10 s of the mosaic idle screen
+#   python bench_session.py --sessions 8 --press-every 1.5   # back-to-back presses, to load the session queue
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+BOOTH_SCRIPT = os.path.join(REPO_PATH, 'new_booth_11-5.py')
+
+# Booth functions wrapped with a timer, in pipeline order
+STAGES = [
+    'capture_images',
+    'capture_burst',  # The burst itself; capture_burst_images goes on to start playback
+    'capture_image',
+    'create_animated_gif',
+    'simulate_gif',
+    'gif_job_finished',
+    'store_recent_gif',
+    'manage_image_directories',
+]
+
+
+def make_scratch_home():
+    # A throwaway GIFBOOTH_HOME with this checkout's sounds and images and empty storage
+    home = tempfile.mkdtemp(prefix='gifbooth-bench-')
+    for asset in ('click.wav', 'start_images'):
+        os.symlink(os.path.join(REPO_PATH, asset), os.path.join(home, asset))
+    for storage in ('gif_temp', 'gif_recent', 'gif_archive'):
+        os.makedirs(os.path.join(home, storage))
+    return home
+
+
+def load_booth(backend, home):
+    os.environ['GIFBOOTH_HOME'] = home
+    os.environ['GIFBOOTH_GALLERY_PORT'] = '0'
+    os.environ['GIFBOOTH_STAGING'] = os.path.join(home, 'staging')  # Not the machine's /dev/shm
+    backends.set_backend(backend)
+    spec = importlib.util.spec_from_file_location('booth', BOOTH_SCRIPT)
+    booth = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(booth)
+    return booth
+
+
+class SessionTimer:
+    def __init__(self):
+        self.press_time = None
+        self.spans = []  # (stage, start relative to the press, duration), both in seconds
+        self.gif_ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start_session(self):
+        self.press_time = monotonic()
+        self.spans = []
+        self.gif_ready.clear()
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            start = monotonic()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                end = monotonic()
+                with self._lock:
+                    self.spans.append((name, start - self.press_time, end - start))
+                if name == 'gif_job_finished':
+                    self.gif_ready.set()
+        return timed
+
+    def summary(self):
+        # Total time per stage and when the stage finished, relative to the press
+        stages = {}
+        for name, start, duration in self.spans:
+            stage = stages.setdefault(name, {'calls': 0, 'total': 0.0, 'done_at': 0.0})
+            stage['calls'] += 1
+            stage['total'] += duration
+            stage['done_at'] = max(stage['done_at'], start + duration)
+        return stages
+
+
+def run(args):
+    home = make_scratch_home()
+    width, height = (int(v) for v in args.screen.split('x'))
+    backend = backends.FakeBackend(frames_path=args.frames, screen_size=(width, height),
+                                   capture_delay=args.capture_delay)
+
+    if args.mosaic:
+        os.environ['GIFBOOTH_IDLE_SCREEN'] = 'mosaic'
+    if args.effects is not None:
+        os.environ['GIFBOOTH_GIF_EFFECTS'] = args.effects
+    out = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with out:
+        booth = load_booth(backend, home)
+        booth.CAPTURE_IN_MEMORY = not args.disk
+        booth.STREAM_GIF = not args.no_stream
+        if args.high_water is not None:
+            booth.session_queue.high_water = args.high_water
+        if args.loops is not None:
+            booth.NUM_LOOPS_PER_GIF = args.loops
+        if args.view_order:
+            booth.playlist.order = args.view_order
+
+        timer = SessionTimer()
+        for name in STAGES:
+            setattr(booth, name, timer.wrap(name, getattr(booth, name)))
+
+        # Time sessions against a warm camera, as the booth would be once it's been up a moment
+        booth.camera.wait_ready()
+
+        if args.trace:
+            timer.start_session()
+            replay_trace(booth, backend, args.trace)
+            booth.cleanup()
+            return
+        if args.press_every:
+            timer.start_session()
+            press_back_to_back(booth, backend, args.sessions, args.press_every)
+            booth.cleanup()
+            return
+
+        sessions = []
+        for _ in range(args.sessions):
+            timer.start_session()
+            backend.gpio.press(booth.BUTTON_PIN, hold=0.05, chatter=args.chatter)
+            # Run the booth's main loop until this session's playback is over
+            while 'simulate_gif' not in timer.summary() and booth.running:
+                booth.handle_event(booth.pygame.event.wait(100))
+            timer.gif_ready.wait(timeout=120)
+            stages = timer.summary()
+            # The press blocks until playback ends, so take GIF-ready from the callback's own span
+            gif_ready = stages.get('gif_job_finished', {}).get('done_at', monotonic() - timer.press_time)
+            flash = booth.state_machine.flash_latencies[-1] if booth.state_machine.flash_latencies else None
+            sessions.append({'gif_ready': gif_ready, 'first_flash': flash, 'stages': stages})
+            sleep(booth.DEBOUNCE_WINDOW)
+
+        input_stats = booth.input_layer.stats()
+        view_stats = run_view_mode(booth, backend, args.view) if args.view else None
+        mosaic_stats = run_mosaic(booth, args.mosaic) if args.mosaic else None
+        booth.gif_worker.wait()
+        effect_stats = {stage: histogram.sum / histogram.count for stage, histogram in booth.metrics.histograms.items()
+                        if stage.startswith('effect_') or stage == 'encode_gif'}
+        booth.cleanup()
+
+    report(sessions, input_stats, view_stats, mosaic_stats, effect_stats, args)
+
+
+def run_view_mode(booth, backend, seconds):
+    # Flip the switch UP for `seconds` and play the sets just captured
+    player = backend.gpio.play([(0.0, booth.SWITCH_PIN, 1), (seconds, booth.SWITCH_PIN, 0)])
+    while not booth.view_mode_active and player.is_alive():
+        booth.handle_event(booth.pygame.event.wait(100))
+    view_jitter = booth.JitterHistogram('view mode')
+    booth.state_machine.transition(booth.VIEW_MODE)
+    booth.play_recent_sets(view_jitter)
+    booth.state_machine.transition(booth.IDLE)
+    player.join()
+    stats = booth.playlist.stats()
+    stats['frames'] = view_jitter.frames
+    stats['dropped_frames'] = view_jitter.dropped
+    stats['worst_late'] = view_jitter.worst
+    return stats
+
+
+def replay_trace(booth, backend, trace_path):
+    # Feed recorded edges to the booth's main loop and report how the input layer coped
+    timeline = load_trace(trace_path)
+    play_timeline(booth, backend, timeline)
+    with contextlib.redirect_stdout(sys.__stdout__):
+        print(f"Replayed {len(timeline)} edges from {trace_path}")
+        booth.input_layer.print_stats()
+
+
+def press_back_to_back(booth, backend, count, every):
+    # A press every `every` seconds whatever the booth is doing, then wait for the GIFs to catch up
+    timeline = []
+    for i in range(count):
+        # Raise then drop the pin, as FakeGPIO.press() does (the press is the falling edge)
+        timeline += [(i * every, booth.BUTTON_PIN, 1), (i * every + 0.05, booth.BUTTON_PIN, 0)]
+    started = monotonic()
+    play_timeline(booth, backend, timeline)
+    booth.gif_worker.wait()
+    with contextlib.redirect_stdout(sys.__stdout__):
+        print(f"{count} presses {every}s apart, all GIFs done after {monotonic() - started:.1f}s")
+        booth.input_layer.print_stats()
+        booth.session_queue.print_stats()
+
+
+def play_timeline(booth, backend, timeline):
+    player = backend.gpio.play(timeline)
+    quiet_since = monotonic()
+    # Keep going until the trace is over and the booth has been idle with nothing queued for a second
+    while booth.running and (player.is_alive() or monotonic() - quiet_since < 1.0):
+        event = booth.pygame.event.wait(100)
+        if event.type != booth.pygame.NOEVENT or player.is_alive():
+            quiet_since = monotonic()
+        booth.handle_event(event)
+
+
+def run_mosaic(booth, seconds):
+    # Sit on the mosaic idle screen for `seconds`, ticking it as the main loop would
+    booth.display_instruction_image()
+    end = monotonic() + seconds
+    while monotonic() < end and booth.running:
+        booth.wait_for_event()
+    return booth.mosaic.stats()
+
+
+def report(sessions, input_stats, view_stats, mosaic_stats, effect_stats, args):
+    print(f"{len(sessions)} sessions, {'disk' if args.disk else 'in-memory'} capture, screen {args.screen}")
+    print(f"{'stage':<26}{'calls':>6}{'mean ms':>10}{'max ms':>10}{'done at ms':>12}")
+    names = [name for name in STAGES if any(name in s['stages'] for s in sessions)]
+    for name in names:
+        runs = [s['stages'][name] for s in sessions if name in s['stages']]
+        totals = [r['total'] * 1000 for r in runs]
+        done_at = statistics.mean(r['done_at'] for r in runs) * 1000
+        print(f"{name:<26}{runs[0]['calls']:>6}{statistics.mean(totals):>10.1f}{max(totals):>10.1f}{done_at:>12.1f}")
+    ready = [s['gif_ready'] * 1000 for s in sessions]
+    print(f"button to GIF ready: mean {statistics.mean(ready):.1f} ms, max {max(ready):.1f} ms")
+    flashes = [s['first_flash'] * 1000 for s in sessions if s['first_flash'] is not None]
+    if flashes:
+        print(f"button to first flash: mean {statistics.mean(flashes):.1f} ms, max {max(flashes):.1f} ms")
+    if input_stats['presses']:
+        print(f"press to handled: mean {input_stats['latency_mean'] * 1000:.2f} ms, "
+              f"max {input_stats['latency_max'] * 1000:.2f} ms, {input_stats['dropped_presses']} dropped, "
+              f"bounces filtered {input_stats['bounces']}")
+    costs = [f"{stage[len('effect_'):]} {seconds * 1000:.1f} ms"
+             for stage, seconds in effect_stats.items() if stage.startswith('effect_')]
+    if costs:
+        print(f"GIF effects, mean per GIF: {', '.join(costs)} "
+              f"(of {effect_stats.get('encode_gif', 0.0) * 1000:.1f} ms encoding)")
+    if view_stats:
+        print(f"view mode ({view_stats['order']}): {view_stats['played']} sets, {view_stats['frames']} frames, "
+              f"{view_stats['stalls']} stalls ({view_stats['stall_seconds'] * 1000:.1f} ms), "
+              f"{view_stats['dropped_frames']} frames dropped, worst {view_stats['worst_late'] * 1000:.1f} ms late")
+
+    if mosaic_stats:
+        print(f"mosaic: {mosaic_stats['tiles']} tiles, {mosaic_stats['ticks']} ticks, "
+              f"{mosaic_stats['tiles_per_tick']:.1f} tiles and {mosaic_stats['updated_fraction']:.1%} of the screen "
+              f"per tick, draw {mosaic_stats['draw_mean'] * 1000:.2f} ms, "
+              f"{mosaic_stats['thumbnail_mean'] * 1000:.0f} ms to add a set")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'capture': 'disk' if args.disk else 'memory', 'screen': args.screen,
+                       'sessions': sessions, 'input': input_stats, 'view': view_stats,
+                       'mosaic': mosaic_stats, 'effects': effect_stats}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time a full booth session on the fake backend.')
+    parser.add_argument('--sessions', type=int, default=3, help='Number of button presses to time')
+    parser.add_argument('--frames', default=None, help='Directory of JPEGs for the fake camera to replay')
+    parser.add_argument('--screen', default='1920x1080', help='Dummy display size, WIDTHxHEIGHT')
+    parser.add_argument('--capture-delay', type=float, default=0.0, help='Seconds the fake camera takes per shot')
+    parser.add_argument('--disk', action='store_true', help='Capture one file per shot instead of in memory')
+    parser.add_argument('--no-stream', action='store_true', help='Encode GIFs after the burst instead of during it')
+    parser.add_argument('--high-water', type=int, default=None, help='Override SESSION_HIGH_WATER')
+    parser.add_argument('--effects', default=None, help="Override GIF_EFFECTS, e.g. 'grade:warm,boomerang'")
+    parser.add_argument('--loops', type=int, default=None, help='Override NUM_LOOPS_PER_GIF for playback')
+    parser.add_argument('--chatter', type=int, default=0, help='Contact bounces on each edge of every press')
+    parser.add_argument('--press-every', type=float, default=0.0,
+                        help='Press every this many seconds, busy or not, and report the session queue')
+    parser.add_argument('--trace', default=None, help='Replay a recorded GPIO edge trace instead of timed presses')
+    parser.add_argument('--view', type=float, default=0.0, help='Seconds of view mode to play after the sessions')
+    parser.add_argument('--view-order', choices=playlist.ORDERS, default=None, help='Override VIEW_ORDER')
+    parser.add_argument('--mosaic', type=float, default=0.0, help='Seconds of the mosaic idle screen to run after the sessions')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help="Show the booth's own output")
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
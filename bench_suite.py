@@ -0,0 +1,423 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter, time
+
+import numpy as np
+from PIL import Image
+
+import backends
+import config
+import gif_effects
+import gif_encoder
+from bench_session import load_booth, make_scratch_home
+from renderer import Flash, Spinner
+from ring_store import RingStore
+from set_index import SetIndex
+
+# Micro-benchmarks for the capture -> encode -> archive -> playback pipeline.
+# Runs headless on the fake backend and the SDL dummy driver, using synthetic
+# bursts at the camera resolution (config.camera_resolution) and at full screen.
+# Every case reports min/mean/max seconds over --repeat runs and the peak RSS
+# so far; --json writes the lot, and --compare prints the change against an
+# earlier run, so a regression can be pinned to a commit.
+#
+#   python bench_suite.py --json bench-$(git rev-parse --short HEAD).json
+#   python bench_suite.py --only encode --compare bench-abc1234.json
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+BENCHES = ('encode', 'effects', 'surface', 'playback', 'render', 'rotation')
+EFFECT_CASES = ('grade:warm', 'grade:mono', 'logo', 'frame', 'boomerang')  # logo and frame get a synthetic PNG
+ROTATION_SET_COUNTS = (10, 1000, 10000)
+FRAMES_PER_BURST = config.num_photos
+FULL_SCREEN = (config.screen_width, config.screen_height)
+
+
+def synthetic_burst(size, count=FRAMES_PER_BURST, seed=0):
+    # JPEG frames of a gradient background with a block moving across it and
+    # some sensor noise, so both the encoder's palette and its frame deltas have work to do
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    background = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                           np.full_like(x, 128)], axis=-1).astype(np.int16)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        left = (width // 4) + i * width // (4 * count)
+        frame[height // 3:2 * height // 3, left:left + width // 5] = (220, 40, 40)
+        frame += rng.integers(-8, 9, frame.shape, dtype=np.int16)
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=90)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def write_burst(frames, set_dir):
+    os.makedirs(set_dir, exist_ok=True)
+    paths = []
+    for i, data in enumerate(frames):
+        path = os.path.join(set_dir, f'image{i:02d}.jpg')
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux; children covers the GIF worker processes
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / 1024, 1), round(children / 1024, 1)
+
+
+class Suite:
+    def __init__(self, repeat, out=sys.stdout):
+        self.repeat = repeat
+        self.results = []
+        self.out = out  # Results still print while the booth's output is silenced
+
+    def time(self, bench, case, fn, setup=None, repeat=None, **extra):
+        # Run fn() `repeat` times (after setup() each time, untimed) and record the timings
+        timings = []
+        for _ in range(repeat or self.repeat):
+            if setup is not None:
+                setup()
+            start = perf_counter()
+            value = fn()
+            timings.append(perf_counter() - start)
+        if isinstance(value, dict):
+            extra.update(value)
+        return self.record(bench, case, timings, **extra)
+
+    def record(self, bench, case, timings, **extra):
+        rss, children_rss = peak_rss_mb()
+        result = {
+            'bench': bench,
+            'case': case,
+            'runs': len(timings),
+            'min': min(timings),
+            'mean': statistics.mean(timings),
+            'max': max(timings),
+            'peak_rss_mb': rss,
+            'children_peak_rss_mb': children_rss,
+        }
+        result.update(extra)
+        self.results.append(result)
+        print(f"{bench:<10}{case:<44}{result['min'] * 1000:>10.1f}{result['mean'] * 1000:>10.1f}"
+              f"{result['max'] * 1000:>10.1f}{rss:>10.1f}", file=self.out)
+        return result
+
+
+def pillow_encode(frames, optimize):
+    # The booth's original create_animated_gif: Pillow's encoder on the full frames
+    images = [Image.open(io.BytesIO(frame)) for frame in frames]
+    output = io.BytesIO()
+    images[0].save(output, format='GIF', save_all=True, append_images=images[1:], duration=500, loop=0,
+                   optimize=optimize)
+    return {'bytes': output.tell()}
+
+
+def bench_encode(suite, bursts):
+    for label, frames in bursts.items():
+        for optimize in (False, True):
+            suite.time('encode', f'{label} pillow optimize={optimize}', lambda: pillow_encode(frames, optimize))
+        for profile in gif_encoder.PROFILES:
+            def run(profile=profile):
+                stats = gif_encoder.encode(frames, io.BytesIO(), 500, profile)
+                return {'bytes': stats['bytes'], 'size': list(stats['size'])}
+            suite.time('encode', f'{label} gif_encoder {profile}', run)
+
+
+def synthetic_overlays(scratch):
+    # A translucent logo and a border frame, as PNGs with alpha
+    y, x = np.mgrid[0:200, 0:400]
+    logo = np.zeros((200, 400, 4), dtype=np.uint8)
+    logo[((x - 200) / 190) ** 2 + ((y - 100) / 90) ** 2 <= 1] = (255, 200, 0, 200)
+    border = np.zeros((900, 1600, 4), dtype=np.uint8)
+    border[:40], border[-40:], border[:, :40], border[:, -40:] = (255, 255, 255, 255), 255, 255, 255
+    paths = {'logo': os.path.join(scratch, 'logo.png'), 'frame': os.path.join(scratch, 'frame.png')}
+    Image.fromarray(logo).save(paths['logo'])
+    Image.fromarray(border).save(paths['frame'])
+    return paths
+
+
+def bench_effects(suite, bursts, scratch):
+    # What each effect adds to a 'speed' encode, timed by the encoder itself (after a run to build its tables)
+    overlays = synthetic_overlays(scratch)
+    for label, frames in bursts.items():
+        for case in EFFECT_CASES:
+            name = case.partition(':')[0]
+            effects = gif_effects.parse(f'{case}:{overlays[case]}' if case in overlays else case)
+            gif_encoder.encode(frames, io.BytesIO(), 500, 'speed', effects)
+            timings = [gif_encoder.encode(frames, io.BytesIO(), 500, 'speed', effects)['effects'][name]
+                       for _ in range(suite.repeat)]
+            suite.record('effects', f'{label} {case}', timings)
+
+
+def bench_surface(suite, booth, burst_paths):
+    pygame = booth.pygame
+    screen = (booth.screen_width, booth.screen_height)
+    for label, paths in burst_paths.items():
+        def load():
+            return [pygame.image.load(path) for path in paths]
+
+        def load_scale_convert():
+            return [pygame.transform.scale(pygame.image.load(path).convert(), screen) for path in paths]
+
+        def cached():
+            return [booth.frame_cache.get(path, screen) for path in paths]
+
+        suite.time('surface', f'{label} load', load, frames=len(paths))
+        suite.time('surface', f'{label} load+convert+scale', load_scale_convert, frames=len(paths))
+        booth.frame_cache.clear()
+        suite.time('surface', f'{label} frame_cache cold', cached, setup=booth.frame_cache.clear, frames=len(paths))
+        cached()
+        suite.time('surface', f'{label} frame_cache warm', cached, frames=len(paths))
+
+
+class Unpaced:
+    # Stands in for FramePacer so simulate_gif shows frames as fast as the display path allows
+    deadline = None
+
+    def __init__(self, period, policy=None, histogram=None, sleep=None):
+        pass
+
+    def schedule(self, count):
+        return range(count)
+
+
+def bench_playback(suite, booth, burst_paths, loops):
+    # simulate_gif with pacing switched off: how many frames a second the display path sustains
+    screen = (booth.screen_width, booth.screen_height)
+    shown = [0]
+    display_surface = booth.display_surface
+    frame_pacer = booth.FramePacer
+
+    def counting_display_surface(surface, flash=False, deadline=None):
+        shown[0] += 1
+        display_surface(surface, flash, deadline)
+
+    booth.display_surface = counting_display_surface
+    booth.FramePacer = Unpaced
+    booth.NUM_LOOPS_PER_GIF = loops
+    try:
+        for label, paths in burst_paths.items():
+            surfaces = [booth.frame_cache.get(path, screen) for path in paths]
+            for source, args in (('surfaces', (paths, surfaces)), ('files', (paths,))):
+                timings = []
+                for _ in range(suite.repeat):
+                    shown[0] = 0
+                    start = perf_counter()
+                    booth.simulate_gif(*args)
+                    timings.append(perf_counter() - start)
+                suite.record('playback', f'{label} simulate_gif from {source}', timings, frames=shown[0],
+                             fps=round(shown[0] / statistics.mean(timings), 1))
+    finally:
+        booth.display_surface = display_surface
+        booth.FramePacer = frame_pacer
+
+
+def bench_render(suite, booth, burst_paths):
+    # What a present costs: a whole new frame, against only an overlay (spinner, flash fade) changing
+    renderer = booth.renderer
+    screen = (booth.screen_width, booth.screen_height)
+    frame = booth.frame_cache.get(next(iter(burst_paths.values()))[0], screen)
+    frames = 50
+
+    def full():
+        for _ in range(frames):
+            renderer.show(frame)
+            renderer.present()
+
+    def spinner():
+        overlay = renderer.add(Spinner((screen[0] // 2, screen[1] // 2), screen[1] // 30))
+        overlay.changed = lambda now: True  # Redrawn on every present, as if it moved every refresh
+        renderer.show(frame)
+        renderer.present()
+        for _ in range(frames - 1):
+            renderer.present()
+        renderer.remove(overlay)
+
+    def flash():
+        overlay = renderer.flash(60.0)
+        overlay.changed = lambda now: True
+        renderer.show(frame)
+        for _ in range(frames):
+            renderer.present()
+        renderer.remove(overlay)
+
+    for case, fn in (('full-screen frame', full), ('spinner overlay only', spinner), ('flash fade', flash)):
+        suite.time('render', f'{screen[0]}x{screen[1]} {case} x{frames}', fn, frames=frames)
+
+
+def make_sets(sets_path, count):
+    # `count` set directories with one small file each, oldest first by mtime
+    now = time()
+    for i in range(count):
+        set_dir = os.path.join(sets_path, f'set-{i:06d}')
+        os.makedirs(set_dir)
+        with open(os.path.join(set_dir, 'image00.jpg'), 'wb') as f:
+            f.write(b'\xff\xd8\xff\xd9')
+        os.utime(set_dir, (now - count + i, now - count + i))
+
+
+def legacy_rotation(sets_path, keep):
+    # What manage_image_directories used to do: glob, sort by mtime, delete the oldest
+    set_dirs = sorted(Path(sets_path).glob('*/'), key=os.path.getmtime)
+    for old_dir in set_dirs[:-keep]:
+        shutil.rmtree(old_dir)
+
+
+def bench_rotation(suite, scratch, counts, keep=5):
+    for count in counts:
+        sets_path = os.path.join(scratch, f'sets-{count}')
+        manifest_path = os.path.join(scratch, f'sets-{count}.json')
+
+        def fresh():
+            shutil.rmtree(sets_path, ignore_errors=True)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            make_sets(sets_path, count)
+
+        repeat = 1 if count >= 10000 else None
+        suite.time('rotation', f'{count} sets legacy glob+sort+rmtree', lambda: legacy_rotation(sets_path, keep),
+                   setup=fresh, repeat=repeat)
+
+        fresh()
+        suite.time('rotation', f'{count} sets SetIndex scan', lambda: SetIndex(sets_path, manifest_path),
+                   setup=lambda: os.path.exists(manifest_path) and os.remove(manifest_path), repeat=repeat)
+        suite.time('rotation', f'{count} sets SetIndex load manifest', lambda: SetIndex(sets_path, manifest_path))
+
+        # One new session against a full index: add the set, then expire back down to `count`
+        index = SetIndex(sets_path, manifest_path)
+        new_sets = iter(range(10 ** 6))
+
+        def add_and_expire():
+            set_id = f'new-{next(new_sets):06d}'
+            set_dir = os.path.join(sets_path, set_id)
+            os.makedirs(set_dir)
+            index.add_set(set_id, set_dir, [], time())
+            for old_set in index.expire(count):
+                shutil.rmtree(old_set['path'], ignore_errors=True)
+
+        suite.time('rotation', f'{count} sets SetIndex add+expire', add_and_expire)
+        shutil.rmtree(sets_path, ignore_errors=True)
+
+    ring = RingStore(os.path.join(scratch, 'ring'), config.num_photo_sets, 'set{}', first=1)
+    frames = [b'\xff\xd8\xff\xd9'] * FRAMES_PER_BURST
+    suite.time('rotation', f'RingStore push_dir ({config.num_photo_sets} slots)',
+               lambda: ring.push_dir(lambda path: write_burst(frames, path)))
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_PATH, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import pygame
+    return {
+        'commit': commit,
+        'time': time(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'pillow': Image.__version__,
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, previous_path):
+    # Change in mean time for every case present in both runs
+    with open(previous_path) as f:
+        previous = {(r['bench'], r['case']): r for r in json.load(f)['results']}
+    print(f"\nChange in mean against {previous_path}:")
+    for result in results:
+        before = previous.get((result['bench'], result['case']))
+        if before is None or not before['mean']:
+            continue
+        change = (result['mean'] - before['mean']) / before['mean'] * 100
+        flag = '  <-- slower' if change > 10 else ''
+        print(f"{result['bench']:<10}{result['case']:<44}{before['mean'] * 1000:>10.1f}"
+              f"{result['mean'] * 1000:>10.1f}{change:>+9.1f}%{flag}")
+
+
+def run(args):
+    only = set(args.only or BENCHES)
+    scratch = tempfile.mkdtemp(prefix='gifbooth-suite-')
+    suite = Suite(args.repeat, out=sys.stdout)
+    # The booth, SetIndex and friends print as they go; only the results table is shown
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    try:
+        sizes = {'camera': tuple(config.camera_resolution), 'screen': FULL_SCREEN}
+        bursts = {f'{label} {w}x{h}': synthetic_burst((w, h)) for label, (w, h) in sizes.items()}
+        burst_paths = {label: write_burst(frames, os.path.join(scratch, 'bursts', label.replace(' ', '-')))
+                       for label, frames in bursts.items()}
+
+        print(f"{'bench':<10}{'case':<44}{'min ms':>10}{'mean ms':>10}{'max ms':>10}{'rss MB':>10}")
+        with quiet:
+            if 'encode' in only:
+                bench_encode(suite, bursts)
+            if 'effects' in only:
+                bench_effects(suite, bursts, scratch)
+
+            if only & {'surface', 'playback', 'render'}:
+                backend = backends.FakeBackend(frames_path=os.path.dirname(next(iter(burst_paths.values()))[0]),
+                                               screen_size=FULL_SCREEN)
+                home = make_scratch_home()
+                booth = load_booth(backend, home)
+                try:
+                    if 'surface' in only:
+                        bench_surface(suite, booth, burst_paths)
+                    if 'playback' in only:
+                        bench_playback(suite, booth, burst_paths, args.loops)
+                    if 'render' in only:
+                        bench_render(suite, booth, burst_paths)
+                finally:
+                    booth.cleanup()
+                    shutil.rmtree(home, ignore_errors=True)
+
+            if 'rotation' in only:
+                counts = [count for count in ROTATION_SET_COUNTS if count <= args.max_sets]
+                bench_rotation(suite, scratch, counts)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    rss, children_rss = peak_rss_mb()
+    print(f"Peak RSS: {rss:.1f} MB (GIF workers and other children: {children_rss:.1f} MB)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'repeat': args.repeat, 'peak_rss_mb': rss,
+                       'children_peak_rss_mb': children_rss, 'results': suite.results}, f, indent=2)
+        print(f"Results written to {args.json}")
+    if args.compare:
+        compare(suite.results, args.compare)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the booth pipeline stages headless.')
+    parser.add_argument('--only', action='append', choices=BENCHES, help='Bench(es) to run (default all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+    parser.add_argument('--loops', type=int, default=20, help='GIF loops played in the playback bench')
+    parser.add_argument('--max-sets', type=int, default=max(ROTATION_SET_COUNTS),
+                        help='Skip rotation cases with more existing sets than this')
+    parser.add_argument('--json', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='Earlier --json results to compare against')
+    parser.add_argument('--verbose', action='store_true', help="Show the booth's own output")
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
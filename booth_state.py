@@ -0,0 +1,126 @@
+import threading
+import time
+from time import monotonic
+
+import pygame
+
+# Booth state machine.
+# GPIO callbacks run on RPi.GPIO's own thread, so they never touch the display
+# or booth state: the input layer (input_layer.py) queues the debounced edge
+# and posts INPUT_READY. The pygame thread blocks in pygame.event.wait() and
+# makes every state change itself, so an idle booth uses no CPU and presses are
+# picked up as soon as they arrive.
+
+IDLE = 'idle'
+COUNTDOWN = 'countdown'
+CAPTURING = 'capturing'
+PROCESSING = 'processing'
+PLAYBACK = 'playback'
+VIEW_MODE = 'view mode'
+
+TRANSITIONS = {
+    IDLE: {COUNTDOWN, CAPTURING, VIEW_MODE},
+    COUNTDOWN: {CAPTURING, IDLE},
+    CAPTURING: {PROCESSING, IDLE},
+    PROCESSING: {PLAYBACK, IDLE},
+    PLAYBACK: {IDLE},
+    VIEW_MODE: {IDLE},
+}
+
+# Posted from the GPIO thread when the input layer has events queued
+INPUT_READY = pygame.USEREVENT + 1
+
+
+def thread_cpu_clock():
+    # The calling thread's CPU time as a clock any thread can read (metrics are scraped from the
+    # gallery server's threads). Process CPU time would count the GIF, flusher and server threads too.
+    try:
+        clock_id = time.pthread_getcpuclockid(threading.get_ident())
+        time.clock_gettime(clock_id)
+    except (AttributeError, OSError):
+        return time.process_time  # No per-thread clocks on this platform
+    return lambda: time.clock_gettime(clock_id)
+
+
+class BoothStateMachine:
+    # Create it on the pygame thread: CPU time in each state is that thread's
+    def __init__(self):
+        self.state = IDLE
+        self._lock = threading.Lock()
+        self._cpu_time = thread_cpu_clock()
+        self._entered_wall = monotonic()
+        self._entered_cpu = self._cpu_time()
+        self.time_in_state = {state: 0.0 for state in TRANSITIONS}
+        self.cpu_in_state = {state: 0.0 for state in TRANSITIONS}
+        self.press_time = None  # When the press being served was seen by the GPIO thread
+        self.flash_latencies = []
+
+    def post_input_ready(self):
+        # Called from the GPIO thread
+        pygame.event.post(pygame.event.Event(INPUT_READY))
+
+    # Called from the pygame thread
+    def transition(self, new_state):
+        with self._lock:
+            if new_state == self.state:
+                return
+            if new_state not in TRANSITIONS[self.state]:
+                raise ValueError(f"Can't go from {self.state} to {new_state}")
+            now_wall, now_cpu = monotonic(), self._cpu_time()
+            self.time_in_state[self.state] += now_wall - self._entered_wall
+            self.cpu_in_state[self.state] += now_cpu - self._entered_cpu
+            self._entered_wall, self._entered_cpu = now_wall, now_cpu
+            print(f"State: {self.state} -> {new_state}")
+            self.state = new_state
+
+    def is_idle(self):
+        with self._lock:
+            return self.state == IDLE
+
+    def start_session(self, press_time):
+        self.press_time = press_time
+
+    def first_flash(self):
+        # Record button-to-first-flash latency for the session being served
+        if self.press_time is not None:
+            self.flash_latencies.append(monotonic() - self.press_time)
+            self.press_time = None
+
+    def metrics(self):
+        with self._lock:
+            time_in_state = dict(self.time_in_state)
+            cpu_in_state = dict(self.cpu_in_state)
+            time_in_state[self.state] += monotonic() - self._entered_wall
+            cpu_in_state[self.state] += self._cpu_time() - self._entered_cpu
+        idle_wall = time_in_state[IDLE]
+        latencies = self.flash_latencies
+        return {
+            'state': self.state,
+            'idle_cpu_percent': 100.0 * cpu_in_state[IDLE] / idle_wall if idle_wall else 0.0,
+            'time_in_state': time_in_state,
+            'cpu_in_state': cpu_in_state,
+            'button_to_flash_mean': sum(latencies) / len(latencies) if latencies else None,
+            'button_to_flash_max': max(latencies) if latencies else None,
+            'sessions': len(latencies),
+        }
+
+    def register_gauges(self, metrics):
+        # Export the state machine's numbers alongside the stage timings
+        metrics.gauge('gifbooth_idle_cpu_percent', "Main loop CPU use while idle, as a percentage of idle time",
+                      lambda: self.metrics()['idle_cpu_percent'])
+        metrics.gauge('gifbooth_state_seconds', 'Seconds spent in each booth state',
+                      lambda: self.metrics()['time_in_state'], label='state')
+        metrics.gauge('gifbooth_state_cpu_seconds', 'Main loop CPU seconds spent in each booth state',
+                      lambda: self.metrics()['cpu_in_state'], label='state')
+        def button_to_flash():
+            m = self.metrics()
+            return {'mean': m['button_to_flash_mean'] or 0.0, 'max': m['button_to_flash_max'] or 0.0}
+        metrics.gauge('gifbooth_button_to_flash_seconds', 'Mean and max time from a press to the first flash',
+                      button_to_flash, label='stat')
+
+    def print_metrics(self):
+        m = self.metrics()
+        print(f"Idle CPU (main loop): {m['idle_cpu_percent']:.1f}% over {m['time_in_state'][IDLE]:.1f}s idle")
+        if m['sessions']:
+            print(f"Button to first flash: mean {m['button_to_flash_mean'] * 1000:.0f} ms, "
+                  f"max {m['button_to_flash_max'] * 1000:.0f} ms over {m['sessions']} sessions")
@@ -0,0 +1,88 @@
+import io
+import os
+import threading
+
+import pygame
+
+# In-memory burst capture.
+# The whole burst is grabbed from the camera's video port into JPEG buffers.
+# The same buffers feed the on-screen preview, the GIF encoder and, once, the
+# files on disk, so nothing has to be read back from the SD card.
+
+
+class Burst:
+    def __init__(self):
+        self.frames = []  # JPEG bytes, one per shot
+        self.timestamps = []  # monotonic() time each shot finished
+        self.paths = []  # Filled in once the burst has been written to disk
+        self._surfaces = {}
+        self._saved = threading.Event()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def surface(self, index, size):
+        # Decode and scale a frame for the screen, once per frame and size
+        key = (index, tuple(size))
+        if key not in self._surfaces:
+            image = pygame.image.load(io.BytesIO(self.frames[index]), 'frame.jpg').convert()
+            self._surfaces[key] = pygame.transform.scale(image, key[1])
+        return self._surfaces[key]
+
+    def surfaces(self, size):
+        return [self.surface(i, size) for i in range(len(self.frames))]
+
+    def intervals(self):
+        return [b - a for a, b in zip(self.timestamps, self.timestamps[1:])]
+
+    def save(self, set_dir, name_format='image{:02d}.jpg'):
+        # Write every frame to set_dir exactly once
+        os.makedirs(set_dir, exist_ok=True)
+        paths = []
+        for i, data in enumerate(self.frames):
+            path = os.path.join(str(set_dir), name_format.format(i))
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        self.paths = paths
+        self._saved.set()
+        return paths
+
+    def save_in_background(self, set_dir, name_format='image{:02d}.jpg', callback=None):
+        # Persist the burst off the critical path
+        def run():
+            try:
+                paths = self.save(set_dir, name_format)
+                print(f"Saved burst of {len(paths)} frames to {set_dir}")
+                if callback is not None:
+                    callback(self)
+            except OSError as e:
+                print(f"Error saving burst to {set_dir}: {e}")
+                self._saved.set()
+
+        thread = threading.Thread(target=run, name='burst-writer', daemon=True)
+        thread.start()
+        return thread
+
+    def wait_saved(self, timeout=None):
+        return self._saved.wait(timeout)
+
+
+def capture_burst(camera, num_photos, interval, on_frame=None, should_stop=None, histogram=None):
+    # Capture num_photos JPEGs from a camera_service.CameraService, starting one
+    # every `interval` seconds. on_frame(index, burst) is called on this thread
+    # after each shot (play the click, show the preview) while the camera carries
+    # on with the next one, and should_stop() can end the burst early.
+    burst = Burst()
+    frames = camera.burst(num_photos, interval, histogram)
+    try:
+        for i, (frame, captured_at) in enumerate(frames):
+            burst.frames.append(frame)
+            burst.timestamps.append(captured_at)
+            if on_frame is not None:
+                on_frame(i, burst)
+            if should_stop is not None and should_stop():
+                break
+    finally:
+        frames.close()
+    return burst
@@ -0,0 +1,217 @@
+import io
+import queue
+import threading
+from time import monotonic, sleep
+
+from frame_pacer import FramePacer, HOLD
+
+# Long-lived camera for the booth scripts.
+# The camera is opened once, on the service's own thread, given settle_time
+# for auto exposure and white balance to converge and then has both locked, so
+# every shot of every session comes out the same and a burst can start the
+# moment it's asked for. Callers queue work (a burst, a single capture) for
+# the camera thread and read the results back as they arrive.
+#
+# A watchdog thread reopens the camera if a capture has been running for
+# longer than capture_timeout, or if the idle health check fails. A caller
+# waiting on a wedged camera gets a CameraTimeout instead of hanging the booth.
+
+
+class CameraTimeout(Exception):
+    pass
+
+
+class CameraService:
+    def __init__(self, open_camera, resolution=None, iso=None, hflip=False, settle_time=2.0,
+                 capture_timeout=5.0, health_interval=60.0):
+        self.open_camera = open_camera  # Returns a new PiCamera (or stand-in)
+        self.resolution = resolution
+        self.iso = iso
+        self.hflip = hflip
+        self.settle_time = settle_time
+        self.capture_timeout = capture_timeout
+        self.health_interval = health_interval  # Probe an idle camera this often (0 for never)
+        self.camera = None
+        self.ready = threading.Event()
+        self.bursts = 0
+        self.restarts = 0
+        self.burst_latencies = []  # Seconds from asking for a burst to its first frame
+        self._requests = queue.Queue()
+        self._generation = 0
+        self._busy_since = None  # monotonic() time the current request started, None when idle
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._watchdog = None
+        self._thread = None
+
+    def start(self):
+        # Opens and settles the camera in the background; requests queue up until it's ready
+        self._start_thread()
+        self._watchdog = threading.Thread(target=self._watch, name='camera-watchdog', daemon=True)
+        self._watchdog.start()
+        return self
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def _start_thread(self):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        self._thread = threading.Thread(target=self._run, args=(generation,), name=f'camera-{generation}', daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        camera = self.open_camera()
+        if self.resolution is not None:
+            camera.resolution = self.resolution
+        if self.iso is not None:
+            camera.iso = self.iso
+        camera.hflip = self.hflip
+        print(f"Camera opened, letting exposure settle for {self.settle_time:.1f}s...")
+        sleep(self.settle_time)
+        # Freeze what auto exposure and white balance settled on
+        camera.shutter_speed = camera.exposure_speed
+        camera.exposure_mode = 'off'
+        gains = camera.awb_gains
+        camera.awb_mode = 'off'
+        camera.awb_gains = gains
+        print(f"Camera ready: shutter {camera.shutter_speed} us, AWB gains {gains}")
+        return camera
+
+    def _run(self, generation):
+        # The camera thread: the only thread that touches the camera
+        try:
+            camera = self._open()
+        except Exception as e:
+            print(f"Error opening camera: {e}")
+            self._closed.wait(1.0)
+            if generation == self._generation and not self._closed.is_set():
+                self._start_thread()
+            return
+        self.camera = camera
+        self.ready.set()
+
+        while generation == self._generation and not self._closed.is_set():
+            try:
+                request = self._requests.get(timeout=self.health_interval or None)
+            except queue.Empty:
+                request = self._health_check
+            if request is None:
+                break
+            self._busy_since = monotonic()
+            try:
+                request(camera)
+            except Exception as e:
+                print(f"Camera error: {e}")
+            finally:
+                if generation == self._generation:
+                    self._busy_since = None
+        if generation == self._generation:
+            camera.close()
+
+    def _health_check(self, camera):
+        # A single video-port frame; a wedged camera trips the watchdog instead of returning
+        camera.capture(io.BytesIO(), format='jpeg', use_video_port=True)
+
+    def _watch(self):
+        while not self._closed.wait(0.25):
+            busy_since = self._busy_since
+            if busy_since is not None and monotonic() - busy_since > self.capture_timeout:
+                self.restart(f"capture running for {monotonic() - busy_since:.1f}s")
+
+    def restart(self, reason):
+        # Abandon the current camera thread and open the camera again
+        print(f"Restarting camera ({reason})...")
+        self.restarts += 1
+        self.ready.clear()
+        self._busy_since = None
+        camera, self.camera = self.camera, None
+        if camera is not None:
+            # Closing a wedged camera can block too, so don't wait for it
+            threading.Thread(target=self._close_quietly, args=(camera,), daemon=True).start()
+        self._start_thread()
+
+    def _close_quietly(self, camera):
+        try:
+            camera.close()
+        except Exception as e:
+            print(f"Error closing wedged camera: {e}")
+
+    def _call(self, fn):
+        # Run fn(camera) on the camera thread and return its result
+        done = queue.Queue()
+
+        def request(camera):
+            try:
+                done.put((True, fn(camera)))
+            except Exception as e:
+                done.put((False, e))
+                raise
+
+        self._requests.put(request)
+        try:
+            ok, value = done.get(timeout=self.settle_time + self.capture_timeout * 2)
+        except queue.Empty:
+            raise CameraTimeout("Camera did not respond")
+        if not ok:
+            raise value
+        return value
+
+    def capture(self, output, format='jpeg', use_video_port=False):
+        # Same call as PiCamera.capture, run on the warm camera
+        return self._call(lambda camera: camera.capture(output, format=format, use_video_port=use_video_port))
+
+    def burst(self, count, interval, histogram=None):
+        # Generator of (JPEG bytes, monotonic capture time) for `count` shots starting
+        # `interval` apart. Frames are captured on the camera thread while the caller
+        # handles the previous one; close the generator to stop the burst early.
+        frames = queue.Queue()
+        stop = threading.Event()
+        asked_at = monotonic()
+        self.bursts += 1
+
+        def request(camera):
+            def outputs():
+                for _ in FramePacer(interval, HOLD, histogram).schedule(count):
+                    if stop.is_set():
+                        return
+                    stream = io.BytesIO()
+                    yield stream
+                    frames.put((stream.getvalue(), monotonic()))
+                    self._busy_since = monotonic()  # Progress, so the watchdog times each shot
+            try:
+                camera.capture_sequence(outputs(), format='jpeg', use_video_port=True)
+            finally:
+                frames.put(None)
+
+        self._requests.put(request)
+        timeout = (self.settle_time if not self.ready.is_set() else 0) + interval + self.capture_timeout * 2
+        try:
+            for index in range(count):
+                try:
+                    item = frames.get(timeout=timeout)
+                except queue.Empty:
+                    raise CameraTimeout(f"No frame from the camera after {timeout:.1f}s")
+                if item is None:
+                    raise CameraTimeout(f"Burst ended after {index} of {count} frames")
+                if index == 0:
+                    self.burst_latencies.append(item[1] - asked_at)
+                timeout = interval + self.capture_timeout * 2
+                yield item
+        finally:
+            stop.set()
+
+    def print_stats(self):
+        if self.burst_latencies:
+            latencies = self.burst_latencies
+            print(f"Camera: {self.bursts} bursts, first frame after {sum(latencies) / len(latencies) * 1000:.0f} ms "
+                  f"on average (max {max(latencies) * 1000:.0f} ms), {self.restarts} restarts")
+
+    def close(self, timeout=2.0):
+        # Let the camera thread finish what it's doing and release the camera
+        self._requests.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._closed.set()
+        self.ready.clear()
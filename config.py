@@ -1,4 +1,8 @@
 # config.py
+import os
+
+# Install location (override with GIFBOOTH_HOME to run off the Pi)
+gifbooth_home = os.environ.get('GIFBOOTH_HOME', '/home/plevin/gifbooth')
 
 # Camera settings
 camera_resolution = (960, 540)
@@ -9,19 +13,21 @@ screen_width = 1920  # Adjust as per your screen resolution
 screen_height = 1080  # Adjust as per your screen resolution
 
 # Sound and image file locations
-snap_path = '/home/plevin/gifbooth/click.wav'
-processing_image_path = '/home/plevin/gifbooth/start_images/processing.png'
-start_image_path = '/home/plevin/gifbooth/start_images/stooges.jpg'
+snap_path = os.path.join(gifbooth_home, 'click.wav')
+processing_image_path = os.path.join(gifbooth_home, 'start_images/processing.png')
+start_image_path = os.path.join(gifbooth_home, 'start_images/stooges.jpg')
+asset_cache_path = os.path.join(gifbooth_home, 'asset_cache')  # The images above, pre-scaled for the screen
 
 # Image storage settings
-images_path = '/home/plevin/gifbooth/gbooth_temp'  # Ensure this directory exists
-current_photos_path = '/home/plevin/gifbooth/gbooth_temp'
-recent_sets_path = '/home/plevin/gifbooth/gbooth_recent'
-archive_path = '/home/plevin/gifbooth/gbooth_archive'
+images_path = os.path.join(gifbooth_home, 'gbooth_temp')  # Ensure this directory exists
+current_photos_path = os.path.join(gifbooth_home, 'gbooth_temp')
+recent_sets_path = os.path.join(gifbooth_home, 'gbooth_recent')
+archive_path = os.path.join(gifbooth_home, 'gbooth_archive')
 num_images = 5  # Number of images to keep
 
 # Delay Times (in seconds)
 camera_warmup_time = .5    # Time for camera warm-up
+camera_settle_time = 2.0   # Time auto exposure/white balance get when the camera is opened, before being locked
 image_display_time = .25    # Time to display the captured image
 post_capture_delay = .1    # Delay after displaying captured image
 flash_time = 0.1          # Duration of the flash in seconds
@@ -36,3 +42,4 @@ num_loops_per_set = 3      # the number of loops for a set of gifs
 
 # GIF Creation Settings
 gif_frame_duration = 500  # Duration for each frame in the GIF (in milliseconds)
+gif_effects = ''  # Effects chain for the GIF, e.g. 'grade:warm,boomerang' (see gif_effects.py)
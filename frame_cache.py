@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pygame
+
+import raw_frames
+
+# Screen-ready frame cache.
+# Holds decoded, scaled and converted Surfaces keyed by (path, mtime, size) so
+# the same JPEGs aren't decoded and rescaled on every pass of view mode or
+# simulate_gif. Least recently used frames are evicted once the cache goes over
+# its memory budget. The view mode playlist fills it from a prefetch thread,
+# so lookups and evictions are done under a lock. When a JPEG has an up-to-date raw frame next to it (see
+# raw_frames.py) the cache maps that instead; mapped frames live in the page
+# cache rather than in our memory, so they don't count against the budget.
+# They do hold address space and an open mapping each, which a 32-bit Pi runs
+# short of long before an event is over, so they have a budget of their own
+# (mapped_budget_bytes) and are evicted like any other frame once it's used up.
+
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024  # 256 MB of screen-ready surfaces
+DEFAULT_MAPPED_BUDGET_BYTES = 512 * 1024 * 1024  # 512 MB of mapped raw frames (64 frames at 1080p)
+
+
+class FrameCache:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES, mapped_budget_bytes=DEFAULT_MAPPED_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.mapped_budget_bytes = mapped_budget_bytes
+        self.used_bytes = 0
+        self.mapped_bytes = 0  # Size of the mappings held by cached raw frames
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.mapped = 0  # Frames served from raw frame files
+        self._frames = OrderedDict()  # (path, mtime, size) -> (surface, nbytes, mapped bytes)
+        self._lock = threading.Lock()
+
+    def get(self, image_path, size):
+        image_path = os.path.abspath(str(image_path))
+        key = (image_path, os.path.getmtime(image_path), tuple(size))
+
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._frames.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+
+        # Decode outside the lock so a prefetch doesn't hold up the display
+        surface = self._map_raw(image_path, key[1], key[2])
+        if surface is not None:
+            with self._lock:
+                self.mapped += 1
+            self.put(key, surface, nbytes=0, mapped_bytes=surface.get_pitch() * surface.get_height())
+            return surface
+        surface = pygame.transform.scale(pygame.image.load(image_path).convert(), key[2])
+        self.put(key, surface)
+        return surface
+
+    def _map_raw(self, image_path, mtime, size):
+        path = raw_frames.raw_path(image_path, size)
+        try:
+            if os.path.getmtime(path) < mtime:
+                return None  # The JPEG has been replaced since the raw frame was written
+        except OSError:
+            return None
+        return raw_frames.load_frame(path)
+
+    def put(self, key, surface, nbytes=None, mapped_bytes=0):
+        # A mapped raw frame is put with nbytes=0 and the size of its mapping as mapped_bytes
+        if nbytes is None:
+            nbytes = surface.get_bytesize() * surface.get_width() * surface.get_height()
+        if nbytes > self.budget_bytes or mapped_bytes > self.mapped_budget_bytes:
+            return  # Never cache a frame bigger than the whole budget
+
+        with self._lock:
+            self._drop(key)
+            self._frames[key] = (surface, nbytes, mapped_bytes)
+            self.used_bytes += nbytes
+            self.mapped_bytes += mapped_bytes
+
+            while self.used_bytes > self.budget_bytes or self.mapped_bytes > self.mapped_budget_bytes:
+                self._drop(next(iter(self._frames)))  # Least recently used first
+                self.evictions += 1
+
+    def _drop(self, key):
+        # With the lock held. Dropping a mapped frame unmaps it once nothing else is showing it.
+        entry = self._frames.pop(key, None)
+        if entry is not None:
+            self.used_bytes -= entry[1]
+            self.mapped_bytes -= entry[2]
+
+    def invalidate(self, image_path):
+        image_path = os.path.abspath(str(image_path))
+        with self._lock:
+            for key in [k for k in self._frames if k[0] == image_path]:
+                self._drop(key)
+
+    def invalidate_dir(self, dir_path):
+        # Drop every frame stored under dir_path (used when a set is deleted)
+        prefix = os.path.join(os.path.abspath(str(dir_path)), '')
+        with self._lock:
+            for key in [k for k in self._frames if k[0].startswith(prefix)]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.used_bytes = 0
+            self.mapped_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'mapped': self.mapped,
+            'frames': len(self._frames),
+            'used_bytes': self.used_bytes,
+            'budget_bytes': self.budget_bytes,
+            'mapped_bytes': self.mapped_bytes,
+            'mapped_budget_bytes': self.mapped_budget_bytes,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Frame cache: {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.0%} hit rate), "
+              f"{s['frames']} frames, {s['used_bytes'] / 1e6:.1f} of {s['budget_bytes'] / 1e6:.1f} MB, "
+              f"{s['evictions']} evictions, {s['mapped']} mapped from raw frames "
+              f"({s['mapped_bytes'] / 1e6:.1f} of {s['mapped_budget_bytes'] / 1e6:.1f} MB mapped)")
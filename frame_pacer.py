@@ -0,0 +1,80 @@
+from bisect import bisect_left
+from time import monotonic, sleep
+
+# Deadline-based frame pacing.
+# Frame i is due at start + i * period on the monotonic clock, so the time
+# spent loading and drawing a frame comes out of the interval instead of being
+# added to it, and errors don't accumulate from frame to frame. When a frame is
+# more than a whole period late the pacer either drops frames to catch up
+# (playback) or shifts the rest of the schedule back (capture, where every
+# shot matters).
+
+DROP = 'drop'
+HOLD = 'hold'
+
+# Upper edges of the jitter histogram buckets, in milliseconds
+JITTER_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class JitterHistogram:
+    def __init__(self, name=''):
+        self.name = name
+        self.counts = [0] * (len(JITTER_BUCKETS_MS) + 1)
+        self.frames = 0
+        self.dropped = 0
+        self.held = 0
+        self.worst = 0.0
+
+    def record(self, late):
+        late_ms = late * 1000
+        self.counts[bisect_left(JITTER_BUCKETS_MS, late_ms)] += 1
+        self.frames += 1
+        self.worst = max(self.worst, late)
+
+    def buckets(self):
+        labels = [f"<={edge}ms" for edge in JITTER_BUCKETS_MS] + [f">{JITTER_BUCKETS_MS[-1]}ms"]
+        return dict(zip(labels, self.counts))
+
+    def print_summary(self):
+        shown = ", ".join(f"{label}: {count}" for label, count in self.buckets().items() if count)
+        print(f"Frame jitter{' for ' + self.name if self.name else ''}: {self.frames} frames, "
+              f"{self.dropped} dropped, {self.held} held, worst {self.worst * 1000:.1f} ms late ({shown})")
+
+
+class FramePacer:
+    def __init__(self, period, policy=DROP, histogram=None, sleep=sleep):
+        self.period = period
+        self.policy = policy
+        self.histogram = histogram if histogram is not None else JitterHistogram()
+        self.sleep = sleep  # Renderer.sleep keeps overlays animating between frames
+        self.deadline = None  # When the frame just yielded was due
+
+    def schedule(self, count):
+        # Yields frame indices 0..count-1, each once its deadline arrives.
+        # With DROP, indices that are already a period overdue are skipped.
+        start = monotonic()
+        index = 0
+        while index < count:
+            deadline = start + index * self.period
+            now = monotonic()
+            if now < deadline:
+                self.sleep(deadline - now)
+                now = monotonic()
+
+            late = now - deadline
+            if late >= self.period:
+                behind = int(late // self.period)
+                if self.policy == DROP and index + behind < count:
+                    self.histogram.dropped += behind
+                    index += behind
+                    late -= behind * self.period
+                elif self.policy == HOLD:
+                    # Restart the schedule from this frame
+                    self.histogram.held += 1
+                    start += late
+                    late = 0.0
+
+            self.histogram.record(late)
+            self.deadline = now - late
+            yield index
+            index += 1
@@ -0,0 +1,284 @@
+import argparse
+import email.utils
+import hashlib
+import json
+import os
+import re
+import threading
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from ring_store import HEAD_FILE
+
+# Local gallery server for the GIF player.
+# Serves the recent and archived GIFs with strong ETags, Last-Modified and
+# Range support, plus /manifest.json listing the current GIFs newest first.
+# Manifest URLs carry each GIF's ETag as a version, so a display only ever
+# downloads a GIF once and new sessions show up as soon as the manifest changes.
+# When given a metrics.Metrics, the booth's stage timings are served at /metrics.
+# When given an archive_store.ArchiveStore, the archive is listed from its
+# index (newest session first) instead of by scanning the directory.
+#
+#   python gallery_server.py --recent gif_recent --archive gif_archive --port 8000
+#   then open http://localhost:8000/ on each display
+
+PLAYER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gif_player', 'gif_player.html')
+ARCHIVE_MANIFEST_LIMIT = 50  # Newest archive GIFs listed in the manifest
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+class GalleryFiles:
+    # Works out ETags and the manifest, caching both until the files change
+    def __init__(self, recent_path, archive_path, archive=None):
+        self.dirs = {'recent': str(recent_path), 'archive': str(archive_path)}
+        self.archive = archive
+        self._etags = {}  # (path, mtime_ns, size) -> etag
+        self._manifest = (None, None)  # (key, manifest)
+        self._lock = threading.Lock()
+
+    def resolve(self, kind, name):
+        # Only plain file names inside the served directories, never '..' or subdirectories
+        if kind not in self.dirs or not name or name != os.path.basename(name) or name.startswith('.'):
+            return None
+        path = os.path.join(self.dirs[kind], name)
+        return path if os.path.isfile(path) else None
+
+    def etag(self, path, stat=None):
+        stat = stat or os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            etag = self._etags.get(key)
+        if etag is None:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            etag = '"' + digest.hexdigest()[:20] + '"'
+            with self._lock:
+                self._etags[key] = etag
+        return etag
+
+    def _recent_names(self):
+        try:
+            with open(os.path.join(self.dirs['recent'], HEAD_FILE)) as f:
+                return json.load(f)['recent']
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _archive_names(self):
+        if self.archive is not None:
+            # Sessions whose GIFs came out the same share a file; list it once
+            names = [entry['blob'] for entry in self.archive.recent(ARCHIVE_MANIFEST_LIMIT)]
+            return list(dict.fromkeys(names))
+        try:
+            names = [e.name for e in os.scandir(self.dirs['archive']) if e.name.endswith('.gif') and e.is_file()]
+        except OSError:
+            return []
+        return sorted(names, reverse=True)[:ARCHIVE_MANIFEST_LIMIT]
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def manifest(self):
+        # Rebuilt only when ring.json or the archive directory changes
+        key = (self._mtime(os.path.join(self.dirs['recent'], HEAD_FILE)), self._mtime(self.dirs['archive']),
+               self.archive.version if self.archive is not None else None)
+        with self._lock:
+            if self._manifest[0] == key:
+                return self._manifest[1]
+
+        manifest = {}
+        for kind, names in (('recent', self._recent_names()), ('archive', self._archive_names())):
+            entries = []
+            for name in names:
+                path = self.resolve(kind, name)
+                if path is None:
+                    continue
+                etag = self.etag(path)
+                version = etag.strip('"')
+                entries.append({'name': name, 'etag': etag, 'url': f"/{kind}/{name}?v={version}"})
+            manifest[kind] = entries
+        body = json.dumps(manifest).encode()
+        manifest = (body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"')
+        with self._lock:
+            self._manifest = (key, manifest)
+        return manifest
+
+
+class GalleryHandler(SimpleHTTPRequestHandler):
+    files = None  # Set on the server's handler class
+    metrics = None  # Optional metrics.Metrics exported at /metrics
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if url.path in ('/', '/index.html'):
+            self.send_file(PLAYER_PATH, 'text/html; charset=utf-8', head, cache='no-cache')
+        elif url.path == '/manifest.json':
+            body, etag = self.files.manifest()
+            self.send_bytes(body, 'application/json', etag, head)
+        elif url.path == '/metrics' and self.metrics is not None:
+            self.send_text(self.metrics.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8', head)
+        elif len(parts) == 2 and parts[0] in ('recent', 'recent_gifs', 'archive'):
+            kind = 'archive' if parts[0] == 'archive' else 'recent'
+            path = self.files.resolve(kind, parts[1])
+            if path is None:
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+            self.send_file(path, 'image/gif', head, version=parse_qs(url.query).get('v', [None])[0])
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def not_modified(self, etag, mtime=None):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and mtime is not None:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_bytes(self, body, content_type, etag, head):
+        if self.not_modified(etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_text(self, text, content_type, head):
+        body = text.encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_file(self, path, content_type, head, cache=None, version=None):
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            etag = self.files.etag(path, stat) if self.files else None
+            if cache is None:
+                # A URL carrying the current ETag never changes, so it can be cached for good
+                immutable = version is not None and etag == f'"{version}"'
+                cache = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+
+            if etag and self.not_modified(etag, stat.st_mtime):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', cache)
+                self.end_headers()
+                return
+
+            start, end = 0, stat.st_size - 1
+            status = HTTPStatus.OK
+            byte_range = self.requested_range(stat.st_size, etag)
+            if byte_range == 'invalid':
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', f'bytes */{stat.st_size}')
+                self.end_headers()
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                status = HTTPStatus.PARTIAL_CONTENT
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Cache-Control', cache)
+            if etag:
+                self.send_header('ETag', etag)
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{stat.st_size}')
+            self.end_headers()
+            if head:
+                return
+
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1 << 16))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def requested_range(self, size, etag):
+        # (start, end) for a single satisfiable byte range, None for the whole file
+        header = self.headers.get('Range')
+        if not header or size == 0:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() != etag:
+            return None
+        match = RANGE_PATTERN.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None  # Multiple or malformed ranges: send the whole file
+        first, last = match.groups()
+        if first == '':
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return 'invalid'
+        return start, end
+
+    def log_message(self, format, *args):
+        pass  # The booth's own prints are noisy enough
+
+
+def start_gallery_server(recent_path, archive_path, port=8000, host='', metrics=None, archive=None):
+    # Serve the gallery from a background thread; call .shutdown() on the result to stop it
+    handler = type('BoothGalleryHandler', (GalleryHandler,),
+                   {'files': GalleryFiles(recent_path, archive_path, archive), 'metrics': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='gallery-server', daemon=True)
+    thread.start()
+    print(f"Gallery server listening on http://{host or 'localhost'}:{server.server_address[1]}/")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the recent and archived GIFs to the GIF player.')
+    parser.add_argument('--recent', required=True, help='Directory holding the recent GIF ring')
+    parser.add_argument('--archive', required=True, help='Directory holding archived GIFs')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--host', default='')
+    args = parser.parse_args()
+
+    server = start_gallery_server(args.recent, args.archive, args.port, args.host)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import os
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+# GIF effects stage.
+# Runs between capture and encoding on the burst as one (n, h, w, 3) NumPy
+# stack, after gif_encoder has shrunk it to the GIF's size, so every effect
+# costs what it costs at output resolution rather than at camera resolution.
+#
+#   grade:LOOK     colour look from LOOKS, as a lookup table per channel
+#   logo:PATH      a PNG with alpha in the bottom right corner
+#   frame:PATH     a PNG with alpha stretched over the whole frame (a border)
+#   boomerang      play forward then back again, without the end frames twice
+#
+# A chain is written as a comma-separated spec, e.g.
+# 'grade:warm,logo:/home/pi/logo.png,boomerang', and effects run in that order.
+# Lookup tables are built once per chain. An overlay's scaled, premultiplied
+# image and alpha mask are built once per output size, cut down to the tiles
+# that aren't transparent, and blended into the whole burst at once. Boomerang
+# doesn't copy frames: the encoder replays frames it has already quantised.
+#
+# get() keeps one chain per spec for the life of the process, so each GIF
+# worker only builds its tables and masks the first time.
+
+
+def curve(gain=1.0, lift=0, top=255, contrast=0.0):
+    # A 256-entry tone curve: an S-curve of `contrast` (0..1), scaled by gain, mapped onto lift..top
+    x = np.arange(256) / 255.0
+    x = (1 - contrast) * x + contrast * (0.5 - 0.5 * np.cos(np.pi * x))
+    return np.round(lift + (top - lift) * np.clip(x * gain, 0, 1)).astype(np.uint8)
+
+
+LOOKS = {
+    # (red, green, blue) curves
+    'warm': (curve(gain=1.08), curve(gain=1.02), curve(gain=0.9)),
+    'cool': (curve(gain=0.92), curve(), curve(gain=1.08)),
+    'fade': (curve(lift=24, top=235),) * 3,
+    'punch': (curve(contrast=0.5),) * 3,
+    # Mono looks apply the first curve to the luma
+    'mono': (curve(contrast=0.3),) * 3,
+}
+MONO_LOOKS = {'mono'}
+LUMA_WEIGHTS = (77, 150, 29)  # Rec. 601 luma in 1/256ths
+LOGO_WIDTH = 0.25  # Fraction of the frame width a logo is scaled to
+LOGO_MARGIN = 0.03  # Fraction of the frame width between a logo and the edges
+OVERLAY_TILE = 32  # Pixels; an overlay is only blended in the tiles where it isn't transparent
+
+
+class Grade:
+    def __init__(self, look):
+        if look not in LOOKS:
+            raise ValueError(f"Unknown look '{look}', expected one of {', '.join(LOOKS)}")
+        self.name = 'grade'
+        self.look = look
+        self.luts = np.stack(LOOKS[look])
+        self.mono = look in MONO_LOOKS
+
+    def apply(self, frames):
+        # In place on an (n, h, w, 3) uint8 stack
+        if self.mono:
+            luma = np.multiply(frames[..., 0], LUMA_WEIGHTS[0], dtype=np.uint16)
+            for channel in (1, 2):
+                luma += np.multiply(frames[..., channel], LUMA_WEIGHTS[channel], dtype=np.uint16)
+            luma >>= 8
+            frames[:] = self.luts[0][luma][..., np.newaxis]
+            return
+        for channel in range(3):
+            np.take(self.luts[channel], frames[..., channel], out=frames[..., channel])
+
+
+class Overlay:
+    def __init__(self, path, placement):
+        self.name = placement
+        self.path = path
+        self.placement = placement  # 'logo' or 'frame'
+        with Image.open(path) as image:
+            self.image = image.convert('RGBA')
+        self._cache = {}  # (width, height) -> [(region slices, premultiplied RGB, inverse alpha)]
+
+    def _prepare(self, size):
+        # Scale the overlay for frames of `size` and cut it into the regions where it isn't transparent
+        width, height = size
+        if self.placement == 'frame':
+            scaled_size, origin = size, (0, 0)
+        else:
+            logo_width = max(1, int(width * LOGO_WIDTH))
+            scaled_size = (logo_width, max(1, logo_width * self.image.height // self.image.width))
+            margin = int(width * LOGO_MARGIN)
+            origin = (max(0, width - scaled_size[0] - margin), max(0, height - scaled_size[1] - margin))
+        rgba = np.asarray(self.image.resize(scaled_size, Image.Resampling.LANCZOS))
+        rgba = rgba[:height - origin[1], :width - origin[0]]  # A logo bigger than the frame is cut off
+
+        # Runs of tiles with some alpha, band by band: a border is mostly see-through in the middle
+        regions = []
+        tile = OVERLAY_TILE
+        for top in range(0, rgba.shape[0], tile):
+            band = rgba[top:top + tile]
+            used = [band[:, left:left + tile, 3].any() for left in range(0, band.shape[1], tile)]
+            start = None
+            for index, tile_used in enumerate(used + [False]):
+                if tile_used and start is None:
+                    start = index
+                elif not tile_used and start is not None:
+                    part = band[:, start * tile:index * tile]
+                    alpha = part[..., 3:].astype(np.uint16)
+                    premultiplied = part[..., :3] * alpha + 127  # Rounds the divide by 255 in apply()
+                    y, x = origin[1] + top, origin[0] + start * tile
+                    regions.append(((slice(y, y + part.shape[0]), slice(x, x + part.shape[1])),
+                                    premultiplied, 255 - alpha))
+                    start = None
+        return regions
+
+    def apply(self, frames):
+        size = (frames.shape[2], frames.shape[1])
+        if size not in self._cache:
+            self._cache[size] = self._prepare(size)
+        for (rows, cols), premultiplied, inverse_alpha in self._cache[size]:
+            under = frames[:, rows, cols]
+            blended = under * inverse_alpha  # uint16: at most 255 * 255, plus premultiplied below
+            blended += premultiplied
+            blended //= 255
+            under[:] = blended
+
+
+class Boomerang:
+    def __init__(self):
+        self.name = 'boomerang'
+
+    def apply(self, frames):
+        pass
+
+    def order(self, count):
+        # Forward, then back without repeating either end: 0 1 2 3 4 3 2 1
+        return list(range(count)) + list(range(count - 2, 0, -1))
+
+
+class Effects:
+    def __init__(self, effects=()):
+        self.effects = list(effects)
+
+    def __bool__(self):
+        return bool(self.effects)
+
+    @property
+    def boomerang(self):
+        return any(isinstance(effect, Boomerang) for effect in self.effects)
+
+    def apply(self, frames):
+        # Run each effect in place on an (n, h, w, 3) stack; returns {effect name: seconds}
+        timings = {}
+        for effect in self.effects:
+            start = perf_counter()
+            effect.apply(frames)
+            timings[effect.name] = timings.get(effect.name, 0.0) + perf_counter() - start
+        return timings
+
+    def order(self, count):
+        # The order to encode `count` frames in; indices can repeat, so frames are reused, not copied
+        order = list(range(count))
+        for effect in self.effects:
+            if isinstance(effect, Boomerang):
+                order = [order[i] for i in effect.order(len(order))]
+        return order
+
+
+def parse(spec):
+    # An Effects chain from a spec like 'grade:warm,logo:/path/logo.png,boomerang' ('' for none)
+    effects = []
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, arg = item.partition(':')
+        if name == 'grade':
+            effects.append(Grade(arg))
+        elif name in ('logo', 'frame'):
+            if not os.path.isfile(arg):
+                raise ValueError(f"No overlay image at '{arg}' for {name}")
+            effects.append(Overlay(arg, name))
+        elif name == 'boomerang':
+            effects.append(Boomerang())
+        else:
+            raise ValueError(f"Unknown effect '{name}', expected grade, logo, frame or boomerang")
+    return Effects(effects)
+
+
+_chains = {}
+
+
+def get(spec):
+    # The process's chain for `spec`, so its tables and masks are only built once
+    if spec not in _chains:
+        _chains[spec] = parse(spec)
+    return _chains[spec]
@@ -0,0 +1,270 @@
+import argparse
+import glob
+import io
+import os
+import struct
+from time import perf_counter
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+# Fast GIF encoder for photobooth bursts.
+# The whole burst is downscaled in one NumPy operation and quantised against a
+# single palette built from every frame. After the first frame, only the
+# pixels that changed are stored (cropped to the changed area, everything else
+# transparent), which suits a burst that is mostly static background.
+#
+# StreamingEncoder does the same one frame at a time, as the frames are
+# captured: the palette comes from the first frame and each frame's block is
+# written out as soon as it arrives, so only the current frame and the canvas
+# are held in memory and the GIF is complete as soon as the last frame is in.
+#
+# Both take an optional gif_effects.Effects chain, run on the shrunk frames
+# before the palette is built; its cost per effect is in the returned stats.
+#
+#   python gif_encoder.py gbooth_recent/set1     # compare the profiles on a set
+
+PROFILES = {
+    # Smallest encode time: coarse palette sampling, no dithering
+    'speed': {'max_width': 480, 'colors': 128, 'dither': False, 'threshold': 12, 'palette_sample': 4},
+    # Smallest file: fewer colours and a looser "unchanged" threshold
+    'size': {'max_width': 480, 'colors': 64, 'dither': False, 'threshold': 20, 'palette_sample': 2},
+    # Cheapest of all, for when sessions are queueing up: small, few colours, coarse sampling
+    'lite': {'max_width': 320, 'colors': 48, 'dither': False, 'threshold': 24, 'palette_sample': 8},
+    # Best looking: camera resolution, full palette, dithered
+    'quality': {'max_width': 960, 'colors': 256, 'dither': True, 'threshold': 4, 'palette_sample': 1},
+}
+DEFAULT_PROFILE = 'speed'
+
+
+def load_frame(frame, max_width=None):
+    # Frames can be file paths, JPEG bytes, PIL images or RGB arrays. With
+    # max_width, JPEGs are decoded at the smallest DCT scale still that wide.
+    if isinstance(frame, np.ndarray):
+        return frame
+    if isinstance(frame, bytes):
+        frame = io.BytesIO(frame)
+    if not isinstance(frame, Image.Image):
+        with Image.open(frame) as image:
+            if max_width:
+                image.draft('RGB', (max_width, max_width * image.height // image.width))
+            return np.asarray(image.convert('RGB'))
+    return np.asarray(frame.convert('RGB'))
+
+
+def downscale(frames, max_width):
+    # Box-filter an (n, h, w, 3) stack by the smallest integer factor that fits max_width
+    n, height, width, _ = frames.shape
+    factor = -(-width // max_width)
+    if factor <= 1:
+        return frames
+    height, width = height // factor * factor, width // factor * factor
+    blocks = frames[:, :height, :width].reshape(n, height // factor, factor, width // factor, factor, 3)
+    return (blocks.sum(axis=(2, 4), dtype=np.uint32) // (factor * factor)).astype(np.uint8)
+
+
+def build_palette(frames, colors, sample=1):
+    # One palette for the whole burst, leaving a slot free for the transparent index
+    sampled = frames[:, ::sample, ::sample]
+    strip = np.ascontiguousarray(sampled.reshape(-1, sampled.shape[2], 3))  # frames stacked vertically
+    colors = min(colors, 256) - 1
+    palette_image = Image.fromarray(strip).quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+    # Keep every entry quantize() can map to, duplicates included (palette.colors drops them)
+    palette = palette_image.getpalette()[:3 * colors]
+    return palette_image, np.array(palette, dtype=np.uint8).reshape(-1, 3)
+
+
+def quantize(frame, palette_image, dither):
+    image = Image.fromarray(frame).quantize(
+        palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    return np.asarray(image)
+
+
+def gif_header(width, height, palette, loop=0):
+    # Logical screen descriptor with the shared palette, plus the looping extension
+    bits = max(1, int(np.ceil(np.log2(len(palette)))))
+    table = np.zeros((1 << bits, 3), dtype=np.uint8)
+    table[:len(palette)] = palette
+    return (b'GIF89a' + struct.pack('<HHBBB', width, height, 0x80 | (bits - 1), 0, 0) + table.tobytes()
+            + b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+
+def frame_block(indices, offset, transparency, duration):
+    # Graphic control extension, image descriptor and LZW data for one frame
+    image = Image.fromarray(indices, mode='P')
+    params = {'duration': duration, 'disposal': 1}
+    if transparency is not None:
+        params['transparency'] = transparency
+    return b''.join(GifImagePlugin.getdata(image, offset=offset, **params))
+
+
+class DeltaFrames:
+    # Tracks what the viewer currently shows and turns each new frame into a
+    # cropped block holding only the pixels that changed.
+    def __init__(self, palette, threshold):
+        self.palette = palette.astype(np.int16)
+        self.threshold = threshold
+        self.transparency = len(palette)
+        self.canvas = None
+
+    def next_block(self, rgb, indices):
+        # Returns (block, offset, transparency index or None)
+        if self.canvas is None:
+            self.canvas = indices.copy()
+            return indices, (0, 0), None
+
+        shown = self.palette[self.canvas]
+        changed = np.abs(rgb.astype(np.int16) - shown).max(axis=2) > self.threshold
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not len(rows):
+            # Nothing changed: a single transparent pixel keeps the frame's timing
+            return np.full((1, 1), self.transparency, dtype=np.uint8), (0, 0), self.transparency
+        cols = np.flatnonzero(changed.any(axis=0))
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+        self.canvas[changed] = indices[changed]
+        block = np.where(changed[top:bottom, left:right], indices[top:bottom, left:right], self.transparency)
+        return block.astype(np.uint8), (int(left), int(top)), self.transparency
+
+
+def encode(frames, output, duration, profile=DEFAULT_PROFILE, effects=None):
+    # Encode frames to output (a path or file object); returns timing and size stats
+    settings = PROFILES[profile]
+    start = perf_counter()
+
+    rgb = np.stack([load_frame(frame, settings['max_width']) for frame in frames])
+    rgb = downscale(rgb, settings['max_width'])
+    timings = effects.apply(rgb) if effects else {}  # In place: the stack is always a new array
+    palette_image, palette = build_palette(rgb, settings['colors'], settings['palette_sample'])
+    delta = DeltaFrames(palette, settings['threshold'])
+
+    blocks = [gif_header(rgb.shape[2], rgb.shape[1], np.vstack([palette, [[0, 0, 0]]]))]
+    quantized = {}  # Frame index -> palette indices; frames replayed by an effect are only quantised once
+    for position, index in enumerate(effects.order(len(rgb)) if effects else range(len(rgb))):
+        block_start = perf_counter()
+        if index not in quantized:
+            quantized[index] = quantize(rgb[index], palette_image, settings['dither'])
+        blocks.append(frame_block(*delta.next_block(rgb[index], quantized[index]), duration))
+        if position >= len(rgb):
+            timings['boomerang'] = timings.get('boomerang', 0.0) + perf_counter() - block_start
+    blocks.append(b';')
+    data = b''.join(blocks)
+
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'wb') as f:
+            f.write(data)
+    else:
+        output.write(data)
+
+    return {
+        'profile': profile,
+        'seconds': perf_counter() - start,
+        'bytes': len(data),
+        'frames': len(blocks) - 2,
+        'size': (rgb.shape[2], rgb.shape[1]),
+        'effects': timings,
+    }
+
+
+class StreamingEncoder:
+    def __init__(self, output, duration, profile=DEFAULT_PROFILE, loop=0, effects=None):
+        # output is a binary file object; blocks are written to it as frames are added
+        self.output = output
+        self.duration = duration
+        self.profile = profile
+        self.settings = PROFILES[profile]
+        self.frames = 0
+        self.bytes = 0
+        self.seconds = 0.0  # Encoding time, not counting the waits between frames
+        self.size = None
+        self.loop = loop
+        self.effects = effects
+        self.timings = {}  # Seconds spent in each effect
+        self._palette_image = None
+        self._delta = None
+        self._kept = []  # (rgb, indices) per frame, when an effect replays frames at the end
+
+    def _write(self, data):
+        self.output.write(data)
+        self.bytes += len(data)
+
+    def add(self, frame):
+        # Encode one frame (path, JPEG bytes, PIL image or RGB array) and write its block
+        start = perf_counter()
+        rgb = downscale(load_frame(frame, self.settings['max_width'])[np.newaxis], self.settings['max_width'])
+        if self.effects:
+            if rgb.base is not None or not rgb.flags.writeable:
+                rgb = rgb.copy()  # Effects work in place; don't write into the caller's array
+            for name, seconds in self.effects.apply(rgb).items():
+                self.timings[name] = self.timings.get(name, 0.0) + seconds
+        rgb = rgb[0]
+        if self._delta is None:
+            # The first frame sets the palette and the size for the whole GIF
+            self._palette_image, palette = build_palette(
+                rgb[np.newaxis], self.settings['colors'], self.settings['palette_sample'])
+            self._delta = DeltaFrames(palette, self.settings['threshold'])
+            self.size = (rgb.shape[1], rgb.shape[0])
+            self._write(gif_header(self.size[0], self.size[1], np.vstack([palette, [[0, 0, 0]]]), self.loop))
+        elif (rgb.shape[1], rgb.shape[0]) != self.size:
+            raise ValueError(f"Frame {self.frames} is {rgb.shape[1]}x{rgb.shape[0]}, expected {self.size[0]}x{self.size[1]}")
+
+        indices = quantize(rgb, self._palette_image, self.settings['dither'])
+        self._write(frame_block(*self._delta.next_block(rgb, indices), self.duration))
+        self.output.flush()
+        if self.effects and self.effects.boomerang:
+            self._kept.append((rgb, indices))
+        self.frames += 1
+        self.seconds += perf_counter() - start
+
+    def finish(self):
+        # Write any replayed frames and the trailer; returns the same stats as encode()
+        if not self.frames:
+            raise ValueError("No frames were added")
+        if self._kept:
+            start = perf_counter()
+            for index in self.effects.order(len(self._kept))[len(self._kept):]:
+                self._write(frame_block(*self._delta.next_block(*self._kept[index]), self.duration))
+            self.timings['boomerang'] = perf_counter() - start
+            self.seconds += self.timings['boomerang']
+            self.frames += len(self.effects.order(len(self._kept))) - len(self._kept)
+            self._kept = []
+        self._write(b';')
+        self.output.flush()
+        return {
+            'profile': self.profile,
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'size': self.size,
+            'effects': self.timings,
+        }
+
+
+def compare_profiles(frames, duration=500, profiles=None, effects=None):
+    # Encode the same burst with each profile and print time and size for each
+    results = []
+    for profile in profiles or PROFILES:
+        result = encode(frames, io.BytesIO(), duration, profile, effects)
+        results.append(result)
+        costs = ''.join(f"  {name} {seconds * 1000:.1f} ms" for name, seconds in result['effects'].items())
+        print(f"{profile:<8} {result['size'][0]}x{result['size'][1]}  "
+              f"{result['seconds'] * 1000:8.1f} ms  {result['bytes'] / 1024:8.1f} KB{costs}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare GIF encoder profiles on a set of JPEGs.')
+    parser.add_argument('set_dir', help='Directory holding one burst of JPEGs')
+    parser.add_argument('--duration', type=int, default=500, help='Frame duration in milliseconds')
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES), help='Profile(s) to run')
+    parser.add_argument('--effects', default='', help="Effects chain, e.g. 'grade:warm,boomerang' (see gif_effects)")
+    args = parser.parse_args()
+
+    import gif_effects
+    frames = sorted(glob.glob(os.path.join(args.set_dir, '*.jpg')))
+    print(f"{len(frames)} frames from {args.set_dir}")
+    compare_profiles(frames, args.duration, args.profile, gif_effects.parse(args.effects))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from time import perf_counter
+
+import gif_effects
+import gif_encoder
+
+# Background GIF encoding.
+# Pillow encoding and archiving run in a pool of worker processes so they use
+# the Pi's other cores and never block the button callback. Every file is
+# written under a '.part' name and renamed into place, so an interrupted job
+# never leaves a half-written GIF behind.
+#
+# A GifStream instead encodes a burst while it is still being captured: frames
+# are handed over one at a time and encoded on a background thread in the
+# gaps between shots, so the GIF is ready just after the last shot.
+#
+# Effects (see gif_effects) are passed as a spec string, so they can be sent to
+# a worker process; each process builds a chain once and keeps it.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+PART_SUFFIX = '.part'
+
+
+def write_atomically(path, write):
+    # Call write(part_path) and rename the result over path once it's complete
+    part_path = str(path) + PART_SUFFIX
+    try:
+        write(part_path)
+        os.replace(part_path, str(path))
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def encode_gif(image_paths, output_path, duration, archive_path=None, profile=gif_encoder.DEFAULT_PROFILE,
+               effects=''):
+    # Runs in a worker process: encode the frames (file paths or in-memory JPEG
+    # bytes) and copy the result to the archive. Returns the encoder's stats.
+    stats = {}
+    write_atomically(output_path, lambda part: stats.update(
+        gif_encoder.encode(image_paths, part, duration, profile, gif_effects.get(effects))))
+
+    if archive_path:
+        write_atomically(archive_path, lambda part: shutil.copy(output_path, part))
+
+    return stats
+
+
+def worker_ready():
+    # Runs in a worker process; submitted once at startup so every worker is forked straight away
+    return os.getpid()
+
+
+class GifJob:
+    def __init__(self, job_id, image_paths, output_path, archive_path):
+        self.job_id = job_id
+        self.image_paths = list(image_paths)
+        self.output_path = output_path
+        self.archive_path = archive_path
+        self.result = None
+        self.stats = None
+        self.error = None
+        self.future = None
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return FAILED
+        if self.future.running():
+            return RUNNING
+        if not self.future.done():
+            return QUEUED
+        return FAILED if self.error is not None else DONE
+
+
+class GifStreamAborted(Exception):
+    pass
+
+
+_FINISH = object()
+_ABORT = object()
+
+
+class GifStream(GifJob):
+    # A GifJob whose frames arrive one by one; call add() per frame, then finish() or abort()
+    def __init__(self, job_id, output_path, archive_path, duration, profile, effects=''):
+        super().__init__(job_id, [], output_path, archive_path)
+        self.duration = duration
+        self.profile = profile
+        self.effects = effects
+        self.future = Future()
+        self._frames = queue.Queue()
+        self._finish_time = None
+        self._thread = threading.Thread(target=self._run, name=f'gif-stream-{job_id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, frame):
+        self._frames.put(frame)
+
+    def finish(self):
+        self._finish_time = perf_counter()
+        self._frames.put(_FINISH)
+
+    def abort(self):
+        self._frames.put(_ABORT)
+
+    def _run(self):
+        self.future.set_running_or_notify_cancel()
+        stats = {}
+
+        def encode(part_path):
+            with open(part_path, 'wb') as f:
+                encoder = gif_encoder.StreamingEncoder(f, self.duration, self.profile,
+                                                       effects=gif_effects.get(self.effects))
+                while True:
+                    frame = self._frames.get()
+                    if frame is _ABORT:
+                        raise GifStreamAborted(f"Burst for {self.output_path} was abandoned")
+                    if frame is _FINISH:
+                        break
+                    encoder.add(frame)
+                stats.update(encoder.finish())
+
+        try:
+            write_atomically(self.output_path, encode)
+            if self.archive_path:
+                write_atomically(self.archive_path, lambda part: shutil.copy(self.output_path, part))
+            # How long the GIF took to be ready once the last frame was in
+            stats['tail_seconds'] = perf_counter() - self._finish_time
+            self.future.set_result(stats)
+        except BaseException as e:
+            self.future.set_exception(e)
+
+
+class GifWorker:
+    def __init__(self, max_workers=None):
+        # Fork rather than spawn: spawning would re-run the booth script (and
+        # re-open the camera and display) in every worker. A forked process only
+        # gets the forking thread, so a lock another thread held at the time
+        # (stdio, PIL, SDL) stays held in the child for good: create the
+        # GifWorker before the script starts any threads. The pool only forks
+        # its workers on the first submit, so one is made (and waited for) here.
+        self._executor = ProcessPoolExecutor(max_workers=max_workers,
+                                             mp_context=multiprocessing.get_context('fork'))
+        self._executor.submit(worker_ready).result()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.jobs = {}  # Jobs not yet finished (including any whose callback is still running), by id
+
+    def submit(self, image_paths, output_path, duration, archive_path=None, callback=None,
+               profile=gif_encoder.DEFAULT_PROFILE, effects=''):
+        job = GifJob(next(self._ids), image_paths, output_path, archive_path)
+        print(f"Queueing GIF job {job.job_id} for {output_path} ({profile} profile)...")
+        job.future = self._executor.submit(encode_gif, job.image_paths, output_path, duration,
+                                           archive_path, profile, effects)
+        with self._lock:
+            self.jobs[job.job_id] = job
+        job.future.add_done_callback(lambda future: self._finish(job, future, callback))
+        return job
+
+    def stream(self, output_path, duration, archive_path=None, callback=None, profile=gif_encoder.DEFAULT_PROFILE,
+               effects=''):
+        # Start a GifStream; it encodes on its own thread rather than in the process pool
+        job = GifStream(next(self._ids), output_path, archive_path, duration, profile, effects)
+        print(f"Streaming GIF job {job.job_id} to {output_path} ({profile} profile)...")
+        with self._lock:
+            self.jobs[job.job_id] = job
+        job.future.add_done_callback(lambda future: self._finish(job, future, callback))
+        return job.start()
+
+    def _finish(self, job, future, callback):
+        # Runs on the executor's management thread (or a stream's own thread) once the job is done
+        try:
+            job.stats = future.result()
+            job.result = job.output_path
+            tail = f", ready {job.stats['tail_seconds'] * 1000:.0f} ms after the last frame" if 'tail_seconds' in job.stats else ''
+            print(f"GIF job {job.job_id} finished: {job.result} "
+                  f"({job.stats['seconds'] * 1000:.0f} ms, {job.stats['bytes'] / 1024:.0f} KB{tail})")
+        except Exception as e:
+            job.error = e
+            print(f"GIF job {job.job_id} failed: {e}")
+
+        if callback is not None:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Error in completion callback for GIF job {job.job_id}: {e}")
+        # Only now, so a job the callback submits is queued before this one stops counting
+        with self._idle:
+            self.jobs.pop(job.job_id, None)
+            self._idle.notify_all()
+
+    def status(self, job_id):
+        # None once the job has finished (its callback has the outcome)
+        with self._lock:
+            job = self.jobs.get(job_id)
+        return job.status if job else None
+
+    def pending(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def queue_depth(self):
+        with self._lock:
+            return len(self.jobs)
+
+    def wait(self, timeout=None):
+        # Wait until every job, and every job its callbacks submitted, has finished; False on timeout
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.jobs, timeout)
+
+    def drain(self, timeout=None):
+        # Let queued and running jobs finish, then stop the worker processes
+        pending = self.pending()
+        if pending:
+            print(f"Waiting for {len(pending)} GIF job(s) to finish...")
+            self.wait(timeout)
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def remove_partial_files(*dir_paths):
+    # Remove '.part' files left behind by a worker that was killed mid-write
+    for dir_path in dir_paths:
+        if not os.path.isdir(dir_path):
+            continue
+        for name in os.listdir(dir_path):
+            if name.endswith(PART_SUFFIX):
+                print(f"Removing partial file {os.path.join(dir_path, name)}...")
+                os.remove(os.path.join(dir_path, name))
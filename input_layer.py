@@ -0,0 +1,191 @@
+import json
+import threading
+from collections import deque
+from time import monotonic
+
+# Button and switch input for the booth scripts.
+# Every GPIO edge is timestamped the moment its interrupt callback runs and
+# debounced in software: a change of level only counts once the previous
+# accepted change is at least `window` seconds old, and a pin that bounced is
+# read again once its window is over so its final level is never lost.
+# Accepted presses and switch changes go into a deque (appends and pops are
+# atomic, so the GPIO thread never waits on a lock held by the main loop) and
+# the consumer is woken through the `wakeup` callback.
+#
+# The main loop reports back with handled() or dropped(), which gives
+# press-to-handled latency and a count of presses the booth was too busy for.
+# With trace=True every raw edge is kept and save_trace() writes them out as
+# a timeline that backends.FakeGPIO.play() replays.
+
+BUTTON = 'button'
+SWITCH = 'switch'
+
+MAX_QUEUED = 64  # Oldest events are dropped (and counted) past this many
+
+
+class InputEvent:
+    def __init__(self, kind, pin, level, time):
+        self.kind = kind
+        self.pin = pin
+        self.level = level
+        self.time = time  # monotonic() time of the edge that caused it
+
+    def __repr__(self):
+        return f"InputEvent({self.kind}, pin={self.pin}, level={self.level}, time={self.time:.3f})"
+
+
+class _Pin:
+    def __init__(self, kind, pin, window, active_level, level):
+        self.kind = kind
+        self.pin = pin
+        self.window = window
+        self.active_level = active_level  # Buttons: the level a press settles at
+        self.level = level  # Last accepted level
+        self.changed_at = float('-inf')  # When the last accepted change happened
+        self.settle_timer = None
+        self.bounces = 0
+
+
+class InputLayer:
+    def __init__(self, gpio, wakeup=None, trace=False):
+        self.gpio = gpio
+        self.wakeup = wakeup  # Called (from the GPIO thread) when the queue goes from empty to not
+        self.queued = deque()
+        self.ready = threading.Event()  # Set while there may be events queued, for wait()
+        self.latencies = []  # Seconds from edge to handled(), per press
+        self.dropped_presses = 0
+        self.overflows = 0
+        self.trace = [] if trace else None
+        self._pins = {}
+        self._wake_pending = False
+        self._lock = threading.Lock()  # Between the GPIO thread and settle timers, never the main loop
+        self._start = monotonic()
+
+    def watch_button(self, pin, window, edge=None):
+        # A press is the pin settling after `edge` (GPIO.FALLING by default, as the booth is wired)
+        edge = self.gpio.FALLING if edge is None else edge
+        return self._watch(BUTTON, pin, window, 0 if edge == self.gpio.FALLING else 1)
+
+    def watch_switch(self, pin, window):
+        return self._watch(SWITCH, pin, window, None)
+
+    def _watch(self, kind, pin, window, active_level):
+        self._pins[pin] = _Pin(kind, pin, window, active_level, self.gpio.input(pin))
+        # Both edges, no hardware bouncetime: debouncing happens in _edge
+        self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=self._edge)
+        return self._pins[pin]
+
+    # Called from the GPIO thread
+    def _edge(self, pin):
+        now = monotonic()
+        level = self.gpio.input(pin)
+        if self.trace is not None:
+            self.trace.append((now - self._start, pin, level))
+        state = self._pins.get(pin)
+        if state is None:
+            return
+        with self._lock:
+            self._debounce(state, level, now)
+
+    def _debounce(self, state, level, now):
+        if now - state.changed_at < state.window:
+            # Bounce: look at the pin again once the window is over
+            state.bounces += 1
+            if state.settle_timer is None:
+                state.settle_timer = threading.Timer(state.changed_at + state.window - now, self._settle, (state, now))
+                state.settle_timer.daemon = True
+                state.settle_timer.start()
+            return
+        self._accept(state, level, now)
+
+    def _settle(self, state, edge_time):
+        with self._lock:
+            state.settle_timer = None
+            self._accept(state, self.gpio.input(state.pin), edge_time)
+
+    def _accept(self, state, level, now):
+        if level == state.level:
+            return
+        state.level = level
+        state.changed_at = now
+        if state.kind == BUTTON and level != state.active_level:
+            return  # The other half of a press
+        self._put(InputEvent(state.kind, state.pin, level, now))
+
+    def _put(self, event):
+        if len(self.queued) >= MAX_QUEUED:
+            self.queued.popleft()
+            self.overflows += 1
+        self.queued.append(event)
+        self.ready.set()
+        if not self._wake_pending:
+            self._wake_pending = True
+            if self.wakeup is not None:
+                self.wakeup()
+
+    # Called from the main loop
+    def drain(self):
+        # Every queued event, oldest first
+        self._wake_pending = False
+        self.ready.clear()
+        events = []
+        while True:
+            try:
+                events.append(self.queued.popleft())
+            except IndexError:
+                return events
+
+    def wait(self, timeout=None):
+        # Block until an event may be queued (for loops with no pygame event queue to wait on)
+        return self.ready.wait(timeout)
+
+    def level(self, pin):
+        # Debounced level, without touching the GPIO
+        return self._pins[pin].level
+
+    def handled(self, event):
+        latency = monotonic() - event.time
+        if event.kind == BUTTON:
+            self.latencies.append(latency)
+        return latency
+
+    def dropped(self, event):
+        if event.kind == BUTTON:
+            self.dropped_presses += 1
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'presses': len(latencies),
+            'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+            'latency_p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+            'latency_max': latencies[-1] if latencies else None,
+            'dropped_presses': self.dropped_presses,
+            'overflows': self.overflows,
+            'bounces': {state.pin: state.bounces for state in self._pins.values()},
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        if s['presses']:
+            print(f"Press to handled: mean {s['latency_mean'] * 1000:.1f} ms, p95 {s['latency_p95'] * 1000:.1f} ms, "
+                  f"max {s['latency_max'] * 1000:.1f} ms over {s['presses']} presses")
+        print(f"Dropped presses: {s['dropped_presses']} (busy), {s['overflows']} (queue full); "
+              f"bounces filtered: {s['bounces']}")
+
+    def save_trace(self, path):
+        # Raw edges as [seconds, pin, level] rows, ready for load_trace() and FakeGPIO.play()
+        with open(path, 'w') as f:
+            json.dump({'edges': [[round(t, 6), pin, level] for t, pin, level in self.trace or []]}, f)
+
+    def close(self):
+        for state in self._pins.values():
+            self.gpio.remove_event_detect(state.pin)
+            if state.settle_timer is not None:
+                state.settle_timer.cancel()
+
+
+def load_trace(path):
+    # A saved trace as a FakeGPIO.play() timeline of (seconds, pin, level)
+    with open(path) as f:
+        return [tuple(edge) for edge in json.load(f)['edges']]
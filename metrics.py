@@ -0,0 +1,157 @@
+import functools
+import json
+import os
+import shutil
+import threading
+from time import monotonic, time
+
+# Per-stage timing for the booth.
+# Stages are timed with metrics.timed(...) or metrics.span(...). Every span is
+# appended to a JSON-lines log tagged with its session, and folded into a
+# latency histogram per stage that the gallery server exports at /metrics in
+# Prometheus text format, along with registered gauges (queue depth, free
+# disk). When disabled, timed functions cost one attribute check per call.
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, metrics, stage, session):
+        self.metrics = metrics
+        self.stage = stage
+        self.session = session
+
+    def __enter__(self):
+        self.wall = time()
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, monotonic() - self.start, self.session, self.wall, error=exc_type is not None)
+        return False
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class Metrics:
+    def __init__(self, enabled=True, log_path=None):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.session = None  # Session that spans belong to unless given one explicitly
+        self.histograms = {}
+        self.gauges = {}  # name -> (help, function returning a number or {label value: number}, label name)
+        self._lock = threading.Lock()
+        self._log = None
+
+    def start_session(self, session):
+        self.session = session
+
+    def timed(self, stage):
+        # Decorator timing every call of the function as `stage`
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Span(self, stage, self.session):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def span(self, stage, session=None):
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, stage, session or self.session)
+
+    def observe(self, stage, seconds, session=None, wall=None, **fields):
+        # Record a stage timing that was measured elsewhere (e.g. in a worker process)
+        if not self.enabled:
+            return
+        with self._lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds)
+            if self.log_path:
+                record = {'session': session or self.session, 'stage': stage,
+                          'start': wall if wall is not None else time() - seconds, 'seconds': round(seconds, 6)}
+                record.update(fields)
+                self._write(record)
+
+    def _write(self, record):
+        if self._log is None:
+            os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+            self._log = open(self.log_path, 'a', buffering=1)  # Line buffered
+        self._log.write(json.dumps(record) + '\n')
+
+    def gauge(self, name, help_text, fn, label='path'):
+        # fn returns a number, or a dict of numbers reported with `label` set to each key
+        self.gauges[name] = (help_text, fn, label)
+
+    def disk_free_gauge(self, paths):
+        # Free bytes on the filesystem holding each path
+        def free():
+            values = {}
+            for path in paths:
+                try:
+                    values[path] = shutil.disk_usage(path).free
+                except OSError:
+                    pass
+            return values
+        self.gauge('gifbooth_disk_free_bytes', 'Free bytes on the filesystem holding each path', free)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.count, h.sum) for stage, h in self.histograms.items()}
+        if histograms:
+            lines.append('# HELP gifbooth_stage_seconds Time spent in each booth stage')
+            lines.append('# TYPE gifbooth_stage_seconds histogram')
+        for stage, (counts, count, total) in sorted(histograms.items()):
+            for bound, bucket_count in zip(BUCKETS, counts):
+                lines.append(f'gifbooth_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+            lines.append(f'gifbooth_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'gifbooth_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'gifbooth_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        for name, (help_text, fn, label_name) in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            if isinstance(value, dict):
+                for label, v in sorted(value.items()):
+                    lines.append(f'{name}{{{label_name}="{label}"}} {v}')
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,177 @@
+import math
+from collections import OrderedDict
+from time import monotonic
+
+import numpy as np
+import pygame
+
+# Mosaic idle screen.
+# Tiles the most recent sets across the screen as a grid of small animated
+# GIFs. Every set's frames are shrunk once, with a NumPy box filter, into one
+# row of a shared atlas Surface; after that a tile changing frame is a single
+# blit from the atlas. Tiles are out of phase with each other, so each tick
+# only redraws the one or two tiles whose frame is due and hands just their
+# rects to pygame.display.update() instead of flipping the whole screen.
+#
+# The atlas keeps a row per tile. A new set takes over the row of the oldest
+# one, so only its own frames are ever shrunk, and sets that have gone from
+# disk keep their tile until something newer needs the row.
+
+MARGIN = 8  # Pixels between tiles and around the edge
+
+
+def thumbnail(pixels, size):
+    # Box-filter a (width, height, 3) pixel array (pygame.surfarray layout) down to `size`
+    width, height = size
+    # Average every step-th pixel (step is half the shrink factor): the same at thumbnail size, for far less work
+    step = max(1, min(pixels.shape[0] // width, pixels.shape[1] // height) // 2)
+    pixels = pixels[::step, ::step]
+    src_width, src_height = pixels.shape[:2]
+    xs = (np.arange(width) * src_width) // width
+    ys = (np.arange(height) * src_height) // height
+    summed = np.add.reduceat(np.add.reduceat(pixels, xs, axis=0, dtype=np.uint32), ys, axis=1)
+    counts = np.outer(np.diff(np.append(xs, src_width)), np.diff(np.append(ys, src_height)))
+    return (summed // np.maximum(counts, 1)[:, :, None]).astype(np.uint8)
+
+
+def grid_for(count, screen_size, aspect):
+    # The columns x rows with room for `count` tiles that gives the biggest tiles of the given aspect
+    width, height = screen_size
+    best = None
+    for columns in range(1, count + 1):
+        rows = math.ceil(count / columns)
+        tile_width = (width - MARGIN * (columns + 1)) // columns
+        tile_height = (height - MARGIN * (rows + 1)) // rows
+        tile_width = min(tile_width, int(tile_height * aspect))
+        if tile_width > 0 and (best is None or tile_width > best[2]):
+            best = (columns, rows, tile_width, int(tile_width / aspect))
+    return best
+
+
+class Mosaic:
+    def __init__(self, screen_size, tiles, frames_per_set, period, banner=None):
+        self.screen_size = screen_size
+        self.period = period  # Seconds each frame of a tile is shown for
+        self.frames_per_set = frames_per_set
+        # One cell of the grid is kept for the banner (the instruction image) if there is one
+        cells = tiles + (1 if banner is not None else 0)
+        columns, rows, tile_width, tile_height = grid_for(cells, screen_size, screen_size[0] / screen_size[1])
+        self.tile_size = (tile_width, tile_height)
+        left = (screen_size[0] - columns * tile_width - (columns - 1) * MARGIN) // 2
+        top = (screen_size[1] - rows * tile_height - (rows - 1) * MARGIN) // 2
+        self.cells = [pygame.Rect(left + c * (tile_width + MARGIN), top + r * (tile_height + MARGIN), tile_width, tile_height)
+                      for r in range(rows) for c in range(columns)][:cells]
+        self.banner = None
+        if banner is not None:
+            self.banner_rect = self.cells.pop(len(self.cells) // 2)
+            self.banner = pygame.transform.smoothscale(banner, self.banner_rect.size)
+
+        self.atlas = pygame.Surface((tile_width * frames_per_set, tile_height * tiles)).convert()
+        self.slots = OrderedDict()  # set id -> (atlas row, frame count), least recently added first
+        self.layout = []  # (cell rect, set id) for the sets on screen, newest first
+        self.shown = {}  # cell index -> frame last drawn there
+        self._start = monotonic()
+        self.ticks = 0
+        self.tiles_drawn = 0
+        self.pixels_updated = 0
+        self.draw_seconds = 0.0
+        self.thumbnail_seconds = 0.0
+        self.sets_added = 0
+
+    def __contains__(self, set_id):
+        return set_id in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add_set(self, set_id, frames):
+        # Shrink a set's frames ((width, height, 3) arrays) into the atlas, replacing the oldest set if it's full
+        started = monotonic()
+        if set_id in self.slots:
+            row = self.slots.pop(set_id)[0]
+        elif len(self.slots) < len(self.cells):
+            row = len(self.slots)
+        else:
+            row = self.slots.popitem(last=False)[1][0]
+        frames = frames[:self.frames_per_set]
+        tile_width, tile_height = self.tile_size
+        pixels = pygame.surfarray.pixels3d(self.atlas)
+        try:
+            for index, frame in enumerate(frames):
+                x, y = index * tile_width, row * tile_height
+                pixels[x:x + tile_width, y:y + tile_height] = thumbnail(frame, self.tile_size)
+        finally:
+            del pixels  # Unlocks the atlas
+        self.slots[set_id] = (row, len(frames))
+        self.thumbnail_seconds += monotonic() - started
+        self.sets_added += 1
+
+    def show(self, set_ids):
+        # Lay out these sets (newest first); ones that aren't in the atlas are left out
+        set_ids = [set_id for set_id in set_ids if set_id in self.slots and self.slots[set_id][1]]
+        self.layout = list(zip(self.cells, set_ids))
+        self.shown = {}
+
+    def _frame(self, cell, set_id, now):
+        # Each cell runs a fraction of a period behind the one before it, so they don't all change together
+        count = self.slots[set_id][1]
+        offset = cell / len(self.layout)
+        return int((now - self._start) / self.period + offset) % count
+
+    def _blit(self, surface, cell, set_id, frame):
+        row = self.slots[set_id][0]
+        tile_width, tile_height = self.tile_size
+        surface.blit(self.atlas, self.layout[cell][0], (frame * tile_width, row * tile_height, tile_width, tile_height))
+        self.shown[cell] = frame
+
+    def draw_all(self, surface, now=None):
+        # Redraw the whole screen; returns the rect to update
+        now = monotonic() if now is None else now
+        surface.fill((0, 0, 0))
+        if self.banner is not None:
+            surface.blit(self.banner, self.banner_rect)
+        for cell, (_, set_id) in enumerate(self.layout):
+            self._blit(surface, cell, set_id, self._frame(cell, set_id, now))
+        return [surface.get_rect()]
+
+    def draw(self, surface, now=None):
+        # Blit only the tiles whose frame has changed; returns their rects for pygame.display.update()
+        started = monotonic()
+        now = started if now is None else now
+        dirty = []
+        for cell, (rect, set_id) in enumerate(self.layout):
+            frame = self._frame(cell, set_id, now)
+            if self.shown.get(cell) != frame:
+                self._blit(surface, cell, set_id, frame)
+                dirty.append(rect)
+        self.ticks += 1
+        self.tiles_drawn += len(dirty)
+        self.pixels_updated += sum(rect.width * rect.height for rect in dirty)
+        self.draw_seconds += monotonic() - started
+        return dirty
+
+    def next_change(self, now=None):
+        # Seconds until the next tile is due to change frame
+        now = monotonic() if now is None else now
+        step = self.period / max(1, len(self.layout))
+        return step - ((now - self._start) % step)
+
+    def stats(self):
+        screen_pixels = self.screen_size[0] * self.screen_size[1]
+        return {
+            'tiles': len(self.layout),
+            'tile_size': self.tile_size,
+            'ticks': self.ticks,
+            'tiles_per_tick': self.tiles_drawn / self.ticks if self.ticks else 0.0,
+            'updated_fraction': self.pixels_updated / (self.ticks * screen_pixels) if self.ticks else 0.0,
+            'draw_mean': self.draw_seconds / self.ticks if self.ticks else 0.0,
+            'sets_added': self.sets_added,
+            'thumbnail_mean': self.thumbnail_seconds / self.sets_added if self.sets_added else 0.0,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Mosaic: {s['tiles']} tiles of {s['tile_size'][0]}x{s['tile_size'][1]}, {s['ticks']} ticks, "
+              f"{s['tiles_per_tick']:.1f} tiles and {s['updated_fraction']:.1%} of the screen updated per tick, "
+              f"draw {s['draw_mean'] * 1000:.2f} ms, {s['sets_added']} sets added "
+              f"({s['thumbnail_mean'] * 1000:.0f} ms each)")
@@ -1,46 +1,112 @@
-import RPi.GPIO as GPIO
 import pygame
 import time
+import io
 import os
-import shutil
-from picamera import PiCamera
 import config
-from PIL import Image
+from asset_cache import AssetCache, Deferred
+from backends import get_backend
+from camera_service import CameraService, CameraTimeout
+from gif_worker import GifWorker
+from input_layer import InputLayer, BUTTON
+from frame_pacer import FramePacer
+from renderer import Renderer
+import raw_frames
+from ring_store import RingStore
+from session_queue import SessionQueue
 import datetime
 
+backend = get_backend()
+GPIO = backend.gpio
+
+# GIFs are encoded in the background, so the next guest can start while earlier GIFs are still being made.
+# The worker process is forked here, before anything below starts a thread.
+gif_worker = GifWorker(max_workers=1)
+
 # GPIO setup
 BUTTON_PIN = 5
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+DEBOUNCE_WINDOW = 0.03  # Seconds a button edge must settle for before it counts as a press
+
+# Presses are picked up by interrupt, debounced and timestamped; wait_for_button_press() only waits on the queue
+input_layer = InputLayer(GPIO)
+input_layer.watch_button(BUTTON_PIN, DEBOUNCE_WINDOW)
 
 # Initialize Pygame and create a window
-pygame.init()
-pygame.mixer.init()
-screen = pygame.display.set_mode((config.screen_width, config.screen_height), pygame.FULLSCREEN)
+backend.configure()
+pygame.display.init()
+renderer = Renderer(backend, (config.screen_width, config.screen_height))
+screen = renderer.window
 pygame.display.set_caption('Photobooth')
 
-# Load sounds
+# Screen images are kept pre-scaled for this screen, so the start image is up without a decode
+asset_cache = AssetCache(config.asset_cache_path)
+screen_images = (config.start_image_path, config.processing_image_path)
+
+# Load sounds in the background; opening the sound card shouldn't hold up the start image
+def load_snap_sound():
+    pygame.mixer.init()
+    return pygame.mixer.Sound(config.snap_path)
+
 print("Loading sounds...")
-snap_sound = pygame.mixer.Sound(config.snap_path)
+snap_sound = Deferred(load_snap_sound, 'audio')
+
+# Open the camera once; exposure and white balance settle while we wait for the first press
+camera = CameraService(backend.open_camera, resolution=config.camera_resolution, iso=config.camera_iso,
+                       hflip=True, settle_time=config.camera_settle_time).start()
+
+# Recent photo sets live in fixed slots set1..setN; ring.json says which is newest
+photo_sets = RingStore(config.recent_sets_path, config.num_photo_sets, 'set{}', first=1)
+
+# Past SESSION_HIGH_WATER queued sessions the GIF is made with the 'speed' profile and redone at 'quality'
+# once the queue is empty; at SESSION_QUEUE_MAX the press is refused.
+SESSION_QUEUE_MAX = 3
+SESSION_HIGH_WATER = 2
+session_queue = SessionQueue(SESSION_QUEUE_MAX, SESSION_HIGH_WATER, 'quality', 'speed')
+
+def take_button_press():
+    # Whether a press has come in since the last drain (other queued input is dropped)
+    pressed = False
+    for event in input_layer.drain():
+        if event.kind == BUTTON and not pressed:
+            latency = input_layer.handled(event)
+            print(f"Button pressed ({latency * 1000:.0f} ms ago)")
+            pressed = True
+        else:
+            input_layer.dropped(event)
+    return pressed
 
 def wait_for_button_press():
+    # Presses made while the last sequence was running don't start another one
+    for event in input_layer.drain():
+        input_layer.dropped(event)
     while True:
-        if not GPIO.input(BUTTON_PIN):  # Button is pressed (if using pull-up resistor)
-            break
+        if take_button_press():
+            return
         if check_for_exit():
             raise SystemExit
-        time.sleep(0.1)  # Debounce delay
+        input_layer.wait(0.1)  # Wakes as soon as a press is queued
 
 def clear_screen():
-    screen.fill((0, 0, 0))
-    pygame.display.flip()
+    renderer.fill((0, 0, 0))
+    renderer.present()
+
+def load_screen_image(image_path):
+    # Saved sets have display-ready raw frames next to their JPEGs; map those instead of decoding
+    if image_path in screen_images:
+        return asset_cache.load(image_path, (config.screen_width, config.screen_height), screen)
+    if isinstance(image_path, str):
+        image = raw_frames.load_frame(raw_frames.raw_path(image_path, (config.screen_width, config.screen_height)))
+        if image is not None:
+            return image
+    image = pygame.image.load(image_path)
+    return pygame.transform.scale(image, (config.screen_width, config.screen_height))
 
 def show_image_for_duration(image_path, duration):
     try:
-        image = pygame.image.load(image_path)
-        image = pygame.transform.scale(image, (config.screen_width, config.screen_height))
-        screen.blit(image, (0, 0))
-        pygame.display.flip()
+        image = load_screen_image(image_path)
+        renderer.show(image)
+        renderer.present()
 
         start_time = time.time()
         while time.time() - start_time < duration:
@@ -50,105 +116,143 @@ def show_image_for_duration(image_path, duration):
     except pygame.error as e:
         print(f"Error displaying image: {e}")
 
+def show_frame_for_duration(frame, duration):
+    # Same as show_image_for_duration, but for a JPEG held in memory
+    show_image_for_duration(io.BytesIO(frame), duration)
+
 def simulate_flash():
     white = (255, 255, 255)
-    screen.fill(white)
-    pygame.display.flip()
+    renderer.fill(white)
+    renderer.present()
     time.sleep(config.flash_time)
     # clear_screen()
 
 def capture_current_photos():
-    with PiCamera() as camera:
-        camera.resolution = config.camera_resolution
-        camera.iso = config.camera_iso
-
-        for photo_number in range(1, config.num_images + 1):
-            try:
-                clear_screen()
-                camera.hflip = True
-                camera.start_preview()
-                time.sleep(config.camera_warmup_time)
-                camera.stop_preview()
-                # camera.hflip = False
-
-                simulate_flash()
-                snap_sound.play()
-
-                photo_path = os.path.join(config.current_photos_path, f"photo{photo_number}.jpg")
-                camera.capture(photo_path)
-                print(f"Photo {photo_number} captured and saved to {photo_path}")
-
-                show_image_for_duration(photo_path, config.image_display_time)
-                clear_screen()
-
-                if photo_number < config.num_images:
-                    time.sleep(config.photo_interval)
-            except Exception as e:
-                print(f"An error occurred during photo {photo_number}: {e}")
-                break
-            finally:
-                time.sleep(config.post_capture_delay)
-
-def manage_photo_sets():
-    for i in range(config.num_photo_sets, 0, -1):
-        old_set_path = os.path.join(config.recent_sets_path, f"set{i}")
-        new_set_path = os.path.join(config.recent_sets_path, f"set{i + 1}")
-
-        if os.path.exists(old_set_path):
-            if i == config.num_photo_sets:
-                shutil.rmtree(old_set_path)
-            else:
-                os.rename(old_set_path, new_set_path)
-
-    new_set_path = os.path.join(config.recent_sets_path, "set1")
-    os.makedirs(new_set_path, exist_ok=True)
-
+    # Photos are captured into memory and only written to disk once, by manage_photo_sets
+    # The camera is already open and settled, so each photo is taken straight away
+    frames = []
     for photo_number in range(1, config.num_images + 1):
-        current_photo_path = os.path.join(config.current_photos_path, f"photo{photo_number}.jpg")
-        new_photo_path = os.path.join(new_set_path, f"photo{photo_number}.jpg")
-        shutil.copy(current_photo_path, new_photo_path)
-
-def create_animated_gif(image_paths, output_path):
-    images = [Image.open(image_path) for image_path in image_paths if os.path.exists(image_path)]
-    if images:
-        images[0].save(output_path, save_all=True, append_images=images[1:], loop=0, duration=config.gif_frame_duration, optimize=True)
-        print(f"Animated GIF saved to {output_path}")
-
-def create_gif_from_recent_set():
-    # Assuming the most recent set is always 'set1' in 'recent_sets_path'
-    recent_set_path = os.path.join(config.recent_sets_path, "set1")
-    image_paths = [os.path.join(recent_set_path, f"photo{i}.jpg") for i in range(1, config.num_images + 1)]
+        try:
+            clear_screen()
+            simulate_flash()
+            if snap_sound.ready() and not snap_sound.failed:
+                snap_sound.get().play()
+
+            stream = io.BytesIO()
+            camera.capture(stream, format='jpeg', use_video_port=True)
+            frames.append(stream.getvalue())
+            print(f"Photo {photo_number} captured into memory")
+
+            show_frame_for_duration(frames[-1], config.image_display_time)
+            clear_screen()
+
+            if photo_number < config.num_images:
+                time.sleep(config.photo_interval)
+        except CameraTimeout as e:
+            print(f"Camera stopped responding during photo {photo_number}, it is being restarted: {e}")
+            break
+        except Exception as e:
+            print(f"An error occurred during photo {photo_number}: {e}")
+            break
+        finally:
+            time.sleep(config.post_capture_delay)
+    return frames
+
+def manage_photo_sets(frames):
+    # The new set replaces the oldest slot; no other set is moved
+    def write_photos(new_set_path):
+        photo_paths = []
+        for photo_number, frame in enumerate(frames, start=1):
+            new_photo_path = os.path.join(new_set_path, f"photo{photo_number}.jpg")
+            with open(new_photo_path, 'wb') as f:
+                f.write(frame)
+            photo_paths.append(new_photo_path)
+        # Decode and scale each photo once here, so replaying the set never has to
+        surfaces = [pygame.transform.scale(pygame.image.load(io.BytesIO(frame)).convert(),
+                                           (config.screen_width, config.screen_height)) for frame in frames]
+        raw_frames.write_frames(photo_paths, surfaces, screen)
+
+    new_set_path = photo_sets.push_dir(write_photos)
+    print(f"Saved photo set to {new_set_path}")
+
+def create_animated_gif(image_paths, output_path, ticket):
+    # image_paths may also be in-memory JPEG bytes. The GIF is encoded by the worker in the background.
+    frames = [p for p in image_paths if isinstance(p, bytes) or os.path.exists(p)]
+    if not frames:
+        session_queue.release(ticket)
+        return
+    gif_worker.submit(frames, output_path, config.gif_frame_duration, profile=ticket.profile,
+                      effects=config.gif_effects, callback=lambda job: gif_finished(job, ticket, frames))
+
+def gif_finished(job, ticket, frames):
+    # Called from the worker's management thread; a degraded GIF is redone once the queue is empty
+    if job.error is None:
+        print(f"Animated GIF saved to {job.result}")
+    session_queue.release(ticket)
+    if ticket.defer_archive and job.error is None:
+        session_queue.defer(ticket, frames, job.output_path)
+    start_deferred_encode()
+
+def start_deferred_encode():
+    deferred = session_queue.next_deferred()
+    if deferred is None:
+        return
+    ticket, (frames, gif_path) = deferred
+    print(f"Re-encoding {gif_path} with the 'quality' profile...")
+    gif_worker.submit(frames, gif_path, config.gif_frame_duration, profile=session_queue.profile,
+                      effects=config.gif_effects, callback=deferred_encode_finished)
+
+def deferred_encode_finished(job):
+    session_queue.deferred_finished(ok=job.error is None)
+    start_deferred_encode()
+
+def create_gif_from_recent_set(ticket, frames=None):
+    if frames:
+        # Encode straight from the frames still in memory
+        image_paths = frames
+    else:
+        recent_set_path = photo_sets.recent(0)
+        if recent_set_path is None:
+            print("No photo sets to make a GIF from")
+            session_queue.release(ticket)
+            return
+        image_paths = [os.path.join(recent_set_path, f"photo{i}.jpg") for i in range(1, config.num_images + 1)]
 
     # Generating a timestamped filename for the GIF
     timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     gif_filename = f"{timestamp}.gif"
     gif_path = os.path.join(config.archive_path, gif_filename)
 
-    create_animated_gif(image_paths, gif_path)
+    create_animated_gif(image_paths, gif_path, ticket)
 
-def display_current_set():
-    for _ in range(config.num_loops):  # Looping through the current set
-        for photo_number in range(1, config.num_images + 1):
-            current_photo_path = os.path.join(config.current_photos_path, f"photo{photo_number}.jpg")
-            if os.path.exists(current_photo_path):
-                show_image_for_duration(current_photo_path, config.photo_display_duration)
-            else:
-                print(f"Photo not found: {current_photo_path}")
+def display_current_set(frames):
+    # Loop through the current set at the GIF's own frame rate.
+    # Returns True if the button was pressed, to go straight into the next sequence.
+    def sleep(seconds):
+        renderer.sleep(seconds, wake=input_layer.ready.is_set)  # A press cuts the frame short
 
-            if check_for_exit():
-                return  # Exit the function if ESC is pressed
+    pacer = FramePacer(config.gif_frame_duration / 1000, sleep=sleep)
+    for index in pacer.schedule(len(frames) * config.num_loops):
+        show_frame_for_duration(frames[index % len(frames)], 0)
+
+        if check_for_exit():
+            return False  # Exit the function if ESC is pressed
+        if take_button_press():
+            print("Starting the next sequence")
+            return True
+    pacer.histogram.print_summary()
+    return False
 
 def display_photo_sets():
-    for set_number in range(1, config.num_photo_sets + 1):
-        set_path = os.path.join(config.recent_sets_path, f"set{set_number}")
+    for set_path in photo_sets.recent_paths():  # Newest first
         if os.path.exists(set_path):
-            for _ in range(config.num_loops_per_set):
-                for photo_number in range(1, config.num_images + 1):
-                    photo_path = os.path.join(set_path, f"photo{photo_number}.jpg")
-                    if os.path.exists(photo_path):
-                        show_image_for_duration(photo_path, config.photo_display_duration)
-                    if check_for_exit():
-                        return  # Exit the function if ESC is pressed
+            pacer = FramePacer(config.gif_frame_duration / 1000)
+            for index in pacer.schedule(config.num_images * config.num_loops_per_set):
+                photo_path = os.path.join(set_path, f"photo{index % config.num_images + 1}.jpg")
+                if os.path.exists(photo_path):
+                    show_image_for_duration(photo_path, 0)
+                if check_for_exit():
+                    return  # Exit the function if ESC is pressed
 
 def check_for_exit():
     for event in pygame.event.get():
@@ -157,20 +261,31 @@ def check_for_exit():
     return False
 
 def photobooth_sequence():
+    # Returns True if the button was pressed again while the set was showing
+    ticket = session_queue.admit()
+    if ticket is None:
+        show_image_for_duration(config.processing_image_path, 0)  # Still busy with earlier GIFs
+        return False
+
     print("Starting photo capture")
-    capture_current_photos()
+    frames = capture_current_photos()
+    if len(frames) < config.num_images:
+        # The burst was cut short: keep the saved sets as they are and make no GIF
+        print(f"Only {len(frames)} of {config.num_images} photos were taken, discarding them")
+        session_queue.release(ticket)
+        return False
 
     print("Showing processing image")
-    show_image_for_duration(config.processing_image_path, 3)
+    show_image_for_duration(config.processing_image_path, 0)
     
     print("Managing photo sets")
-    manage_photo_sets()
+    manage_photo_sets(frames)
     
     print("Creating a GIF for the archive")
-    create_gif_from_recent_set()
+    create_gif_from_recent_set(ticket, frames)
 
     print("Showing current photo set")
-    display_current_set()
+    return display_current_set(frames)
     
 # Main execution
 # try:
@@ -201,19 +316,33 @@ def photobooth_sequence():
 
 
 # Main execution
-try:
-    while True:
-        show_image_for_duration(config.start_image_path, 0)  # Show start image indefinitely
-        wait_for_button_press()  # Wait for button press to start photobooth
-        photobooth_sequence()  # Execute photobooth sequence
-
-except KeyboardInterrupt:
-    print("Program interrupted by user")
-except SystemExit:
-    print("Exiting program")
-except Exception as e:
-    print(f"An error occurred: {e}")
-
-finally:
-    GPIO.cleanup()
-    pygame.quit()
\ No newline at end of file
+if __name__ == '__main__':
+    try:
+        while True:
+            show_image_for_duration(config.start_image_path, 0)  # Show start image indefinitely
+            wait_for_button_press()  # Wait for button press to start photobooth
+            while photobooth_sequence():  # Execute photobooth sequence, again if pressed during playback
+                pass
+
+    except KeyboardInterrupt:
+        print("Program interrupted by user")
+    except SystemExit:
+        print("Exiting program")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+    finally:
+        # Finish the queued GIFs and the deferred 'quality' re-encodes they leave behind
+        while True:
+            gif_worker.wait()
+            start_deferred_encode()
+            if not gif_worker.queue_depth():
+                break
+        gif_worker.drain()
+        session_queue.print_stats()
+        input_layer.print_stats()
+        renderer.print_stats()
+        input_layer.close()
+        camera.close()
+        GPIO.cleanup()
+        pygame.quit()
\ No newline at end of file
@@ -1,46 +1,183 @@
-import RPi.GPIO as GPIO
 import pygame
+import math
 import os
-from picamera import PiCamera
 from time import sleep, time
 from os import listdir, rename
 from os.path import isfile, join
-from PIL import Image
 from datetime import datetime
 from pathlib import Path
 import shutil
+import threading
+# Only what it takes to get the idle screen up; the rest is imported once it's showing
+from asset_cache import AssetCache, Deferred, StartupTimer
+from renderer import Renderer, Spinner, Text
+from staging import Journal, Flusher, DONE, ABANDONED, default_staging_path
+from metrics import Metrics
+from backends import get_backend
+from booth_state import (BoothStateMachine, INPUT_READY, IDLE, COUNTDOWN,
+                         CAPTURING, PROCESSING, PLAYBACK, VIEW_MODE)
+from input_layer import InputLayer, BUTTON, SWITCH
 
 # Constants
 # GIFS_PATH = '/home/plevin/piBooth/photobooth_gifs/'
-SNAP_SOUND_PATH = '/home/plevin/gifbooth/click.wav'
-INSTRUCTION_IMAGE_PATH = '/home/plevin/gifbooth/start_images/stooges.jpg'
-TEMP_IMAGES_PATH = '/home/plevin/gifbooth/gif_temp/'
-RECENT_GIFS_PATH = '/home/plevin/gifbooth/gif_recent/'
-ARCHIVE_PATH = '/home/plevin/gifbooth/gif_archive/'
+GIFBOOTH_HOME = os.environ.get('GIFBOOTH_HOME', '/home/plevin/gifbooth')  # Override to run off the Pi
+SNAP_SOUND_PATH = os.path.join(GIFBOOTH_HOME, 'click.wav')
+INSTRUCTION_IMAGE_PATH = os.path.join(GIFBOOTH_HOME, 'start_images/stooges.jpg')
+TEMP_IMAGES_PATH = os.path.join(GIFBOOTH_HOME, 'gif_temp/')
+RECENT_GIFS_PATH = os.path.join(GIFBOOTH_HOME, 'gif_recent/')
+ARCHIVE_PATH = os.path.join(GIFBOOTH_HOME, 'gif_archive/')
+SET_MANIFEST_PATH = os.path.join(GIFBOOTH_HOME, 'gif_sets.json')  # Index of the sets in TEMP_IMAGES_PATH
+ARCHIVE_MANIFEST_PATH = os.path.join(GIFBOOTH_HOME, 'gif_archive.json')  # Index of the GIFs in ARCHIVE_PATH
+# Sessions are written here first (RAM on the Pi) and copied to the card behind them
+STAGING_PATH = os.environ.get('GIFBOOTH_STAGING', default_staging_path('gifbooth', os.path.join(GIFBOOTH_HOME, 'staging/')))
+STAGED_SETS_PATH = os.path.join(STAGING_PATH, 'sets/')
+STAGED_GIFS_PATH = os.path.join(STAGING_PATH, 'gifs/')
+JOURNAL_PATH = os.path.join(GIFBOOTH_HOME, 'sessions.journal')  # Each session's progress, to finish it after a crash
+FLUSH_INTERVAL = 2.0  # Seconds staged files wait to be batched up before being written to the card
+NUM_SETS_TO_KEEP = 5  # Image sets shown in view mode, and always kept in TEMP_IMAGES_PATH
+STORAGE_BUDGET_MB = int(os.environ.get('GIFBOOTH_STORAGE_BUDGET_MB', '8192'))  # Archived GIFs plus sets in TEMP_IMAGES_PATH
+MIN_FREE_MB = 512  # Free space left on the card; older sets and GIFs are compacted to keep it
+KEEP_FULL_GIFS = 50  # Newest archived GIFs never shrunk or deleted (the gallery lists as many)
+COMPACT_PROFILE = 'size'  # Encoder profile older archived GIFs are shrunk to when space runs short
+COMPACT_INTERVAL = 60.0  # Seconds between storage checks (also checked after each session)
+NUM_RECENT_GIFS = 5  # Slots in the recent GIF ring (recent0.gif..recent4.gif, order in ring.json)
 SWITCH_PIN = 6
 BUTTON_PIN = 5
-DEBOUNCE_THRESHOLD = 0.5  # seconds
+DEBOUNCE_WINDOW = 0.03  # seconds a button edge must be apart from the last one to count (presses while busy are dropped anyway)
+SWITCH_DEBOUNCE_WINDOW = 0.3  # seconds, same for the view mode switch
+INPUT_TRACE_PATH = os.environ.get('GIFBOOTH_INPUT_TRACE')  # Record raw GPIO edges here, to replay with FakeGPIO.play()
 NUM_PHOTOS = 5
-PHOTO_INTERVAL = 0.15  # seconds
-GIF_DURATION = 500  # milliseconds
+PHOTO_INTERVAL = 0.15  # seconds between shots when capturing to disk
+GIF_DURATION = 500  # milliseconds, also the frame period for on-screen playback
 NUM_LOOPS_PER_GIF = 4  # You can change this to set how many times each GIF is looped
+IDLE_SCREEN = os.environ.get('GIFBOOTH_IDLE_SCREEN', 'image')  # 'image' (INSTRUCTION_IMAGE_PATH) or 'mosaic' of recent GIFs
+MOSAIC_TILES = 24  # Sets tiled on the mosaic idle screen (topped up from the archive)
+VIEW_ORDER = os.environ.get('GIFBOOTH_VIEW_ORDER', 'recency')  # View mode order: 'recency', 'shuffle' or 'weighted' (toward new sets)
+FRAME_CACHE_BUDGET_MB = 256  # Memory budget for decoded, screen-sized frames
+MAPPED_FRAMES_BUDGET_MB = 512  # Address space for mapped raw frames held by the frame cache
+RAW_FRAMES = True  # Also store each shot pre-scaled in the display's pixel format, for mmap playback (~8 MB a frame at 1080p)
+GIF_WORKERS = 3  # Processes encoding GIFs in the background (leave a core for the UI)
+CAPTURE_IN_MEMORY = True  # Capture bursts from the video port into memory instead of one file per shot
+BURST_INTERVAL = 0.15  # seconds between shots in an in-memory burst
+BURST_PREVIEW = True  # Flash and show each shot during the burst (runs while the camera takes the next one)
+GIF_PROFILE = 'speed'  # Encoder profile from gif_encoder.PROFILES: 'speed', 'size' or 'quality'
+SESSION_QUEUE_MAX = 4  # Sessions allowed between press and finished GIF; presses past this are refused
+SESSION_HIGH_WATER = 2  # From this many sessions queued, new ones get DEGRADED_GIF_PROFILE and a deferred archive encode
+DEGRADED_GIF_PROFILE = 'lite'  # Encoder profile for sessions admitted above the high water mark
+GIF_EFFECTS = os.environ.get('GIFBOOTH_GIF_EFFECTS', '')  # e.g. 'grade:warm,logo:/path/logo.png,boomerang' (see gif_effects)
+STREAM_GIF = True  # Encode the GIF frame by frame while the burst is captured, not after it
+CAMERA_SETTLE_TIME = 2.0  # Seconds auto exposure and white balance get at startup before being locked
+CAMERA_TIMEOUT = 5.0  # A capture taking longer than this means the camera is wedged and gets reopened
+VSYNC = True  # Present on vsync where the display driver supports it
+REFRESH_RATE = 60  # Hz, the panel's refresh rate (for overlay animation and dropped present counts)
+FLASH_TIME = 0.1  # Seconds the flash takes to fade back to the shot
+COUNTDOWN_SECONDS = 0  # Seconds of on-screen countdown before the burst (0 to shoot straight away)
+GALLERY_PORT = int(os.environ.get('GIFBOOTH_GALLERY_PORT', '8000'))  # Port for the GIF player's server, 0 for none
+METRICS_ENABLED = True  # Time each stage; served at /metrics on the gallery server
+METRICS_LOG_PATH = os.path.join(GIFBOOTH_HOME, 'metrics/sessions.jsonl')  # One JSON line per timed stage
+ASSET_CACHE_PATH = os.path.join(GIFBOOTH_HOME, 'asset_cache/')  # Screen images pre-scaled for this display, for a fast start
+BOOT_BUDGET = float(os.environ.get('GIFBOOTH_BOOT_BUDGET', '3.0'))  # Seconds from process start to the idle screen showing
 
 
 # Initialization
 print("Initializing system...")
-pygame.init()
-pygame.mixer.init()
-screen_info = pygame.display.Info()
-screen_width, screen_height = screen_info.current_w, screen_info.current_h
-window = pygame.display.set_mode((screen_width, screen_height), pygame.FULLSCREEN)
-camera = PiCamera()
-camera.resolution = (screen_width, screen_height)
-print("Camera initialized.")
-
-# Load sounds and images
+startup = StartupTimer()
+startup.mark('imports')
+metrics = Metrics(enabled=METRICS_ENABLED, log_path=METRICS_LOG_PATH)
+backend = get_backend()
+GPIO = backend.gpio
+backend.configure()
+pygame.display.init()
+pygame.font.init()
+renderer = Renderer(backend, vsync=VSYNC, refresh_rate=REFRESH_RATE)
+window = renderer.window
+screen_width, screen_height = window.get_size()
+startup.mark('display')
+
+# The idle screen goes up first, from a copy already scaled for this screen when there is one
+asset_cache = AssetCache(ASSET_CACHE_PATH)
+instruction_image = asset_cache.load(INSTRUCTION_IMAGE_PATH, (screen_width, screen_height), window)
+renderer.show(instruction_image)
+renderer.present()
+startup.mark('first_frame')
+
+# The rest of the booth loads while the idle screen is up
+import numpy as np
+from PIL import Image, ImageSequence
+from frame_cache import FrameCache
+import raw_frames
+from gif_worker import GifWorker, GifStreamAborted, remove_partial_files
+import gif_effects
+from burst_capture import capture_burst
+from camera_service import CameraService, CameraTimeout
+from frame_pacer import FramePacer, JitterHistogram, HOLD
+from set_index import SetIndex
+from playlist import Playlist
+from mosaic import Mosaic
+from session_queue import SessionQueue
+from archive_store import ArchiveStore, Compactor
+from ring_store import RingStore
+startup.mark('booth_imports')
+
+# Background GIF encoding. The worker processes are forked first, while this is the only thread
+# (so none of them inherits a lock some other thread was holding)
+print("Starting GIF workers...")
+asset_cache.wait()
+gif_worker = GifWorker(max_workers=GIF_WORKERS)
+gif_effects.parse(GIF_EFFECTS)  # A bad effects spec stops the booth here rather than failing every GIF
+
+# The camera stays open for the whole run; it settles in the background while we load the rest
+camera = CameraService(backend.open_camera, resolution=(screen_width, screen_height),
+                       settle_time=CAMERA_SETTLE_TIME, capture_timeout=CAMERA_TIMEOUT).start()
+camera_ready = Deferred(camera.wait_ready, 'camera_ready', startup)
+print("Camera starting.")
+
+def load_snap_sound():
+    # Opening the sound card can take a while, so it happens in the background too
+    pygame.mixer.init()
+    return pygame.mixer.Sound(SNAP_SOUND_PATH)
+
 print("Loading sounds and images...")
-snap_sound = pygame.mixer.Sound(SNAP_SOUND_PATH)
-instruction_image = pygame.transform.scale(pygame.image.load(INSTRUCTION_IMAGE_PATH).convert(), (screen_width, screen_height))
+snap_sound = Deferred(load_snap_sound, 'audio', startup)
+frame_cache = FrameCache(budget_bytes=FRAME_CACHE_BUDGET_MB * 1024 * 1024,
+                         mapped_budget_bytes=MAPPED_FRAMES_BUDGET_MB * 1024 * 1024)
+set_index = SetIndex(TEMP_IMAGES_PATH, SET_MANIFEST_PATH)
+archive = ArchiveStore(ARCHIVE_PATH, ARCHIVE_MANIFEST_PATH, on_change=lambda set_id, path: archive_changed(set_id, path))
+# Write-behind to the card, journalling how far each session has got
+journal = Journal(JOURNAL_PATH)
+flusher = Flusher(journal, FLUSH_INTERVAL).start()
+staged_sessions = {}  # set id -> the parts of it already on the card, until it's done (flusher thread only)
+for path in (STAGED_SETS_PATH, STAGED_GIFS_PATH):
+    os.makedirs(path, exist_ok=True)
+mosaic = Mosaic((screen_width, screen_height), MOSAIC_TILES, NUM_PHOTOS, GIF_DURATION / 1000,
+                banner=instruction_image) if IDLE_SCREEN == 'mosaic' else None
+
+recent_gifs = RingStore(RECENT_GIFS_PATH, NUM_RECENT_GIFS, 'recent{}.gif')
+session_queue = SessionQueue(SESSION_QUEUE_MAX, SESSION_HIGH_WATER, GIF_PROFILE, DEGRADED_GIF_PROFILE)
+# Storage retention: keeps sets and archived GIFs within the budget, working only while no GIFs are being made
+compactor = Compactor(archive, set_index, STORAGE_BUDGET_MB * 1024 * 1024, MIN_FREE_MB * 1024 * 1024,
+                      keep_sets=NUM_SETS_TO_KEEP, keep_gifs=KEEP_FULL_GIFS, small_profile=COMPACT_PROFILE,
+                      interval=COMPACT_INTERVAL, idle=lambda: not gif_worker.queue_depth() and not session_queue.depth(),
+                      on_drop_set=lambda record: frame_cache.invalidate_dir(record['path']))
+metrics.gauge('gifbooth_gif_queue_depth', 'GIF jobs queued or encoding', gif_worker.queue_depth)
+metrics.gauge('gifbooth_session_queue_depth', 'Sessions between press and finished GIF', session_queue.depth)
+metrics.gauge('gifbooth_session_decisions', 'Sessions admitted normally, degraded or refused', lambda: {
+    decision: count for decision, count in session_queue.stats().items() if decision in ('normal', 'degraded', 'refused')},
+    label='decision')
+metrics.disk_free_gauge([TEMP_IMAGES_PATH, ARCHIVE_PATH, STAGING_PATH])
+metrics.gauge('gifbooth_flush_backlog', 'Staged writes and journal records waiting for the card', flusher.backlog)
+metrics.gauge('gifbooth_archive_bytes', 'Bytes of archived GIFs, each stored once', lambda: archive.bytes)
+metrics.gauge('gifbooth_compactions', 'Sets dropped and archived GIFs shrunk or deleted to stay within budget',
+              lambda: dict(compactor.actions), label='action')
+metrics.gauge('gifbooth_dropped_presents', 'Frames presented more than a refresh after they were due',
+              lambda: renderer.dropped)
+
+# Gallery server for the GIF player displays, started in the background (http.server is a slow import)
+def start_gallery():
+    from gallery_server import start_gallery_server
+    return start_gallery_server(RECENT_GIFS_PATH, ARCHIVE_PATH, port=GALLERY_PORT, metrics=metrics, archive=archive)
+
+gallery_server = Deferred(start_gallery, 'gallery', startup) if GALLERY_PORT else None
 
 # GPIO setup
 print("Setting up GPIO...")
@@ -50,132 +187,362 @@ GPIO.setup(BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 
 # Flags and variables
 running = True
-capture_in_progress = False
 view_mode_active = False
-last_button_press_time = 0
-display_instruction_flag = True
+state_machine = BoothStateMachine()
+state_machine.register_gauges(metrics)
+input_layer = InputLayer(GPIO, wakeup=state_machine.post_input_ready, trace=INPUT_TRACE_PATH is not None)
+session_jitter = JitterHistogram('session')  # Replaced at the start of every capture session
+session_ticket = None  # The session queue's ticket for the session being captured
+pending_press = None  # A press made during playback, served as soon as playback has stopped
 
 # Function definitions
-def button_callback(channel):
-    print("Button pressed callback triggered.")
-    global capture_in_progress, last_button_press_time
-    print("Button pressed. Checking if capture is already in progress...")
-    current_time = time()
-    if not capture_in_progress and (current_time - last_button_press_time) >= DEBOUNCE_THRESHOLD:
-        print("Starting image capture sequence...")
-        last_button_press_time = current_time
-        capture_in_progress = True
-        capture_images()
-        capture_in_progress = False
+def handle_event(event):
+    # Runs on the pygame thread, from the main loop or from check_for_quit
+    global running
+    if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+        print("ESC key pressed, setting running to False...")
+        running = False
+    elif event.type == pygame.QUIT:
+        print("Quit event detected, setting running to False...")
+        running = False
+    elif event.type == INPUT_READY:
+        for input_event in input_layer.drain():
+            handle_input(input_event)
+
+def handle_input(event):
+    # A debounced button press or switch change from the input layer
+    global view_mode_active, pending_press
+    if event.kind == SWITCH:
+        # Switch UP means view mode; the main loop enters it once the booth is idle
+        input_layer.handled(event)
+        view_mode_active = bool(event.level)
+        print(f"Switch toggled to {'UP' if view_mode_active else 'DOWN'} position...")
+    elif event.kind == BUTTON:
+        if not state_machine.is_idle() and not view_mode_active and pending_press is None:
+            # GIFs encode in the background, so the next session starts as soon as this burst is over
+            # (cutting its playback short)
+            print(f"Button pressed while {state_machine.state}, starting the next session after this burst...")
+            pending_press = event
+            return
+        if not state_machine.is_idle() or view_mode_active:
+            print(f"Booth is busy ({state_machine.state}), ignoring button press.")
+            input_layer.dropped(event)
+            return
+        run_sessions(event)
+
+def run_sessions(event):
+    # Serve the press, then any press made during its playback, and so on
+    global pending_press, session_ticket
+    while event is not None:
+        session_ticket = session_queue.admit()
+        if session_ticket is None:
+            print("Too many GIFs still being made, ignoring button press.")
+            input_layer.dropped(event)
+            break
+        latency = input_layer.handled(event)
+        print(f"Button pressed {latency * 1000:.1f} ms ago, starting image capture sequence "
+              f"({session_ticket.depth} sessions ahead of it)...")
+        state_machine.start_session(event.time)
+        try:
+            capture_images()
+        finally:
+            if session_ticket.set_id is None:
+                session_queue.release(session_ticket)  # No GIF was started for it
+            state_machine.transition(IDLE)
         print("Image capture sequence complete.")
-    else:
-        print("Debounce or capture already in progress, ignoring button press.")
-
-def switch_callback(channel):
-    global view_mode_active, display_instruction_flag
-    # Detect the current state of the switch
-    if GPIO.input(SWITCH_PIN):
-        # If the switch is UP, enter view mode
-        if not view_mode_active:  # Only enter view mode if not already in it
-            view_mode_active = True
-            display_instruction_flag = False
+        event, pending_press = pending_press, None
+    if not view_mode_active:
+        display_instruction_image()
+
+def main_loop():
+    while running:
+        if view_mode_active:
             enter_view_mode()
-    else:
-        # If the switch is DOWN, exit view mode
-        if view_mode_active:  # Only exit view mode if currently in it
-            view_mode_active = False
-            display_instruction_flag = True
-            display_instruction_image()  # Immediately display instruction image
+            continue
+        wait_for_event()
+
+def wait_for_event():
+    # Sleeps in pygame.event.wait() until there's a key, button or switch event (or a mosaic tile is due)
+    if mosaic is None or not mosaic.layout:
+        handle_event(pygame.event.wait())
+        return
+    handle_event(pygame.event.wait(max(1, math.ceil(mosaic.next_change() * 1000))))
+    if running and not view_mode_active and state_machine.is_idle():
+        renderer.update(mosaic.draw(window))
+        renderer.present()
+
+def play_snap():
+    # Silent until the sound card is open, and for good if it couldn't be
+    if snap_sound.ready() and not snap_sound.failed:
+        snap_sound.get().play()
 
 def display_instruction_image():
-    window.blit(instruction_image, (0, 0))
-    pygame.display.flip()
+    if mosaic is not None:
+        refresh_mosaic()
+        if mosaic.layout:
+            mosaic.draw_all(window)
+            renderer.update()
+            renderer.present()
+            return
+    renderer.show(instruction_image)
+    renderer.present()
+
+def refresh_mosaic():
+    # Add any sets the mosaic hasn't got yet (newest from the index, the rest from the archive) and lay it out
+    sources = {image_set['id']: image_set for image_set in set_index.recent(MOSAIC_TILES)}
+    if len(sources) < MOSAIC_TILES:
+        for entry in archive.recent(MOSAIC_TILES):
+            if len(sources) == MOSAIC_TILES:
+                break
+            sources.setdefault(entry['id'], entry['path'])
+    # Set ids are capture timestamps, so sorting them puts the newest first
+    set_ids = sorted(sources, reverse=True)[:MOSAIC_TILES]
+    for set_id in reversed(set_ids):
+        if set_id not in mosaic:
+            frames = mosaic_frames(sources[set_id])
+            if frames:
+                mosaic.add_set(set_id, frames)
+    mosaic.show(set_ids)
+
+def mosaic_frames(source):
+    # A set's frames as (width, height, 3) arrays: its raw frames or JPEGs, or an archived GIF's frames
+    try:
+        if isinstance(source, str):
+            with Image.open(source) as gif:
+                return [np.asarray(frame.convert('RGB')).transpose(1, 0, 2)
+                        for frame in ImageSequence.Iterator(gif)][:NUM_PHOTOS]
+        frames = []
+        for image_path in source['frames']:
+            surface = raw_frames.load_frame(raw_frames.raw_path(image_path, (screen_width, screen_height)))
+            if surface is None:
+                surface = pygame.image.load(image_path)
+            frames.append(pygame.surfarray.pixels3d(surface))  # A view, not a copy
+        return frames
+    except (pygame.error, OSError) as e:
+        print(f"Couldn't load {source if isinstance(source, str) else source['id']} for the mosaic: {e}")
+        return []
 
 def enter_view_mode():
-    global view_mode_active
     print("Entering view mode...")
-    
-    while view_mode_active:
-        # Get the 5 most recent directories containing image sets
-        recent_dirs = sorted(Path(TEMP_IMAGES_PATH).glob('*/'), key=os.path.getmtime, reverse=True)[:5]
-
-        # Loop through each directory
-        for image_dir in recent_dirs:
-            # Make sure the directory exists and has image files
-            if image_dir.is_dir():
-                image_files = sorted(image_dir.glob('*.jpg'), key=os.path.getmtime)
-
-                # Loop through each image set NUM_LOOPS_PER_GIF times
-                for _ in range(NUM_LOOPS_PER_GIF):
-                    # Display each image in the directory in sequence
-                    for image_file in image_files:
-                        if not view_mode_active:
-                            print("Exiting view mode...")
-                            return
-                        display_image(str(image_file))  # Display the image
-                        sleep(PHOTO_INTERVAL)  # Wait for the duration of each frame
-
-                    if not GPIO.input(SWITCH_PIN):  # Check directly after displaying an image
-                        print("Switch toggled to DOWN position, exiting view mode...")
-                        view_mode_active = False
-                        return
-
-        # Optional: Add a short delay before repeating the entire process
-        sleep(0.5)
+    state_machine.transition(VIEW_MODE)
+    try:
+        show_recent_sets()
+    finally:
+        state_machine.transition(IDLE)
+        frame_cache.print_stats()
+    if running:
+        display_instruction_image()
+
+def show_recent_sets():
+    view_jitter = JitterHistogram('view mode')
+    try:
+        play_recent_sets(view_jitter)
+    finally:
+        view_jitter.print_summary()
+
+def play_recent_sets(view_jitter):
+    # One schedule for the whole of view mode, so moving on to the next set doesn't break the frame rhythm
+    pacer = FramePacer(GIF_DURATION / 1000, histogram=view_jitter, sleep=renderer.sleep)
+    item, shown = None, 0
+    playlist.start()
+    try:
+        for _ in pacer.schedule(float('inf')):
+            check_for_quit()  # Picks up the switch going DOWN
+            if not view_mode_active or not running:
+                print("Exiting view mode...")
+                return
+            if item is None or shown == len(item.frames) * NUM_LOOPS_PER_GIF:
+                # Already loaded by the playlist's prefetch thread while this set was playing
+                item, shown = playlist.advance(), 0
+                if item is None:
+                    continue  # No sets yet; look again next frame
+                print(f"Showing set {item.set_id}...")
+            display_surface(item.frames[shown % len(item.frames)], deadline=pacer.deadline)
+            shown += 1
+    finally:
+        playlist.stop()
+        playlist.print_stats()
+
+@metrics.timed('prefetch_set')
+def load_set_frames(image_set):
+    # Runs on the playlist's prefetch thread
+    frames = []
+    for image_path in image_set['frames']:
+        try:
+            frames.append(frame_cache.get(image_path, (screen_width, screen_height)))
+        except (pygame.error, OSError) as e:
+            print(f"Failed to load image {image_path} for view mode: {e}")
+    return frames
+
+playlist = Playlist(set_index, load_set_frames, NUM_SETS_TO_KEEP, order=VIEW_ORDER)
 
 def capture_images():
-    global display_instruction_flag
+    global session_jitter
     print("Capturing images...")
+    session_jitter = JitterHistogram('session')
+    if COUNTDOWN_SECONDS and not run_countdown():
+        return
+    state_machine.transition(CAPTURING)
     
-    # Create a unique directory for the new set of images
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    current_set_dir = Path(TEMP_IMAGES_PATH) / timestamp
-    current_set_dir.mkdir(exist_ok=True)
-    
-    # Save images to the new directory
+    # Create a unique directory for the new set of images (the time, with -2 etc. for a second session that second)
+    timestamp = archive.new_id(datetime.now().strftime("%Y%m%d-%H%M%S"), taken=lambda set_id: set_index.get(set_id) is not None)
+    current_set_dir = Path(STAGED_SETS_PATH) / timestamp
+    metrics.start_session(timestamp)
+
+    if CAPTURE_IN_MEMORY:
+        captured = capture_burst_images(current_set_dir, timestamp)
+    else:
+        captured = capture_images_to_disk(current_set_dir, timestamp)
+    if captured:
+        print("Done capturing images.")
+    session_jitter.print_summary()
+
+def run_countdown():
+    # Counts down over the instruction image; returns False if interrupted
+    state_machine.transition(COUNTDOWN)
+    # Only the digits are redrawn each second, over the instruction image
+    renderer.show(instruction_image)
+    digits = renderer.add(Text(pygame.font.Font(None, screen_height // 2), (screen_width // 2, screen_height // 2)))
+    try:
+        for remaining in range(COUNTDOWN_SECONDS, 0, -1):
+            digits.set(str(remaining))
+            renderer.present()
+            sleep(1)
+            check_for_quit()
+            if not running or view_mode_active:
+                print("Countdown interrupted.")
+                return False
+        return True
+    finally:
+        renderer.remove(digits)
+
+def capture_images_to_disk(current_set_dir, set_id):
+    current_set_dir.mkdir(parents=True, exist_ok=True)
+
+    # Save images to the new directory, starting a shot every PHOTO_INTERVAL
     image_paths = [current_set_dir / f'image{i:02d}.jpg' for i in range(NUM_PHOTOS)]
-    for image_path in image_paths:
+    stream = start_gif_stream(set_id) if STREAM_GIF else None
+    if not capture_to_disk(image_paths, stream):
+        if stream is not None:
+            stream.abort()
+        shutil.rmtree(current_set_dir, ignore_errors=True)
+        return False
+    if stream is not None:
+        stream.finish()
+    
+    set_index.add_set(set_id, current_set_dir, [str(p) for p in image_paths], time())
+    # Decoded now: the staged files can be cleared once they're on the card, mid-playback
+    surfaces = [frame_cache.get(p, (screen_width, screen_height)) for p in image_paths]
+
+    def write_behind():
+        if RAW_FRAMES:
+            raw_frames.write_frames(image_paths, surfaces, window)
+        persist_set(set_id, current_set_dir, image_paths)
+
+    threading.Thread(target=write_behind, name='raw-frame-writer', daemon=True).start()
+
+    # Pass the paths of the temp images to be processed into a GIF
+    process_images_to_gif(image_paths, set_id, surfaces=surfaces, gif_started=stream is not None)
+    return True
+
+def capture_to_disk(image_paths, stream=None):
+    pacer = FramePacer(PHOTO_INTERVAL, HOLD, session_jitter)
+    for index in pacer.schedule(len(image_paths)):
         if not running or view_mode_active:
             print("Aborting capture_images, running: {}, view_mode_active: {}".format(running, view_mode_active))
-            return
-        capture_image(image_path)
-        sleep(PHOTO_INTERVAL)
+            return False
+        try:
+            capture_image(image_paths[index])
+        except CameraTimeout as e:
+            print(f"Camera failed during capture, skipping this session: {e}")
+            return False
+        if stream is not None:
+            stream.add(str(image_paths[index]))
         check_for_quit()
         if not running:
             print("Stopping image capture due to ESC key press...")
-            return
-    
-    # Pass the paths of the temp images to be processed into a GIF
-    process_images_to_gif(image_paths)
-    display_instruction_flag = True
-    print("Done capturing images.")
-    display_instruction_image()
+            return False
+    return True
+
+def capture_burst_images(current_set_dir, set_id):
+    # Grab the whole burst into memory; the JPEGs are written to disk once, in the background
+    stream = start_gif_stream(set_id) if STREAM_GIF else None
+
+    def on_frame(index, burst):
+        if stream is not None:
+            stream.add(burst.frames[index])  # Encoded while the camera takes the next shot
+        play_snap()
+        print(f"Captured image {index + 1} of {NUM_PHOTOS} into memory...")
+        if BURST_PREVIEW:
+            display_surface(burst.surface(index, (screen_width, screen_height)), flash=True)
+        check_for_quit()
 
+    burst = None
+    try:
+        # Only the burst itself: GIF submission and playback are timed as their own stages
+        with metrics.span('capture_burst_images'):
+            burst = capture_burst(camera, NUM_PHOTOS, BURST_INTERVAL, on_frame=on_frame,
+                                  should_stop=lambda: not running or view_mode_active, histogram=session_jitter)
+    except CameraTimeout as e:
+        print(f"Camera failed during the burst, skipping this session: {e}")
+    finally:
+        if stream is not None:
+            # The GIF only needs its trailer now, so it's ready a moment after the last shot
+            if burst is not None and len(burst) == NUM_PHOTOS:
+                stream.finish()
+            else:
+                stream.abort()
+    if burst is None:
+        return False
+    if len(burst) < NUM_PHOTOS:
+        print("Aborting capture_images, running: {}, view_mode_active: {}".format(running, view_mode_active))
+        return False
+    print("Burst intervals: " + ", ".join(f"{interval:.3f}s" for interval in burst.intervals()))
+
+    captured_at = time()
+    surfaces = burst.surfaces((screen_width, screen_height))
+
+    def burst_saved(saved):
+        set_index.add_set(set_id, current_set_dir, saved.paths, captured_at)
+        if RAW_FRAMES:
+            raw_frames.write_frames(saved.paths, surfaces, window)
+        persist_set(set_id, current_set_dir, saved.paths)
+
+    burst.save_in_background(current_set_dir, callback=burst_saved)
+    process_images_to_gif(burst.frames, set_id, surfaces=surfaces, gif_started=stream is not None)
+    return True
+
+@metrics.timed('capture_image')
 def capture_image(image_path):
     print(f"Capturing image to {image_path}...")
     camera.capture(str(image_path))  # Convert PosixPath to string
-    snap_sound.play()
+    play_snap()
     display_image(str(image_path), flash=True)  # Ensure display_image also accepts a string path
 
     
-def display_image(image_path, flash=False):
+def display_surface(surface, flash=False, deadline=None):
+    renderer.show(surface)
     if flash:
+        # Full white, then the shot fades in as the flash dies away
         print("Flashing screen...")
-        window.fill((255, 255, 255))
-        pygame.display.flip()
-        sleep(0.1)
-
+        renderer.flash(FLASH_TIME)
+        renderer.present()
+        state_machine.first_flash()
+        renderer.sleep(FLASH_TIME)
+    renderer.present(deadline)
+
+@metrics.timed('display_image')
+def display_image(image_path, flash=False, deadline=None):
     print(f"Displaying image {image_path}...")
 
     # Attempt to load the image with retries
     max_retries = 5
     for attempt in range(max_retries):
         try:
-            image = pygame.transform.scale(pygame.image.load(image_path).convert(), (screen_width, screen_height))
-            window.blit(image, (0, 0))
-            pygame.display.flip()
+            image = frame_cache.get(image_path, (screen_width, screen_height))
+            display_surface(image, flash=flash, deadline=deadline)
             break  # If the image is loaded successfully, break out of the loop
-        except pygame.error as e:
+        except (pygame.error, OSError) as e:
             if attempt < max_retries - 1:
                 print(f"Failed to load image {image_path}, attempt {attempt + 1} of {max_retries}. Error: {e}")
                 sleep(0.5)  # Wait half a second before trying again
@@ -184,113 +551,281 @@ def display_image(image_path, flash=False):
                 # Handle the failure, possibly by skipping this image or shutting down the process
 
 
-def process_images_to_gif(image_paths):
+def process_images_to_gif(image_paths, set_id, surfaces=None, gif_started=False):
     print("Processing images into GIF...")
     check_for_quit()
     if not running:
         print("Aborting GIF creation due to ESC key press...")
         return
-    # Create an animated GIF from the temp images and save it to RECENT_GIFS_PATH
-    recent_gif_path = create_animated_gif(image_paths)
-    # Pass the path of the recently created GIF for renaming and archiving
-    rename_and_archive_gifs(recent_gif_path)
-    simulate_gif(image_paths)
+    # Encode the GIF in the background (unless it was streamed during capture);
+    # it's archived and rotated into RECENT_GIFS_PATH when the job finishes
+    state_machine.transition(PROCESSING)
+    if not gif_started:
+        create_animated_gif(image_paths, set_id)
+    state_machine.transition(PLAYBACK)
+    simulate_gif(image_paths, surfaces)
     print("Finished processing images into GIF.")
-    # Manage the directories of images
-    manage_image_directories()
-
-def create_animated_gif(image_paths):
-    print("Creating animated GIF...")
-    # Load images and print progress
-    images = []
-    for i, image_path in enumerate(image_paths):
-        print(f"Loading image {i + 1} of {len(image_paths)}: {image_path}")
-        try:
-            images.append(Image.open(str(image_path)))
-        except IOError as e:
-            print(f"Error loading image {image_path}: {e}")
-            return None
 
-    output_path = os.path.join(RECENT_GIFS_PATH, 'recent0.gif')
-    print("Saving frames to GIF...")
-    try:
-        images[0].save(output_path, save_all=True, append_images=images[1:], loop=0, duration=GIF_DURATION)
-        print("Animated GIF created at:", output_path)
-    except IOError as e:
-        print(f"Error saving GIF: {e}")
-        return None
-
-    # Check if the GIF was actually created and is readable
-    if os.path.exists(output_path):
-        if os.access(output_path, os.R_OK):
-            print(f"GIF creation confirmed: {output_path} is readable.")
-        else:
-            print(f"Error: The GIF {output_path} is not readable. Check permissions.")
-            return None
+def staged_gif_path(set_id):
+    # Where a set's GIF is written; the archive stores its copy under its content hash
+    return os.path.join(STAGED_GIFS_PATH, f'{set_id}.gif')
+
+def start_gif_stream(set_id):
+    output_path = staged_gif_path(set_id)
+    ticket = session_ticket
+    ticket.set_id = set_id
+    return gif_worker.stream(output_path, GIF_DURATION,
+                             callback=lambda job: gif_job_finished(job, set_id, ticket), profile=ticket.profile,
+                             effects=GIF_EFFECTS)
+
+@metrics.timed('create_animated_gif')
+def create_animated_gif(image_paths, set_id):
+    # image_paths may also be in-memory JPEG bytes from a burst
+    print("Queueing animated GIF...")
+    output_path = staged_gif_path(set_id)
+    ticket = session_ticket
+    ticket.set_id = set_id
+    return gif_worker.submit(image_paths, output_path, GIF_DURATION,
+                             callback=lambda job: gif_job_finished(job, set_id, ticket), profile=ticket.profile,
+                             effects=GIF_EFFECTS)
+
+def gif_job_finished(job, set_id, ticket):
+    # Called from the worker's management thread when a GIF job completes
+    if isinstance(job.error, GifStreamAborted):
+        print(f"Discarded the GIF for abandoned set {set_id}")
     else:
-        print(f"Error: The GIF {output_path} does not exist after saving attempt.")
-        return None
-
-    return output_path
-
-def rename_and_archive_gifs(output_path):
-    print("Renaming and archiving GIFs...")
-
-    # First, archive the new GIF before renaming others
+        gif_finished(job, set_id)
+    # Manage the directories of images
+    with metrics.span('manage_image_directories', session=set_id):
+        manage_image_directories()
+    # The session leaves the queue; a degraded one's archive GIF is redone once the queue is empty
+    # (and once its own archive copy is on the card, so that can't land on top of the redone one)
+    session_queue.release(ticket)
+    if ticket.defer_archive and job.error is None:
+        session_queue.defer(ticket, set_id)
+    flusher.after(start_deferred_encode)
+
+def gif_finished(job, set_id):
+    # A session's GIF is in staging: archive it behind the session (also used for resumed sessions)
+    if job.error is not None:
+        print(f"Error creating GIF {job.output_path}: {job.error}")
+        flusher.after(lambda: session_part_done(set_id, gif=None))  # The set is still kept
+        return
+    metrics.observe('encode_gif', job.stats['seconds'], session=set_id)
+    for name, seconds in job.stats['effects'].items():
+        metrics.observe(f'effect_{name}', seconds, session=set_id)  # What each effect adds to the encode
+    archive_gif(set_id, job.result, job.stats['profile'])
+
+def persist_set(set_id, staged_dir, frames):
+    # A set is in staging: copy its JPEGs and raw frames to the card behind the session
+    persistent_dir = Path(TEMP_IMAGES_PATH) / set_id
+    persistent_frames = [str(persistent_dir / Path(p).name) for p in frames]
+    part = f'{set_id}/frames'  # If a copy fails, the set stays staged and unfinished in the journal
+    flusher.record(set_id, 'captured', staged=str(staged_dir), staged_frames=[str(p) for p in frames])
+    # JPEGs before their raw frames, which are only mapped while they're newer than the JPEG
+    for path in sorted(Path(staged_dir).iterdir(), key=lambda p: (p.suffix == '.raw', p.name)):
+        flusher.copy(path, persistent_dir / path.name, part=part)
+    flusher.record(set_id, 'persisted', part=part, path=str(persistent_dir), frames=persistent_frames)
+    flusher.after(lambda: session_part_done(set_id, staged=str(staged_dir), path=str(persistent_dir),
+                                            frames=persistent_frames), part=part)
+
+def archive_gif(set_id, staged_gif, profile):
+    # Copy a finished GIF from staging into the archive (unless it's there already), then move it into the recent ring
+    archive_path = archive.blob_path(archive.digest(staged_gif))
+    part = f'{set_id}/gif'
+    flusher.record(set_id, 'encoded', staged_gif=staged_gif, profile=profile)
+    if not os.path.exists(archive_path):
+        flusher.copy(staged_gif, archive_path, part=part)
+    flusher.record(set_id, 'archived', part=part, gif=archive_path)
+    flusher.after(lambda: gif_archived(set_id, staged_gif, archive_path, profile), part=part)
+
+def gif_archived(set_id, staged_gif, archive_path, profile):
+    # On the flusher thread, once the archive copy is on the card
+    archive.add(set_id, archive_path, profile=profile)
+    set_index.set_gif(set_id, archive_path)
+    with metrics.span('store_recent_gif', session=set_id):
+        store_recent_gif(staged_gif)
+    session_part_done(set_id, gif=archive_path)
+
+def session_part_done(set_id, **parts):
+    # On the flusher thread. Once both the frames and the GIF are on the card, the set is
+    # pointed at its files there and its staging directory is cleared.
+    session = staged_sessions.setdefault(set_id, {})
+    session.update(parts)
+    if 'frames' not in session or 'gif' not in session:
+        return
+    on_card = session['frames'] + ([session['gif']] if session['gif'] else [])  # No GIF if its encode failed
+    if not all(os.path.exists(p) for p in on_card):
+        # Never clear staging for files that aren't on the card; the next start retries from the journal
+        print(f"Keeping session {set_id} staged, some of its files are missing from the card")
+        return
+    del staged_sessions[set_id]
+    if not set_index.relocate(set_id, session['path'], session['frames']):
+        shutil.rmtree(session['path'], ignore_errors=True)  # Expired while it was being written
+    if session.get('staged'):
+        frame_cache.invalidate_dir(session['staged'])
+        shutil.rmtree(session['staged'], ignore_errors=True)
+    flusher.record(set_id, DONE)
+    start_deferred_encode()  # One may have been waiting for this set to leave staging
+
+def resume_sessions():
+    # Finish the sessions the journal says were interrupted (a crash or power cut), going by
+    # how far each one got; a set whose frames only ever reached staging can't be recovered
+    unfinished = journal.compact()
+    for set_id, session in unfinished.items():
+        frames = session.get('frames')
+        staged_frames = session.get('staged_frames') or []
+        if frames and all(os.path.exists(p) for p in frames):
+            if set_index.get(set_id) is None:
+                set_index.add_set(set_id, session['path'], frames, session['time'])
+            else:
+                set_index.relocate(set_id, session['path'], frames)
+            flusher.after(lambda set_id=set_id, session=session: session_part_done(
+                set_id, staged=session.get('staged'), path=session['path'], frames=session['frames']))
+        elif staged_frames and all(os.path.exists(p) for p in staged_frames):
+            if set_index.get(set_id) is None:
+                set_index.add_set(set_id, session['staged'], staged_frames, session['time'])
+            persist_set(set_id, session['staged'], staged_frames)
+        else:
+            print(f"Session {set_id} was lost before its photos were saved")
+            flusher.record(set_id, ABANDONED)
+            set_index.discard(set_id)
+            continue
+
+        staged_gif = session.get('staged_gif')
+        if session.get('gif') and os.path.exists(session['gif']):
+            gif = archive.add(set_id, session['gif'], profile=session.get('profile'))['path']
+            set_index.set_gif(set_id, gif)
+            flusher.after(lambda set_id=set_id, gif=gif: session_part_done(set_id, gif=gif))
+        elif staged_gif and os.path.exists(staged_gif):
+            archive_gif(set_id, staged_gif, session.get('profile'))
+        else:
+            print(f"Re-encoding the GIF for interrupted session {set_id}...")
+            output_path = staged_gif_path(set_id)
+            gif_worker.submit(frames or staged_frames, output_path, GIF_DURATION, profile=GIF_PROFILE,
+                              effects=GIF_EFFECTS, callback=lambda job, set_id=set_id: gif_finished(job, set_id))
+    if unfinished:
+        print(f"Resumed {len(unfinished)} interrupted session(s) from {JOURNAL_PATH}")
+
+def start_deferred_encode():
+    # Redo the oldest deferred archive GIF at the normal profile, if no sessions are queued
+    deferred = session_queue.next_deferred()
+    if deferred is None:
+        return
+    ticket, (set_id,) = deferred
+    image_set = set_index.get(set_id)
+    if image_set is not None and os.path.abspath(image_set['path']).startswith(os.path.abspath(STAGED_SETS_PATH)):
+        # Its staged frames are removed once they're on the card; session_part_done tries again then
+        session_queue.defer(ticket, set_id)
+        return
+    if image_set is None or not all(os.path.exists(p) for p in image_set['frames']):
+        print(f"Set {set_id} has already been removed, its archive keeps the '{ticket.profile}' GIF")
+        session_queue.deferred_finished(ok=False)
+        start_deferred_encode()
+        return
+    print(f"Re-encoding the archive GIF for {set_id} with the '{GIF_PROFILE}' profile...")
+    gif_worker.submit(image_set['frames'], staged_gif_path(set_id), GIF_DURATION,
+                      callback=lambda job: deferred_encode_finished(job, set_id), profile=GIF_PROFILE,
+                      effects=GIF_EFFECTS)
+
+def deferred_encode_finished(job, set_id):
+    if job.error is None:
+        archive.add(set_id, job.result, profile=GIF_PROFILE)  # Replaces the degraded GIF
+        os.remove(job.result)
+    session_queue.deferred_finished(ok=job.error is None)
+    start_deferred_encode()
+
+def archive_changed(set_id, path):
+    # An archived GIF was replaced (re-encoded at a better profile, or shrunk to make room)
+    if set_index.get(set_id) is not None:
+        set_index.set_gif(set_id, path)
+
+def store_recent_gif(output_path):
+    # The GIF is already in ARCHIVE_PATH; this moves the staged copy into the ring
     if not os.path.isfile(output_path):
-        print(f"Error: The GIF {output_path} to be archived does not exist.")
+        print(f"Error: The new GIF {output_path} does not exist.")
         return
-    else:
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        archive_path = os.path.join(ARCHIVE_PATH, f'{timestamp}.gif')
-        print(f"Archiving recent GIF as {archive_path}...")
-        shutil.copy(output_path, archive_path)
-
-    # Now rename the existing recent GIFs
-    for i in range(4, 0, -1):
-        old_path = os.path.join(RECENT_GIFS_PATH, f'recent{i - 1}.gif')
-        new_path = os.path.join(RECENT_GIFS_PATH, f'recent{i}.gif')
-        if os.path.isfile(old_path):
-            print(f"Renaming {old_path} to {new_path}...")
-            shutil.move(old_path, new_path)
 
-    
-def simulate_gif(image_paths):
+    # The new GIF replaces the oldest slot; ring.json records the new order
+    stored_path = recent_gifs.push_file(output_path)
+    print(f"Stored new GIF as {stored_path} (newest of {len(recent_gifs)})")
+
+def playback_sleep(seconds):
+    # Wakes as soon as there's input, so a press for the next session doesn't wait for the next frame
+    renderer.sleep(seconds, wake=lambda: pygame.event.peek(INPUT_READY))
+
+@metrics.timed('simulate_gif')
+def simulate_gif(image_paths, surfaces=None):
+    # Plays the already-decoded burst surfaces when we have them, otherwise the files
     print("Simulating GIF...")
-    for _ in range(NUM_LOOPS_PER_GIF):  # Loop for a fixed number of iterations
-        for image_path in image_paths:
+    # A spinner in the corner while GIFs are still encoding
+    spinner = None
+    if gif_worker.queue_depth():
+        radius = screen_height // 30
+        spinner = renderer.add(Spinner((screen_width - 2 * radius, screen_height - 2 * radius), radius,
+                                       until=lambda: not gif_worker.queue_depth()))
+    # Loop a fixed number of times at the GIF's own frame rate
+    pacer = FramePacer(GIF_DURATION / 1000, histogram=session_jitter, sleep=playback_sleep)
+    try:
+        for index in pacer.schedule(len(image_paths) * NUM_LOOPS_PER_GIF):
+            check_for_quit()  # Picks up a press for the next session
             if not running:  # Check if the simulation should stop early
                 print("Stopping GIF simulation due to ESC key press...")
                 return
-            display_image(image_path)
-            sleep(PHOTO_INTERVAL)  # Wait for the duration of each frame
+            if pending_press is not None:
+                print("Stopping GIF simulation for the next session...")
+                return
+            i = index % len(image_paths)
+            if surfaces is not None:
+                display_surface(surfaces[i], deadline=pacer.deadline)
+            else:
+                display_image(image_paths[i], deadline=pacer.deadline)
+    finally:
+        if spinner is not None:
+            renderer.remove(spinner)
     print("Finished simulating GIF.")
+    frame_cache.print_stats()
 
 def manage_image_directories():
-    # Get all the image set directories
-    all_image_dirs = sorted(Path(TEMP_IMAGES_PATH).glob('*/'), key=os.path.getmtime)
-    
-    # Keep only the 5 most recent directories
-    while len(all_image_dirs) > 5:
-        shutil.rmtree(str(all_image_dirs.pop(0)))  # Remove oldest directory
+    # Sets and archived GIFs are kept while they fit STORAGE_BUDGET_MB and MIN_FREE_MB; past that
+    # the compactor drops and shrinks the oldest ones, once no GIFs are being made
+    compactor.kick()
         
 def check_for_quit():
-    global running, view_mode_active
+    # Handle anything queued while we're busy (quit keys, switch changes, extra presses)
     for event in pygame.event.get():
-        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-            print("ESC key pressed, setting running to False...")
-            running = False
-        elif event.type == pygame.QUIT:
-            print("Quit event detected, setting running to False...")
-            running = False
-
-    # Check the switch state directly
-    if not GPIO.input(SWITCH_PIN) and view_mode_active:
-        print("Switch toggled to DOWN position, exiting view mode...")
-        view_mode_active = False
+        handle_event(event)
 
 def cleanup():
     print("Cleaning up and exiting...")
+    state_machine.print_metrics()
+    input_layer.print_stats()
+    camera.print_stats()
+    session_queue.print_stats()
+    renderer.print_stats()
+    if mosaic is not None:
+        mosaic.print_stats()
+    # Let queued GIFs finish so nothing is left half-written, then the deferred archive encodes they
+    # leave behind (started from encode callbacks, and behind the flusher)
+    while True:
+        gif_worker.wait()
+        flusher.flush()
+        start_deferred_encode()
+        if not gif_worker.queue_depth():
+            break
+    gif_worker.drain()
+    remove_partial_files(RECENT_GIFS_PATH, ARCHIVE_PATH, STAGED_GIFS_PATH)
+    # Then everything staged behind the sessions, so the journal has nothing left to resume
+    flusher.close()
+    flusher.print_stats()
+    compactor.close()
+    archive.print_stats()
+    compactor.print_stats()
+    if gallery_server is not None and gallery_server.ready() and not gallery_server.failed:
+        gallery_server.get().shutdown()
+    asset_cache.print_stats()
+    metrics.close()
+
     try:
         # Remove temp images
         for file in listdir(TEMP_IMAGES_PATH):
@@ -302,29 +837,36 @@ def cleanup():
 
     camera.close()
     pygame.quit()
+    input_layer.close()
+    if INPUT_TRACE_PATH:
+        input_layer.save_trace(INPUT_TRACE_PATH)
+        print(f"Input trace saved to {INPUT_TRACE_PATH}")
     GPIO.cleanup()
 
 # Event detections
 print("Setting up event detections...")
-GPIO.add_event_detect(BUTTON_PIN, GPIO.FALLING, callback=button_callback, bouncetime=int(DEBOUNCE_THRESHOLD * 1000))
-GPIO.add_event_detect(SWITCH_PIN, GPIO.BOTH, callback=switch_callback, bouncetime=300)
+input_layer.watch_button(BUTTON_PIN, DEBOUNCE_WINDOW)
+input_layer.watch_switch(SWITCH_PIN, SWITCH_DEBOUNCE_WINDOW)
 
-# Main Loop
-try:
-    if GPIO.input(SWITCH_PIN):
-        print("Switch is UP at startup, entering view mode...")
-        view_mode_active = True
-        enter_view_mode()
-    else:
-        print("Switch is DOWN at startup, displaying instruction image...")
-        view_mode_active = False
-        display_instruction_flag = True
+# Finish anything the last run left staged
+resume_sessions()
+compactor.start()
+startup.mark('ready')
+for milestone, seconds in startup.report(BOOT_BUDGET).items():
+    metrics.observe(f'startup_{milestone}', seconds)
 
-    while running:
-        check_for_quit()
-        if display_instruction_flag and not view_mode_active:
+# Main Loop
+if __name__ == '__main__':
+    try:
+        if input_layer.level(SWITCH_PIN):
+            print("Switch is UP at startup, entering view mode...")
+            view_mode_active = True
+        else:
+            print("Switch is DOWN at startup, displaying instruction image...")
+            view_mode_active = False
             display_instruction_image()
-            display_instruction_flag = False
-finally:
-    cleanup()
+
+        main_loop()
+    finally:
+        cleanup()
 
@@ -0,0 +1,187 @@
+import random
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+# View mode playlist.
+# Plays the recent sets from the set index one after another, keeping the set
+# on screen resident (its frames are held here, so the frame cache can't evict
+# them mid-loop) while a background thread loads the set after it. When the
+# current set finishes, the next one is normally already decoded and the swap
+# costs nothing; if it isn't, advance() waits for it and counts a stall (the
+# very first set of a run is always a wait and is reported separately).
+#
+# The index is asked for the recent sets every time the next set is picked, so
+# sets captured while view mode is running join the playlist straight away,
+# and a set nobody has seen yet always goes next whatever the order.
+
+RECENCY = 'recency'  # Newest to oldest, then round again
+SHUFFLE = 'shuffle'  # Every set once in a random order, then reshuffle
+WEIGHTED = 'weighted'  # Random, with newer sets picked more often
+
+ORDERS = (RECENCY, SHUFFLE, WEIGHTED)
+
+
+class PlaylistItem:
+    def __init__(self, record, frames, load_seconds):
+        self.record = record  # The set's SetIndex record
+        self.frames = frames  # Screen-ready Surfaces
+        self.load_seconds = load_seconds
+
+    @property
+    def set_id(self):
+        return self.record['id']
+
+
+class Playlist:
+    def __init__(self, set_index, load_frames, count, order=RECENCY, seed=None):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown playlist order {order!r}, expected one of {ORDERS}")
+        self.set_index = set_index
+        self.load_frames = load_frames  # record -> list of Surfaces; runs on the prefetch thread
+        self.count = count  # How many of the most recent sets to play
+        self.order = order
+        self.random = random.Random(seed)
+        self.current = None
+        self.played = 0
+        self.stalls = 0  # Times advance() had to wait for the next set
+        self.stall_seconds = 0.0
+        self.worst_stall = 0.0
+        self.first_wait = None  # Seconds spent waiting for the first set after the last start()
+        self.load_times = []
+        self.failed = 0  # Sets skipped because none of their frames loaded
+        self._seen = None  # Set ids already played (None until start())
+        self._bag = []  # Shuffle order still to play
+        self._next = None  # Future for the next PlaylistItem, set by the prefetch thread
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        # Sets already captured count as seen; only ones captured from now on jump the queue
+        self._stopped.clear()
+        self._seen = {record['id'] for record in self.set_index.recent(self.count)}
+        self._prefetch()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._next = None
+        self.current = None
+
+    def advance(self):
+        # The next set to play (or None if there are no sets), and start loading the one after it
+        if self._thread is None:
+            self._prefetch()
+        waited_from = monotonic()
+        ready = self._next.done()
+        item = self._next.result()
+        waited = monotonic() - waited_from
+        if self.current is None:
+            self.first_wait = waited
+        elif not ready and item is not None:
+            self.stalls += 1
+            self.stall_seconds += waited
+            self.worst_stall = max(self.worst_stall, waited)
+            print(f"Playlist stalled {waited * 1000:.0f} ms waiting for set {item.set_id}")
+        self._thread.join()
+        self._thread = None
+
+        self.current = item
+        if item is not None:
+            self.played += 1
+        self._prefetch()
+        return item
+
+    def _prefetch(self):
+        self._next = Future()
+        self._thread = threading.Thread(target=self._load_next, args=(self._next,), daemon=True)
+        self._thread.start()
+
+    # Runs on the prefetch thread
+    def _load_next(self, future):
+        try:
+            future.set_result(self._load_one())
+        except Exception as e:
+            print(f"Playlist prefetch failed: {e}")
+            future.set_result(None)
+
+    def _load_one(self):
+        tried = set()
+        while not self._stopped.is_set():
+            record = self._pick(tried)
+            if record is None:
+                return None
+            tried.add(record['id'])
+            started = monotonic()
+            frames = self.load_frames(record)
+            if frames:
+                item = PlaylistItem(record, frames, monotonic() - started)
+                self.load_times.append(item.load_seconds)
+                return item
+            self.failed += 1
+            print(f"Playlist skipping set {record['id']}, none of its frames loaded")
+        return None
+
+    def _pick(self, tried):
+        records = [record for record in self.set_index.recent(self.count) if record['id'] not in tried]
+        if not records:
+            return None
+        if self._seen is None:
+            self._seen = set()
+
+        # Sets captured since view mode started go first, newest first
+        for record in records:
+            if record['id'] not in self._seen:
+                self._seen.add(record['id'])
+                return record
+
+        playing = self.current.set_id if self.current is not None else None
+        if len(records) > 1:
+            records = [record for record in records if record['id'] != playing]
+
+        if self.order == RECENCY:
+            # The newest set older than the one playing, or back round to the newest
+            if self.current is not None:
+                older = [record for record in records
+                         if record['captured_at'] < self.current.record['captured_at']]
+                if older:
+                    return older[0]
+            return records[0]
+
+        if self.order == SHUFFLE:
+            by_id = {record['id']: record for record in records}
+            self._bag = [set_id for set_id in self._bag if set_id in by_id]
+            if not self._bag:
+                self._bag = list(by_id)
+                self.random.shuffle(self._bag)
+            return by_id[self._bag.pop()]
+
+        # WEIGHTED: records are newest first, the newest gets weight len(records), the oldest 1
+        weights = range(len(records), 0, -1)
+        return self.random.choices(records, weights=weights)[0]
+
+    def stats(self):
+        load_times = sorted(self.load_times)
+        return {
+            'order': self.order,
+            'played': self.played,
+            'stalls': self.stalls,
+            'stall_seconds': self.stall_seconds,
+            'worst_stall': self.worst_stall,
+            'first_wait': self.first_wait,
+            'failed': self.failed,
+            'load_mean': sum(load_times) / len(load_times) if load_times else None,
+            'load_max': load_times[-1] if load_times else None,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        loads = (f", prefetch mean {s['load_mean'] * 1000:.0f} ms, max {s['load_max'] * 1000:.0f} ms"
+                 if s['load_mean'] is not None else '')
+        first = f", first set after {s['first_wait'] * 1000:.0f} ms" if s['first_wait'] is not None else ''
+        print(f"Playlist ({s['order']}): {s['played']} sets played{first}, {s['stalls']} stalls "
+              f"({s['stall_seconds'] * 1000:.0f} ms total, worst {s['worst_stall'] * 1000:.0f} ms), "
+              f"{s['failed']} skipped{loads}")
@@ -0,0 +1,88 @@
+import mmap
+import os
+import struct
+import sys
+
+import pygame
+
+# Display-ready raw frames.
+# Next to each captured JPEG (image00.jpg) we keep image00.<w>x<h>.raw: the
+# frame already scaled to the screen and laid out in the display's pixel order,
+# behind a small header. Playback memory-maps the file and wraps the mapping as
+# a Surface, so showing a frame is a blit straight from the page cache with no
+# JPEG decode, no scaling and no copy into Python memory. Frames for sets that
+# haven't been shown in a while are simply paged out by the OS.
+
+MAGIC = b'GBRAW1\0\0'
+HEADER = struct.Struct('<8sII8s12x')  # magic, width, height, pygame buffer format; 32 bytes
+
+
+def raw_path(image_path, size):
+    base = os.path.splitext(str(image_path))[0]
+    return f"{base}.{size[0]}x{size[1]}.raw"
+
+
+def pixel_format(surface):
+    # The frombuffer() format whose bytes match the surface's pixel layout, or None
+    if surface.get_bytesize() != 4:
+        return None
+    r, g, b = surface.get_masks()[:3]
+    if sys.byteorder == 'little':
+        layouts = {(0xff0000, 0xff00, 0xff): 'BGRA', (0xff, 0xff00, 0xff0000): 'RGBA'}
+    else:
+        layouts = {(0xff00, 0xff0000, 0xff000000): 'BGRA', (0xff000000, 0xff0000, 0xff00): 'RGBA'}
+    return layouts.get((r, g, b))
+
+
+def write_frame(path, surface, fmt):
+    from gif_worker import write_atomically  # Not at the top: it pulls in the GIF encoder, which a cold start can do without
+
+    width, height = surface.get_size()
+    header = HEADER.pack(MAGIC, width, height, fmt.encode())
+    pixels = pygame.image.tobytes(surface, fmt)
+
+    def write(part_path):
+        with open(part_path, 'wb') as f:
+            f.write(header)
+            f.write(pixels)
+
+    write_atomically(path, write)
+    return path
+
+
+def write_frames(image_paths, surfaces, display):
+    # Write a raw frame for each (JPEG path, screen-sized surface); returns the paths written
+    fmt = pixel_format(display)
+    if fmt is None:
+        print("Display pixel format has no raw frame layout, skipping raw frames")
+        return []
+    paths = []
+    for image_path, surface in zip(image_paths, surfaces):
+        try:
+            paths.append(write_frame(raw_path(image_path, surface.get_size()), surface, fmt))
+        except OSError as e:
+            print(f"Error writing raw frame for {image_path}: {e}")
+    return paths
+
+
+def load_frame(path):
+    # A Surface backed by a read-only mapping of the file, or None if it isn't a usable raw frame
+    try:
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapping) < HEADER.size:
+        mapping.close()
+        return None
+    magic, width, height, fmt = HEADER.unpack_from(mapping)
+    fmt = fmt.rstrip(b'\0').decode()
+    if magic != MAGIC or len(mapping) != HEADER.size + width * height * 4:
+        mapping.close()
+        return None
+    if hasattr(mmap, 'MADV_WILLNEED'):
+        mapping.madvise(mmap.MADV_WILLNEED)  # Start reading the pixels in now, not on the first blit
+    # The Surface holds on to the memoryview, which keeps the mapping alive for as long as it's used
+    surface = pygame.image.frombuffer(memoryview(mapping)[HEADER.size:], (width, height), fmt)
+    surface.set_alpha(None)  # The fourth byte is padding, not alpha
+    return surface
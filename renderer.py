@@ -0,0 +1,270 @@
+import math
+from time import monotonic, sleep
+
+import pygame
+
+# Screen renderer.
+# Owns the display: it opens the window double-buffered and, where the video
+# driver allows it, presenting on vsync, so frames never tear and a present
+# lands on a refresh instead of whenever the blit finished.
+#
+# Whatever is on screen is a base frame (a full-screen Surface or a fill
+# colour) plus overlays drawn on top of it: countdown digits, the flash fading
+# out, a spinner while GIFs are encoding. Changing the base redraws and flips
+# the whole screen; an overlay changing only restores the base under where it
+# was, draws it again and updates those rects, so a spinner ticking over a
+# playing GIF costs a few hundred pixels instead of a full-screen blit.
+#
+# Every present is counted. One that lands more than a refresh after the
+# deadline the caller asked for (a FramePacer's) is a dropped present.
+
+DEFAULT_REFRESH_RATE = 60  # Hz, when the driver can't tell us
+
+
+class Overlay:
+    # Something drawn over the base frame. rect is where it was last drawn.
+    rect = None
+
+    def changed(self, now):
+        # Whether it looks different at `now` than when it was last drawn
+        return False
+
+    def draw(self, target, now):
+        # Draw onto `target` and return the rect drawn
+        raise NotImplementedError
+
+    def done(self, now):
+        # Whether it should be taken off the screen
+        return False
+
+
+class Text(Overlay):
+    # Text centred on a point, e.g. countdown digits
+    def __init__(self, font, center, color=(255, 255, 255)):
+        self.font = font
+        self.center = center
+        self.color = color
+        self._text = None
+        self._surface = None
+        self._changed = False
+
+    def set(self, text):
+        if text != self._text:
+            self._text = text
+            self._surface = self.font.render(text, True, self.color)
+            self._changed = True
+
+    def changed(self, now):
+        return self._changed
+
+    def draw(self, target, now):
+        self._changed = False
+        return target.blit(self._surface, self._surface.get_rect(center=self.center))
+
+
+class Flash(Overlay):
+    # The camera flash: full white, fading back to the base frame over `duration`
+    def __init__(self, duration, started=None):
+        self.duration = duration
+        self.started = monotonic() if started is None else started
+        self._level = None
+        self._white = None
+
+    def level(self, now):
+        return max(0, int(255 * (1 - (now - self.started) / self.duration))) if self.duration > 0 else 0
+
+    def changed(self, now):
+        return self.level(now) != self._level
+
+    def draw(self, target, now):
+        self._level = self.level(now)
+        if self._white is None or self._white.get_size() != target.get_size():
+            self._white = target.copy()
+            self._white.fill((255, 255, 255))
+        self._white.set_alpha(self._level)
+        return target.blit(self._white, (0, 0))
+
+    def done(self, now):
+        return now - self.started >= self.duration
+
+
+class Spinner(Overlay):
+    # A rotating arc, e.g. while GIFs are encoding; `until` says when it can go
+    def __init__(self, center, radius, until=None, period=1.0, steps=24, color=(255, 255, 255)):
+        self.center = center
+        self.radius = radius
+        self.until = until
+        self.period = period  # Seconds per revolution
+        self.steps = steps  # Positions per revolution; it only redraws when it moves to the next one
+        self.color = color
+        self._step = None
+
+    def step(self, now):
+        return int(now / self.period * self.steps) % self.steps
+
+    def changed(self, now):
+        return self.step(now) != self._step
+
+    def draw(self, target, now):
+        self._step = self.step(now)
+        start = 2 * math.pi * self._step / self.steps
+        box = pygame.Rect(0, 0, 2 * self.radius, 2 * self.radius)
+        box.center = self.center
+        return pygame.draw.arc(target, self.color, box, start, start + 1.5 * math.pi, max(2, self.radius // 5))
+
+    def done(self, now):
+        return self.until is not None and self.until()
+
+
+class Renderer:
+    def __init__(self, backend, size=None, vsync=True, refresh_rate=None):
+        self.window, self.vsync = self._open(backend, size, vsync)
+        self.size = self.window.get_size()
+        self.refresh_rate = refresh_rate or DEFAULT_REFRESH_RATE
+        self.refresh_period = 1.0 / self.refresh_rate
+        self.base = None  # Surface under the overlays, or None for a fill
+        self.base_color = (0, 0, 0)
+        self.overlays = []
+        self._dirty = []
+        self._full = False
+        self.presents = 0
+        self.full_presents = 0
+        self.dropped = 0
+        self.present_seconds = 0.0
+        self.worst_present = 0.0
+        self.pixels_presented = 0
+        self.active_seconds = 0.0  # Time between presents that came in a run (less than a second apart)
+        self._last_present = None
+
+    def _open(self, backend, size, vsync):
+        # Double-buffered, presenting on vsync if the driver supports it (SDL needs SCALED for that)
+        if vsync:
+            try:
+                window = backend.open_display(pygame, size, pygame.DOUBLEBUF | pygame.SCALED, vsync=True)
+                print("Display opened with vsync")
+                return window, True
+            except pygame.error as e:
+                print(f"No vsync on this display ({e}), presenting without it")
+        return backend.open_display(pygame, size, pygame.DOUBLEBUF | pygame.HWSURFACE), False
+
+    # Called from the pygame thread
+    def show(self, surface):
+        # Make `surface` the base frame
+        self.base = surface
+        self.window.blit(surface, (0, 0))
+        self._full = True
+
+    def fill(self, color):
+        self.base = None
+        self.base_color = color
+        self.window.fill(color)
+        self._full = True
+
+    def update(self, rects=None):
+        # Mark what was drawn straight onto the window (the given rects, or all of it) for the next present.
+        # The base frame isn't changed, so this is for screens that don't use overlays (the mosaic).
+        if rects is None:
+            self._full = True
+        else:
+            self._dirty.extend(rects)
+
+    def add(self, overlay):
+        self.overlays.append(overlay)
+        return overlay
+
+    def remove(self, overlay):
+        if overlay in self.overlays:
+            self.overlays.remove(overlay)
+            self._restore(overlay.rect)
+
+    def flash(self, duration):
+        # White now, fading to the base frame over `duration` (as the base is changed and presented)
+        self.overlays = [overlay for overlay in self.overlays if not isinstance(overlay, Flash)]
+        return self.add(Flash(duration))
+
+    def _restore(self, rect):
+        if rect is None or self._full:
+            return
+        if self.base is not None:
+            self.window.blit(self.base, rect, rect)
+        else:
+            self.window.fill(self.base_color, rect)
+        self._dirty.append(rect)
+
+    def present(self, deadline=None):
+        # Draw overlays that changed and put everything dirty on screen; returns whether anything was presented
+        now = monotonic()
+        for overlay in [overlay for overlay in self.overlays if overlay.done(now)]:
+            self.remove(overlay)
+        # Overlays can overlap, so if one has to be redrawn they all are, over freshly restored base
+        if self._full or self._dirty or any(overlay.changed(now) for overlay in self.overlays):
+            for overlay in self.overlays:
+                self._restore(overlay.rect)
+            for overlay in self.overlays:
+                overlay.rect = overlay.draw(self.window, now)
+                self._dirty.append(overlay.rect)
+        if not self._full and not self._dirty:
+            return False
+
+        if any(rect.contains(self.window.get_rect()) for rect in self._dirty):
+            self._full = True  # e.g. the flash
+        started = monotonic()
+        if self._full:
+            pygame.display.flip()
+            self.full_presents += 1
+            self.pixels_presented += self.size[0] * self.size[1]
+        else:
+            rects = list({tuple(rect): rect for rect in self._dirty}.values())  # An overlay's restore and redraw often match
+            if len(rects) > 8:
+                rects = [rects[0].unionall(rects[1:])]  # One rect is cheaper than many small ones
+            pygame.display.update(rects)
+            self.pixels_presented += sum(rect.width * rect.height for rect in rects)
+        done = monotonic()
+        self._full = False
+        self._dirty = []
+
+        self.presents += 1
+        self.present_seconds += done - started
+        self.worst_present = max(self.worst_present, done - started)
+        if deadline is not None and done - deadline > self.refresh_period:
+            self.dropped += 1
+        if self._last_present is not None and done - self._last_present < 1.0:
+            self.active_seconds += done - self._last_present
+        self._last_present = done
+        return True
+
+    def sleep(self, seconds, wake=None):
+        # Sleep, keeping animated overlays moving at the refresh rate (a FramePacer's sleep).
+        # With `wake`, it's checked every refresh and the sleep ends early once it returns True.
+        end = monotonic() + seconds
+        while self.overlays or wake is not None:
+            next_refresh = monotonic() + self.refresh_period
+            if next_refresh > end:
+                break
+            if wake is not None and wake():
+                return
+            self.present()
+            sleep(max(0.0, next_refresh - monotonic()))
+        remaining = end - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def stats(self):
+        screen_pixels = self.size[0] * self.size[1]
+        return {
+            'vsync': self.vsync,
+            'presents': self.presents,
+            'full_presents': self.full_presents,
+            'dropped': self.dropped,
+            'fps': self.presents / self.active_seconds if self.active_seconds else 0.0,
+            'present_mean': self.present_seconds / self.presents if self.presents else 0.0,
+            'present_max': self.worst_present,
+            'screen_fraction': self.pixels_presented / (self.presents * screen_pixels) if self.presents else 0.0,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Renderer ({'vsync' if s['vsync'] else 'no vsync'}): {s['presents']} presents "
+              f"({s['full_presents']} full screen, {s['screen_fraction']:.0%} of the screen on average), "
+              f"{s['fps']:.1f} fps while animating, {s['dropped']} dropped, "
+              f"present {s['present_mean'] * 1000:.2f} ms mean, {s['present_max'] * 1000:.1f} ms max")
@@ -0,0 +1,275 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from time import monotonic, perf_counter, time
+
+import config
+import gif_effects
+import gif_encoder
+from archive_store import gif_frames
+from gif_worker import write_atomically
+
+# Batch re-render of past sessions with new GIF settings.
+# Walks the set directories (the booth's gif_temp/<timestamp>, the older
+# gbooth_recent/setN) and the GIF archive, and re-encodes every session into an
+# output directory across a pool of processes, one per core. A session whose
+# set is gone is re-encoded from its archived GIF. Each output is named after
+# its session and written under a '.part' name, then renamed into place.
+#
+# Every finished session is appended to a checkpoint in the output directory
+# with a key: the hash of its input files plus the settings (profile and its
+# encoder parameters, frame duration, effects). A session is skipped when its
+# output exists and its key hasn't changed, so an interrupted run picks up
+# where it stopped and a re-run only redoes what changed.
+#
+# Safe to run while the booth is live: inputs are only read (the archive
+# manifest directly, never through ArchiveStore, which may rename files), sets
+# the booth touched in the last LIVE_MARGIN seconds are left for the next run,
+# files that vanish mid-run (compacted or expired) are skipped, and the workers
+# run at low priority so capture and playback keep the CPU.
+#
+#   python rerender.py --profile quality --duration 400
+#   python rerender.py --effects 'grade:warm,boomerang' --out /media/usb/rerender --workers 2
+
+CHECKPOINT_NAME = 'rerender.checkpoint'
+LIVE_MARGIN = 30  # Seconds since a set was last written before it's treated as finished
+NICENESS = 10  # Added to the workers' (and this process's) nice value
+REPORT_INTERVAL = 5.0  # Seconds between progress lines
+
+RENDERED = 'rendered'
+SKIPPED = 'skipped'
+VANISHED = 'vanished'
+FAILED = 'failed'
+
+
+def settings_key(profile, duration, effects):
+    # What the output depends on besides its inputs; a change to any of it re-renders everything
+    settings = {'profile': profile, 'encoder': gif_encoder.PROFILES[profile], 'duration': duration,
+                'effects': effects}
+    return json.dumps(settings, sort_keys=True)
+
+
+def find_sessions(set_roots, archive_path, archive_manifest, margin=LIVE_MARGIN):
+    # [(name, kind, inputs)], kind 'set' (JPEG paths) or 'gif' (an archived GIF), oldest first.
+    # A session with both a set and an archived GIF is rendered from the set's originals.
+    sessions, names, now = [], set(), time()
+    for root in set_roots:
+        try:
+            set_dirs = sorted((e for e in os.scandir(root) if e.is_dir()), key=lambda e: e.stat().st_mtime)
+        except OSError:
+            continue
+        for set_dir in set_dirs:
+            frames = sorted(glob.glob(os.path.join(set_dir.path, '*.jpg')))
+            if not frames:
+                continue
+            if glob.glob(os.path.join(set_dir.path, '*.part')) or \
+                    now - max(os.path.getmtime(p) for p in frames + [set_dir.path]) < margin:
+                print(f"Leaving {set_dir.path} for the next run, the booth may still be writing it")
+                continue
+            name = set_dir.name if set_dir.name not in names else f'{os.path.basename(os.path.normpath(root))}-{set_dir.name}'
+            names.add(name)
+            sessions.append((name, 'set', frames))
+
+    for entry_id, path in archived_gifs(archive_path, archive_manifest) if archive_path else []:
+        if entry_id not in names:
+            names.add(entry_id)
+            sessions.append((entry_id, 'gif', [path]))
+    return sessions
+
+
+def archived_gifs(archive_path, archive_manifest):
+    # (session id, GIF path) for each archived GIF, read without touching the archive
+    try:
+        with open(archive_manifest) as f:
+            entries = json.load(f)['entries']
+        return [(entry['id'], os.path.join(archive_path, entry['blob'])) for entry in entries]
+    except (OSError, ValueError, KeyError):
+        pass
+    # No manifest (an archive from before the store): GIFs named by session
+    try:
+        names = sorted(name for name in os.listdir(archive_path) if name.endswith('.gif'))
+    except OSError:
+        return []
+    return [(name[:-len('.gif')], os.path.join(archive_path, name)) for name in names]
+
+
+def lower_priority():
+    try:
+        os.nice(NICENESS)
+    except OSError:
+        pass
+
+
+def render_session(name, kind, inputs, output_path, settings, done_key):
+    # Runs in a worker process. Returns (name, status, key, bytes read, bytes written, seconds).
+    start = perf_counter()
+    try:
+        digest = hashlib.sha256(settings.encode())
+        read = 0
+        for path in inputs:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+                    read += len(chunk)
+        key = digest.hexdigest()[:32]
+        if key == done_key and os.path.exists(output_path):
+            return name, SKIPPED, key, read, 0, perf_counter() - start
+
+        options = json.loads(settings)
+        if kind == 'gif':
+            frames, _ = gif_frames(inputs[0])
+            effects = gif_effects.Effects()  # Effects are already baked into an archived GIF
+        else:
+            frames = inputs
+            effects = gif_effects.get(options['effects'])
+        stats = {}
+        write_atomically(output_path, lambda part: stats.update(
+            gif_encoder.encode(frames, part, options['duration'], options['profile'], effects)))
+        return name, RENDERED, key, read, stats['bytes'], perf_counter() - start
+    except FileNotFoundError:
+        return name, VANISHED, None, 0, 0, perf_counter() - start  # Expired or compacted by the booth
+    except Exception as e:
+        print(f"Error re-rendering {name}: {e}")
+        return name, FAILED, None, 0, 0, perf_counter() - start
+
+
+class Checkpoint:
+    # Output name -> key of the inputs and settings it was rendered from, appended as each one finishes
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A line torn by an interrupted run
+                    self.keys[record['name']] = record['key']
+        except OSError:
+            pass
+        self._file = None
+
+    def record(self, name, key):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps({'name': name, 'key': key}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.keys[name] = key
+
+    def close(self):
+        # Rewrite it with one line per output
+        if self._file is not None:
+            self._file.close()
+
+        def write(part_path):
+            with open(part_path, 'w') as f:
+                f.write(''.join(json.dumps({'name': name, 'key': key}) + '\n' for name, key in self.keys.items()))
+
+        write_atomically(self.path, write)
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.counts = {RENDERED: 0, SKIPPED: 0, VANISHED: 0, FAILED: 0}
+        self.read = 0
+        self.written = 0
+        self.start = monotonic()
+        self._last_report = self.start
+
+    def add(self, status, read, written):
+        self.counts[status] += 1
+        self.read += read
+        self.written += written
+        if monotonic() - self._last_report >= REPORT_INTERVAL:
+            self._last_report = monotonic()
+            self.print_line()
+
+    def print_line(self, final=False):
+        elapsed = max(monotonic() - self.start, 1e-9)
+        done = sum(self.counts.values())
+        print(f"{'Done' if final else 'Progress'}: {done}/{self.total} sessions in {elapsed:.1f}s "
+              f"({self.counts[RENDERED]} rendered, {self.counts[SKIPPED]} up to date, "
+              f"{self.counts[VANISHED]} gone, {self.counts[FAILED]} failed); "
+              f"{self.counts[RENDERED] / elapsed:.2f} sets/s, {self.read / (1024 * 1024) / elapsed:.1f} MB/s read, "
+              f"{self.written / (1024 * 1024):.1f} MB written")
+
+
+def rerender(sessions, out_dir, profile, duration, effects, workers=None, force=False):
+    os.makedirs(out_dir, exist_ok=True)
+    gif_effects.parse(effects)  # A bad spec stops here rather than failing every session
+    settings = settings_key(profile, duration, effects)
+    checkpoint = Checkpoint(os.path.join(out_dir, CHECKPOINT_NAME))
+    progress = Progress(len(sessions))
+    workers = workers or os.cpu_count()
+    print(f"Re-rendering {len(sessions)} sessions into {out_dir} with {workers} workers "
+          f"('{profile}' profile, {duration} ms frames{', effects ' + effects if effects else ''})")
+
+    lower_priority()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=lower_priority)
+    pending = set()
+    todo = iter(sessions)
+    try:
+        while True:
+            # Only a couple of sessions per worker in flight, so a big archive isn't all queued up at once
+            for name, kind, inputs in todo:
+                done_key = None if force else checkpoint.keys.get(name)
+                pending.add(executor.submit(render_session, name, kind, inputs,
+                                            os.path.join(out_dir, f'{name}.gif'), settings, done_key))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, status, key, read, written, _ = future.result()
+                if status == RENDERED:
+                    checkpoint.record(name, key)
+                progress.add(status, read, written)
+    except KeyboardInterrupt:
+        print("Interrupted; the next run carries on from the checkpoint")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        checkpoint.close()
+        progress.print_line(final=True)
+    return progress.counts
+
+
+def main():
+    home = config.gifbooth_home
+    parser = argparse.ArgumentParser(description='Re-render past sessions with new GIF settings.')
+    parser.add_argument('--sets', action='append',
+                        help='Directory of set directories (repeatable; default: gif_temp and gbooth_recent)')
+    parser.add_argument('--archive', default=os.path.join(home, 'gif_archive'), help='GIF archive directory')
+    parser.add_argument('--archive-manifest', default=os.path.join(home, 'gif_archive.json'),
+                        help="The archive's manifest (read only)")
+    parser.add_argument('--no-archive', action='store_true', help='Only re-render sessions whose sets still exist')
+    parser.add_argument('--out', default=os.path.join(home, 'gif_rerender'), help='Where the new GIFs go')
+    parser.add_argument('--profile', default=gif_encoder.DEFAULT_PROFILE, choices=sorted(gif_encoder.PROFILES))
+    parser.add_argument('--duration', type=int, default=config.gif_frame_duration, help='Frame duration in milliseconds')
+    parser.add_argument('--effects', default=config.gif_effects, help="Effects chain, e.g. 'grade:warm,boomerang'")
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='Re-render even what is up to date')
+    args = parser.parse_args()
+
+    set_roots = args.sets or [os.path.join(home, 'gif_temp'), config.recent_sets_path]
+    sessions = find_sessions(set_roots, None if args.no_archive else args.archive, args.archive_manifest)
+    try:
+        counts = rerender(sessions, args.out, args.profile, args.duration, args.effects, args.workers, args.force)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.exit(1 if counts[FAILED] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import errno
+import json
+import os
+import shutil
+import threading
+
+# Fixed-slot ring buffer for the most recent GIFs or photo sets.
+# Items live in N fixed slots (e.g. recent0.gif..recent4.gif or set1..set5) and a
+# small head file (ring.json) says which slot is newest. Adding an item only
+# overwrites the oldest slot and then rewrites the head file with one atomic
+# rename, so rotation costs the same however many slots there are and a crash
+# can never leave a gap or a duplicate. Readers resolve "recent k" through
+# recent(k) (or the 'recent' list in ring.json) instead of assuming slot names.
+
+HEAD_FILE = 'ring.json'
+
+
+class RingStore:
+    def __init__(self, root, slots, name_format, first=0):
+        # name_format.format(first + i) names slot i
+        self.root = str(root)
+        self.slots = slots
+        self.name_format = name_format
+        self.first = first
+        self.head_path = os.path.join(self.root, HEAD_FILE)
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._remove_leftovers()
+        self.head, self.count, self.seq = self._load_head()
+
+    def slot_name(self, slot):
+        return self.name_format.format(self.first + slot)
+
+    def slot_path(self, slot):
+        return os.path.join(self.root, self.slot_name(slot))
+
+    def _load_head(self):
+        try:
+            with open(self.head_path) as f:
+                head = json.load(f)
+            if head['slots'] == self.slots:
+                return head['head'], head['count'], head['seq']
+            print(f"Ring in {self.root} changed from {head['slots']} to {self.slots} slots, re-reading slots...")
+        except (OSError, ValueError, KeyError):
+            pass
+        # No head file yet: adopt the old layout, where the first slot was the newest
+        count = 0
+        while count < self.slots and os.path.exists(self.slot_path(count)):
+            count += 1
+        return 0, count, 0
+
+    def _write_head(self):
+        head = {
+            'head': self.head,
+            'count': self.count,
+            'slots': self.slots,
+            'seq': self.seq,
+            'recent': [self.slot_name(self._slot(k)) for k in range(self.count)],
+        }
+        part_path = self.head_path + '.part'
+        with open(part_path, 'w') as f:
+            json.dump(head, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_path, self.head_path)
+
+    def _remove_leftovers(self):
+        # Clear out half-built slots from a push that was interrupted
+        for name in os.listdir(self.root):
+            if name.endswith('.part') or name.endswith('.old'):
+                path = os.path.join(self.root, name)
+                print(f"Removing leftover {path}...")
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+    def _slot(self, k):
+        return (self.head + k) % self.slots
+
+    def _advance(self):
+        # The slot about to be recycled: the oldest, or the next free one
+        return (self.head - 1) % self.slots
+
+    def push_file(self, source_path):
+        # Move a finished file into the ring as the newest item
+        with self._lock:
+            slot = self._advance()
+            path = self.slot_path(slot)
+            try:
+                os.replace(source_path, path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # From another filesystem (e.g. staging in RAM): copy it in under a temporary name first
+                shutil.copyfile(source_path, path + '.part')
+                os.replace(path + '.part', path)
+                os.remove(source_path)
+            self._commit(slot)
+            return path
+
+    def push_dir(self, fill):
+        # Build a new directory with fill(path) and put it in the ring as the newest item
+        with self._lock:
+            slot = self._advance()
+            path = self.slot_path(slot)
+            part_path, old_path = path + '.part', path + '.old'
+            os.makedirs(part_path)
+            fill(part_path)
+            if os.path.exists(path):
+                os.rename(path, old_path)
+            os.rename(part_path, path)
+            self._commit(slot)
+            if os.path.exists(old_path):
+                shutil.rmtree(old_path)
+            return path
+
+    def _commit(self, slot):
+        self.head = slot
+        self.count = min(self.count + 1, self.slots)
+        self.seq += 1
+        self._write_head()
+
+    def recent(self, k=0):
+        # Path of the k-th most recent item (0 is the newest), or None
+        with self._lock:
+            if k >= self.count:
+                return None
+            return self.slot_path(self._slot(k))
+
+    def recent_paths(self):
+        # Every item, newest first
+        with self._lock:
+            return [self.slot_path(self._slot(k)) for k in range(self.count)]
+
+    def __len__(self):
+        return self.count
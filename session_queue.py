@@ -0,0 +1,116 @@
+import threading
+from collections import Counter, OrderedDict, deque
+from time import monotonic
+
+# Session queue.
+# A session is in the queue from the moment its press is accepted until its
+# GIF is finished, so a guest can start shooting as soon as the previous burst
+# is over while earlier GIFs are still encoding. The queue is bounded, and the
+# deeper it gets the less work a new session is allowed to make:
+#
+#   below high_water   the normal encode profile, archived as usual
+#   at high_water      the cheap profile, and the archive's full encode is
+#                      deferred until the queue has emptied (the archive gets
+#                      the cheap GIF in the meantime, so nothing is missing)
+#   at max_depth       the press is refused until a GIF finishes
+#
+# Every decision is printed and counted, and stats() gives the current depth
+# for /metrics.
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+REFUSED = 'refused'
+
+
+class Ticket:
+    def __init__(self, decision, profile, defer_archive, depth):
+        self.decision = decision
+        self.profile = profile  # Encode profile for this session's GIF
+        self.defer_archive = defer_archive  # Re-encode the archive copy at the normal profile once the queue is idle
+        self.depth = depth  # Sessions already queued when this one was admitted
+        self.set_id = None
+        self.admitted_at = monotonic()
+
+
+class SessionQueue:
+    def __init__(self, max_depth, high_water, profile, degraded_profile):
+        self.max_depth = max_depth
+        self.high_water = high_water
+        self.profile = profile
+        self.degraded_profile = degraded_profile
+        self.sessions = OrderedDict()  # id(ticket) -> ticket, oldest first
+        self.deferred = deque()  # (ticket, args) for archive encodes waiting for the queue to empty
+        self.decisions = Counter()
+        self.deferred_done = 0
+        self.deferred_lost = 0  # Deferred encodes given up on (the set's frames had already gone)
+        self.max_seen = 0
+        self._lock = threading.Lock()
+
+    def admit(self):
+        # A Ticket for a new session, or None if the queue is full
+        with self._lock:
+            depth = len(self.sessions)
+            if depth >= self.max_depth:
+                self.decisions[REFUSED] += 1
+                print(f"Session queue full ({depth} of {self.max_depth}), refusing the press")
+                return None
+            if depth >= self.high_water:
+                ticket = Ticket(DEGRADED, self.degraded_profile, True, depth)
+                print(f"Session queue at {depth} (high water {self.high_water}): "
+                      f"'{self.degraded_profile}' profile, archive encode deferred")
+            else:
+                ticket = Ticket(NORMAL, self.profile, False, depth)
+            self.decisions[ticket.decision] += 1
+            self.sessions[id(ticket)] = ticket
+            self.max_seen = max(self.max_seen, len(self.sessions))
+            return ticket
+
+    def release(self, ticket):
+        # The session's GIF is finished (or the session was abandoned); returns the queue depth left
+        with self._lock:
+            self.sessions.pop(id(ticket), None)
+            return len(self.sessions)
+
+    def defer(self, ticket, *args):
+        # Put off the session's full archive encode; args are whatever the caller needs to run it later
+        with self._lock:
+            self.deferred.append((ticket, args))
+
+    def next_deferred(self):
+        # (ticket, args) for the oldest deferred archive encode once no sessions are queued, else None
+        with self._lock:
+            if self.sessions or not self.deferred:
+                return None
+            return self.deferred.popleft()
+
+    def deferred_finished(self, ok):
+        with self._lock:
+            if ok:
+                self.deferred_done += 1
+            else:
+                self.deferred_lost += 1
+
+    def depth(self):
+        with self._lock:
+            return len(self.sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self.sessions),
+                'max_depth': self.max_depth,
+                'high_water': self.high_water,
+                'max_seen': self.max_seen,
+                'normal': self.decisions[NORMAL],
+                'degraded': self.decisions[DEGRADED],
+                'refused': self.decisions[REFUSED],
+                'deferred_pending': len(self.deferred),
+                'deferred_done': self.deferred_done,
+                'deferred_lost': self.deferred_lost,
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Session queue: {s['normal']} normal, {s['degraded']} degraded, {s['refused']} refused; "
+              f"deepest {s['max_seen']} of {s['max_depth']} (high water {s['high_water']}); deferred archive "
+              f"encodes {s['deferred_done']} done, {s['deferred_pending']} pending, {s['deferred_lost']} lost")
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Index of captured image sets.
+# Keeps every set's frames, capture time and GIF in memory, oldest first, and
+# mirrors it to a small JSON manifest. The capture path adds sets as they are
+# written, so view mode and retention ask the index for the most recent sets
+# instead of globbing and stat'ing the set directories on every pass. The
+# directory tree is only scanned when there is no manifest to load.
+
+
+class SetIndex:
+    def __init__(self, sets_path, manifest_path):
+        self.sets_path = str(sets_path)
+        self.manifest_path = str(manifest_path)
+        self._sets = OrderedDict()  # set id -> record, oldest first
+        self._pending_gifs = {}  # GIFs that finished before their set was written
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # One save at a time, so the newest snapshot is the one left on disk
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                records = json.load(f)['sets']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"No usable set manifest at {self.manifest_path} ({e}), scanning {self.sets_path}...")
+            self.rebuild()
+            return
+        with self._lock:
+            self._sets = OrderedDict((record['id'], record) for record in records)
+        print(f"Loaded {len(records)} sets from {self.manifest_path}")
+
+    def rebuild(self):
+        # One-off scan of the set directories, oldest first
+        set_dirs = sorted((p for p in Path(self.sets_path).glob('*/') if p.is_dir()), key=os.path.getmtime)
+        with self._lock:
+            self._sets = OrderedDict()
+            for set_dir in set_dirs:
+                frames = [str(p) for p in sorted(set_dir.glob('*.jpg'))]
+                self._sets[set_dir.name] = self._record(set_dir.name, set_dir, frames, os.path.getmtime(set_dir))
+        self.save()
+
+    def _record(self, set_id, path, frames, captured_at, gif=None):
+        return {'id': set_id, 'path': str(path), 'frames': list(frames), 'captured_at': captured_at, 'gif': gif}
+
+    def save(self):
+        # Write the manifest to a temporary file and rename it into place. Saves come from the
+        # capture, flusher, GIF and compactor threads; the snapshot is taken under the save lock
+        # too, so they land in order (readers only wait for the snapshot, not the write).
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps({'sets': list(self._sets.values())}, indent=1)
+            part_path = self.manifest_path + '.part'
+            with open(part_path, 'w') as f:
+                f.write(data)
+            os.replace(part_path, self.manifest_path)
+
+    def add_set(self, set_id, path, frames, captured_at):
+        with self._lock:
+            gif = self._pending_gifs.pop(set_id, None)
+            self._sets[set_id] = self._record(set_id, path, frames, captured_at, gif)
+            self._sets.move_to_end(set_id)
+        self.save()
+
+    def set_gif(self, set_id, gif_path):
+        with self._lock:
+            if set_id in self._sets:
+                self._sets[set_id]['gif'] = str(gif_path)
+            else:
+                self._pending_gifs[set_id] = str(gif_path)
+                return
+        self.save()
+
+    def relocate(self, set_id, path, frames):
+        # Point a set at another copy of its files (staged -> on the card); False if it has been expired
+        with self._lock:
+            record = self._sets.get(set_id)
+            if record is None:
+                return False
+            record['path'], record['frames'] = str(path), list(frames)
+        self.save()
+        return True
+
+    def discard(self, set_id):
+        # Drop a set whose files are gone
+        with self._lock:
+            if self._sets.pop(set_id, None) is None:
+                return
+        self.save()
+
+    def get(self, set_id):
+        with self._lock:
+            return self._sets.get(set_id)
+
+    def recent(self, count):
+        # The `count` most recent sets, newest first
+        with self._lock:
+            records = []
+            for set_id in reversed(self._sets):
+                if len(records) == count:
+                    break
+                records.append(self._sets[set_id])
+            return records
+
+    def expire(self, keep):
+        # Drop all but the `keep` newest sets from the index and return them, oldest first
+        with self._lock:
+            expired = []
+            while len(self._sets) > keep:
+                expired.append(self._sets.popitem(last=False)[1])
+        if expired:
+            self.save()
+        return expired
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sets)
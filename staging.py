@@ -0,0 +1,303 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict, deque
+from time import monotonic, time
+
+# Write-behind staging for session files.
+# A session's working files (the burst's JPEGs and raw frames, the GIF as it's
+# encoded) are written to a staging directory in RAM (tmpfs, /dev/shm on the
+# Pi), so capture and encoding never wait on the SD card. A Flusher thread
+# copies them to their persistent home in batches: each file is written under a
+# '.part' name, fsync'd, renamed into place and given its staged copy's mtime
+# (so raw frames stay newer than their JPEGs), and each directory touched is
+# fsync'd once per batch rather than once per file.
+#
+# Copies, records and callbacks can name the part of a session they belong to
+# (e.g. '<set id>/frames'). If one of a part's copies fails (the card is full,
+# or failing), everything queued for that part after it is dropped: its
+# records aren't journalled and its callbacks don't run, so nothing removes the
+# staged files and the journal leaves the session for the next start to retry.
+#
+# The Journal is an append-only file of JSON lines, one per session state
+# change. The flusher appends a batch's records only once the files queued
+# before them are on disk, so the journal never claims more than the card
+# holds. At startup, unfinished() says how far each interrupted session got:
+#
+#   captured    frames are in staging (lost if the power went)
+#   persisted   frames are on the card
+#   encoded     the GIF is in staging
+#   archived    the GIF is on the card
+#   done        everything is on the card and staging has been cleared
+#   abandoned   given up on (its frames were lost)
+
+STAGING_SHM = '/dev/shm'
+PART_SUFFIX = '.part'
+DONE = 'done'
+ABANDONED = 'abandoned'
+
+
+def default_staging_path(name, fallback):
+    # A directory in RAM if the system has a tmpfs at /dev/shm, else `fallback`
+    return os.path.join(STAGING_SHM, name) if os.path.isdir(STAGING_SHM) else fallback
+
+
+def fsync_dir(path):
+    # Make renames in a directory durable (not every filesystem allows it)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def append(self, records):
+        # Write the records and fsync: one write for the whole batch
+        if not records:
+            return
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self):
+        # Each session's record with its fields merged in order, oldest session first
+        sessions = OrderedDict()
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except OSError:
+            return sessions
+        for number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn last line is what a power cut mid-append leaves; anything else is worth a mention
+                if number < len(lines):
+                    print(f"Skipping unreadable line {number} of {self.path}")
+                continue
+            sessions.setdefault(record['session'], {}).update(record)
+        return sessions
+
+    def unfinished(self):
+        return OrderedDict((session, record) for session, record in self.load().items()
+                           if record['state'] not in (DONE, ABANDONED))
+
+    def compact(self):
+        # Rewrite the journal with just the unfinished sessions, one merged line each
+        unfinished = self.unfinished()
+        part_path = self.path + PART_SUFFIX
+        with open(part_path, 'w') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in unfinished.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_path, self.path)
+        fsync_dir(os.path.dirname(self.path) or '.')
+        return unfinished
+
+
+class Flusher:
+    def __init__(self, journal, interval=2.0, max_batch=64):
+        self.journal = journal
+        self.interval = interval  # Seconds work can wait to be batched with more
+        self.max_batch = max_batch  # Queued items that start a batch straight away
+        self._queue = deque()  # (time queued, ('copy', part, staged, persistent) / ('record', part, record) / ('call', part, fn))
+        self._failed_parts = set()  # Parts with a copy that didn't make it to the card (flusher thread only)
+        self._cond = threading.Condition()
+        self._busy = False
+        self._flushing = 0  # Threads waiting in flush(), which want a batch now
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='staging-flusher', daemon=True)
+        self.batches = 0
+        self.files = 0
+        self.bytes = 0
+        self.records = 0
+        self.errors = 0
+        self.dropped = 0  # Records and callbacks dropped because a copy they depend on failed
+        self.flush_seconds = 0.0
+        self.worst_batch = 0.0
+        self.worst_lag = 0.0  # Longest an item waited between being queued and being on the card
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    # Called from any thread
+    def copy(self, staged_path, persistent_path, part=None):
+        # Copy a staged file to the card (the staged copy is left for its owner to remove)
+        self._put(('copy', part, str(staged_path), str(persistent_path)))
+
+    def record(self, session, state, part=None, **fields):
+        # Journal a state change, once everything queued before it is on the card
+        # (dropped if a copy queued before it for the same part failed)
+        self._put(('record', part, dict(fields, session=session, state=state, time=time())))
+
+    def after(self, fn, part=None):
+        # Call fn() on the flusher thread once everything queued before it is on the card
+        # (not at all if a copy queued before it for the same part failed)
+        self._put(('call', part, fn))
+
+    def _put(self, item):
+        with self._cond:
+            self._queue.append((monotonic(), item))
+            if len(self._queue) == 1 or len(self._queue) >= self.max_batch:
+                self._cond.notify_all()  # Start the interval, or the batch
+
+    def backlog(self):
+        with self._cond:
+            return len(self._queue) + (1 if self._busy else 0)
+
+    def flush(self, timeout=None):
+        # Write everything queued so far now and wait for it; returns False on timeout
+        end = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._queue or self._busy:
+                    remaining = None if end is None else end - monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+        return True
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    # The flusher thread
+    def _ready(self):
+        # Whether to start a batch: the oldest item has waited `interval`, the batch is full, or someone's waiting
+        return bool(self._queue) and (self._flushing or self._stop or len(self._queue) >= self.max_batch
+                                      or monotonic() - self._queue[0][0] >= self.interval)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready():
+                    if self._stop:
+                        return
+                    self._cond.wait(max(0.0, self._queue[0][0] + self.interval - monotonic())
+                                    if self._queue else None)
+                batch = list(self._queue)
+                self._queue.clear()
+                self._busy = True
+            try:
+                self._flush_batch(batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _flush_batch(self, batch):
+        start = monotonic()
+        copies, records = [], []
+        for _, (kind, part, *args) in batch:
+            if kind == 'copy':
+                copies.append((part, *args))
+                continue
+            # Whatever was queued after a copy only happens once the copy is durable
+            self._failed_parts |= self._copy_all(copies)
+            copies = []
+            if part is not None and part in self._failed_parts:
+                self.dropped += 1
+                print(f"Not {'journalling' if kind == 'record' else 'finishing'} {part}: its files didn't reach the card")
+            elif kind == 'record':
+                records.append(args[0])
+            else:
+                self._journal(records)
+                records = []
+                try:
+                    args[0]()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error in staging callback: {e}")
+        self._failed_parts |= self._copy_all(copies)
+        self._journal(records)
+
+        done = monotonic()
+        self.batches += 1
+        self.flush_seconds += done - start
+        self.worst_batch = max(self.worst_batch, done - start)
+        self.worst_lag = max(self.worst_lag, done - batch[0][0])
+
+    def _copy_all(self, copies):
+        # Returns the parts that had a copy fail (a part that already failed isn't copied again)
+        dirs, failed = set(), set()
+        for part, staged_path, persistent_path in copies:
+            if part is not None and (part in failed or part in self._failed_parts):
+                continue
+            if self._copy(staged_path, persistent_path):
+                dirs.add(os.path.dirname(persistent_path))
+            elif part is not None:
+                failed.add(part)
+        for path in dirs:
+            fsync_dir(path)  # Once per directory per batch, for all the renames into it
+        return failed
+
+    def _copy(self, staged_path, persistent_path):
+        part_path = persistent_path + PART_SUFFIX
+        try:
+            os.makedirs(os.path.dirname(persistent_path), exist_ok=True)
+            with open(staged_path, 'rb') as source, open(part_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+                target.flush()
+                os.fsync(target.fileno())
+            shutil.copystat(staged_path, part_path)  # Keep the mtime: a raw frame must stay newer than its JPEG
+            os.replace(part_path, persistent_path)
+        except OSError as e:
+            self.errors += 1
+            print(f"Error flushing {staged_path} to {persistent_path}: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return False
+        self.files += 1
+        self.bytes += os.path.getsize(persistent_path)
+        return True
+
+    def _journal(self, records):
+        if not records:
+            return
+        try:
+            self.journal.append(records)
+            self.records += len(records)
+        except OSError as e:
+            self.errors += 1
+            print(f"Error appending to the journal {self.journal.path}: {e}")
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'files': self.files,
+            'bytes': self.bytes,
+            'records': self.records,
+            'errors': self.errors,
+            'dropped': self.dropped,
+            'batch_mean': self.flush_seconds / self.batches if self.batches else 0.0,
+            'batch_max': self.worst_batch,
+            'lag_max': self.worst_lag,
+            'backlog': self.backlog(),
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Write-behind: {s['files']} files ({s['bytes'] / (1024 * 1024):.1f} MB) and {s['records']} journal "
+              f"records in {s['batches']} batches, {s['batch_mean'] * 1000:.0f} ms mean, "
+              f"{s['batch_max'] * 1000:.0f} ms max; longest wait for the card {s['lag_max']:.1f}s, "
+              f"{s['errors']} errors ({s['dropped']} records and callbacks dropped), {s['backlog']} still queued")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The booth modules live at the top of the checkout; run headless on the fake backend
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
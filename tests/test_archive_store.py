@@ -0,0 +1,51 @@
+import json
+import threading
+
+from archive_store import ArchiveStore
+
+
+def write_gif(path, content):
+    path.write_bytes(b'GIF89a' + content)
+    return str(path)
+
+
+def test_manifest_round_trip_and_dedupe(tmp_path):
+    store = ArchiveStore(tmp_path / 'archive', tmp_path / 'archive.json')
+    store.add('a', write_gif(tmp_path / 'a.gif', b'same'), profile='speed')
+    store.add('b', write_gif(tmp_path / 'b.gif', b'same'), profile='speed')  # Stored once
+    store.add('c', write_gif(tmp_path / 'c.gif', b'other'), profile='quality')
+    assert store.deduplicated == 1
+    assert len(list((tmp_path / 'archive').iterdir())) == 2
+
+    reloaded = ArchiveStore(tmp_path / 'archive', tmp_path / 'archive.json')
+    assert [entry['id'] for entry in reloaded.recent()] == ['c', 'b', 'a']
+    assert reloaded.get('a')['path'] == reloaded.get('b')['path']
+    reloaded.remove('a')
+    assert len(list((tmp_path / 'archive').iterdir())) == 2  # 'b' still uses the shared GIF
+    reloaded.remove('b')
+    assert len(list((tmp_path / 'archive').iterdir())) == 1
+
+
+def test_concurrent_saves(tmp_path):
+    # Adds from the flusher and GIF callbacks, removes from the compactor, all at once
+    store = ArchiveStore(tmp_path / 'archive', tmp_path / 'archive.json')
+    errors = []
+
+    def work(thread):
+        try:
+            for i in range(40):
+                entry_id = f'{thread}-{i}'
+                store.add(entry_id, write_gif(tmp_path / f'{entry_id}.gif', entry_id.encode()))
+                if i % 2:
+                    store.remove(entry_id)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    entries = json.loads((tmp_path / 'archive.json').read_text())['entries']
+    assert len(entries) == 160 and len(store.recent()) == 160
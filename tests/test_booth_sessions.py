@@ -0,0 +1,51 @@
+import os
+import shutil
+
+import pytest
+
+import backends
+from bench_session import load_booth, make_scratch_home
+
+
+class FailedJob:
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.error = RuntimeError("encoder crashed")
+
+
+@pytest.fixture
+def booth(monkeypatch):
+    home = make_scratch_home()
+    for name in ('GIFBOOTH_HOME', 'GIFBOOTH_GALLERY_PORT', 'GIFBOOTH_STAGING'):
+        monkeypatch.delenv(name, raising=False)  # load_booth sets them; put them back afterwards
+    booth = load_booth(backends.FakeBackend(screen_size=(64, 36)), home)
+    yield booth
+    booth.cleanup()
+    backends.set_backend(None)
+    shutil.rmtree(home, ignore_errors=True)
+
+
+def stage_set(booth, set_id):
+    staged_dir = os.path.join(booth.STAGED_SETS_PATH, set_id)
+    os.makedirs(staged_dir)
+    frames = []
+    for i in range(booth.NUM_PHOTOS):
+        frame = os.path.join(staged_dir, f'image{i:02d}.jpg')
+        with open(frame, 'wb') as f:
+            f.write(b'jpeg')
+        frames.append(frame)
+    booth.set_index.add_set(set_id, staged_dir, frames, 0.0)
+    return staged_dir, frames
+
+
+def test_failed_encode_still_finishes_the_session(booth):
+    # The set is kept without a GIF: it still goes to the card and leaves staging
+    staged_dir, frames = stage_set(booth, 'failed-encode')
+    booth.gif_finished(FailedJob(booth.staged_gif_path('failed-encode')), 'failed-encode')
+    booth.persist_set('failed-encode', staged_dir, frames)
+    booth.flusher.flush()
+
+    assert not os.path.exists(staged_dir)
+    assert 'failed-encode' not in booth.staged_sessions
+    assert booth.set_index.get('failed-encode')['path'] == os.path.join(booth.TEMP_IMAGES_PATH, 'failed-encode')
+    assert booth.journal.load()['failed-encode']['state'] == booth.DONE
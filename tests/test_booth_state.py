@@ -0,0 +1,36 @@
+import threading
+from time import monotonic, sleep
+
+from booth_state import IDLE, BoothStateMachine
+from metrics import Metrics
+
+
+def test_idle_cpu_is_the_main_loop_only():
+    state_machine = BoothStateMachine()
+    stop = threading.Event()
+
+    def busy():
+        # Background work (a GIF stream, the flusher) burning CPU while the booth sits idle
+        while not stop.is_set():
+            sum(range(10000))
+
+    worker = threading.Thread(target=busy)
+    worker.start()
+    try:
+        end = monotonic() + 0.5
+        while monotonic() < end:
+            sleep(0.05)  # The idle loop, blocked waiting for events
+    finally:
+        stop.set()
+        worker.join()
+    assert state_machine.metrics()['idle_cpu_percent'] < 20
+
+
+def test_state_machine_numbers_are_exported():
+    metrics = Metrics(enabled=True, log_path=None)
+    state_machine = BoothStateMachine()
+    state_machine.register_gauges(metrics)
+    text = metrics.prometheus_text()
+    assert 'gifbooth_idle_cpu_percent ' in text
+    assert f'gifbooth_state_seconds{{state="{IDLE}"}}' in text
+    assert 'gifbooth_button_to_flash_seconds{stat="mean"} 0.0' in text
@@ -0,0 +1,78 @@
+import os
+
+import pygame
+import pytest
+
+import raw_frames
+from frame_cache import FrameCache
+
+SIZE = (16, 8)
+FRAME_BYTES = SIZE[0] * SIZE[1] * 4
+
+
+@pytest.fixture
+def display():
+    pygame.display.init()
+    yield pygame.display.set_mode(SIZE, 0, 32)
+    pygame.display.quit()
+
+
+def write_jpegs(directory, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(str(directory), f'image{i:02}.jpg')
+        surface = pygame.Surface((32, 16))
+        surface.fill((i * 10, 100, 200))
+        pygame.image.save(surface, path)
+        paths.append(path)
+    return paths
+
+
+def write_raw_frames(paths, display):
+    surfaces = [pygame.transform.scale(pygame.image.load(path).convert(), SIZE) for path in paths]
+    assert len(raw_frames.write_frames(paths, surfaces, display)) == len(paths)
+
+
+def test_decoded_frames_evicted_least_recently_used_first(tmp_path, display):
+    paths = write_jpegs(tmp_path, 4)
+    cache = FrameCache(budget_bytes=3 * FRAME_BYTES)
+
+    for path in paths[:3]:
+        cache.get(path, SIZE)
+    cache.get(paths[0], SIZE)  # Now the most recently used
+    cache.get(paths[3], SIZE)  # Over budget: evicts paths[1]
+
+    assert cache.evictions == 1
+    assert cache.used_bytes == 3 * FRAME_BYTES
+    assert [key[0] for key in cache._frames] == [paths[2], paths[0], paths[3]]
+    cache.get(paths[0], SIZE)
+    assert cache.hits == 2
+
+
+def test_mapped_frames_have_their_own_budget(tmp_path, display):
+    paths = write_jpegs(tmp_path, 4)
+    write_raw_frames(paths, display)
+    cache = FrameCache(budget_bytes=FRAME_BYTES, mapped_budget_bytes=2 * FRAME_BYTES)
+
+    for path in paths:
+        cache.get(path, SIZE)
+
+    assert cache.mapped == 4
+    assert cache.used_bytes == 0  # Mapped frames don't use the decoded budget...
+    assert cache.mapped_bytes == 2 * FRAME_BYTES  # ...but are evicted once their own budget is used up
+    assert cache.evictions == 2
+    assert [key[0] for key in cache._frames] == paths[2:]
+
+
+def test_invalidate_releases_both_budgets(tmp_path, display):
+    paths = write_jpegs(tmp_path, 2)
+    write_raw_frames(paths[:1], display)
+    cache = FrameCache()
+
+    cache.get(paths[0], SIZE)  # Mapped
+    cache.get(paths[1], SIZE)  # Decoded
+    assert cache.mapped_bytes == FRAME_BYTES and cache.used_bytes == FRAME_BYTES
+
+    cache.invalidate_dir(str(tmp_path))
+    assert cache.mapped_bytes == 0 and cache.used_bytes == 0
+    assert cache.stats()['frames'] == 0
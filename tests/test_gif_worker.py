@@ -0,0 +1,38 @@
+import glob
+import os
+
+from gif_worker import GifWorker
+
+FRAMES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                       'gbooth_temp', '*.jpg')))[:2]
+
+
+def test_workers_are_forked_up_front_and_finished_jobs_dropped(tmp_path):
+    worker = GifWorker(max_workers=2)
+    try:
+        assert len(worker._executor._processes) == 2  # Before any job, so before the caller starts threads
+        done = []
+        job = worker.submit(FRAMES, str(tmp_path / 'out.gif'), 100, profile='speed', callback=done.append)
+        job.future.result(timeout=60)
+        worker.drain()
+        assert done == [job] and job.error is None
+        assert worker.jobs == {} and worker.queue_depth() == 0
+    finally:
+        worker.drain()
+
+
+def test_wait_covers_jobs_submitted_from_callbacks(tmp_path):
+    # As a deferred archive encode is started from the callback of the GIF before it
+    worker = GifWorker(max_workers=1)
+    outputs = [str(tmp_path / f'{i}.gif') for i in range(3)]
+    finished = []
+
+    def chain(job):
+        finished.append(job.output_path)
+        if len(finished) < len(outputs):
+            worker.submit(FRAMES, outputs[len(finished)], 100, profile='speed', callback=chain)
+
+    worker.submit(FRAMES, outputs[0], 100, profile='speed', callback=chain)
+    assert worker.wait(timeout=60)
+    worker.drain()
+    assert finished == outputs and all(os.path.exists(path) for path in outputs)
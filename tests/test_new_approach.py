@@ -0,0 +1,59 @@
+import importlib.util
+import os
+import shutil
+
+import pytest
+
+import backends
+import config
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_PATH, 'new_approach_11_12.py')
+
+
+class FailingCamera(backends.FakeCamera):
+    # Stops working after `good` shots, like a camera dropping off mid-burst
+    good = 2
+
+    def capture(self, output, **options):
+        if self.captures >= self.good:
+            raise RuntimeError("Camera went away")
+        super().capture(output, **options)
+
+
+class FailingBackend(backends.FakeBackend):
+    def open_camera(self):
+        self.camera = FailingCamera(self.frames_path)
+        return self.camera
+
+
+@pytest.fixture
+def booth(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(REPO_PATH, 'start_images'), tmp_path / 'start_images')
+    for name, value in {
+        'recent_sets_path': tmp_path / 'recent', 'archive_path': tmp_path / 'archive',
+        'asset_cache_path': tmp_path / 'asset_cache', 'start_image_path': tmp_path / 'start_images/stooges.jpg',
+        'processing_image_path': tmp_path / 'start_images/stooges.jpg',
+        'screen_width': 64, 'screen_height': 36, 'camera_settle_time': 0.0,
+        'image_display_time': 0.0, 'post_capture_delay': 0.0, 'flash_time': 0.0, 'photo_interval': 0.0,
+    }.items():
+        monkeypatch.setattr(config, name, str(value) if isinstance(value, os.PathLike) else value)
+    os.makedirs(config.archive_path)
+    backends.set_backend(FailingBackend(screen_size=(64, 36)))
+    spec = importlib.util.spec_from_file_location('new_approach', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.camera.wait_ready()
+    yield module
+    module.gif_worker.drain()
+    module.input_layer.close()
+    module.camera.close()
+    module.pygame.quit()
+    backends.set_backend(None)
+
+
+def test_interrupted_burst_keeps_the_saved_sets(booth):
+    assert booth.photobooth_sequence() is False
+    assert booth.photo_sets.recent(0) is None  # No partial set pushed into a slot
+    assert os.listdir(config.archive_path) == []  # And no GIF made from one
+    assert booth.session_queue.depth() == 0  # The ticket was given back
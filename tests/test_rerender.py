@@ -0,0 +1,48 @@
+import os
+
+import pytest
+from PIL import Image
+
+import rerender
+from rerender import FAILED, RENDERED, SKIPPED, Checkpoint
+
+
+@pytest.fixture
+def session(tmp_path):
+    set_dir = tmp_path / 'sets' / '20240101-120000'
+    set_dir.mkdir(parents=True)
+    for i in range(3):
+        Image.new('RGB', (32, 24), (i * 80, 40, 200)).save(set_dir / f'image{i:02}.jpg')
+    old = os.path.getmtime(set_dir) - 2 * rerender.LIVE_MARGIN  # Long enough ago not to look live
+    for path in [set_dir, *set_dir.iterdir()]:
+        os.utime(path, (old, old))
+    return rerender.find_sessions([tmp_path / 'sets'], None, None)
+
+
+def run(sessions, out_dir, duration=500, force=False):
+    return rerender.rerender(sessions, str(out_dir), 'speed', duration, '', workers=1, force=force)
+
+
+def test_checkpoint_skips_what_is_up_to_date(tmp_path, session):
+    out = tmp_path / 'out'
+    assert run(session, out)[RENDERED] == 1
+    assert run(session, out)[SKIPPED] == 1
+
+    counts = run(session, out, duration=400)  # New settings re-render
+    assert counts[RENDERED] == 1 and counts[FAILED] == 0
+    assert len(Checkpoint(str(out / rerender.CHECKPOINT_NAME)).keys) == 1
+
+    os.remove(out / '20240101-120000.gif')  # A missing output is re-rendered even with a matching key
+    assert run(session, out, duration=400)[RENDERED] == 1
+
+
+def test_checkpoint_ignores_a_torn_line(tmp_path):
+    path = str(tmp_path / rerender.CHECKPOINT_NAME)
+    checkpoint = Checkpoint(path)
+    checkpoint.record('a', 'k1')
+    checkpoint.record('a', 'k2')
+    checkpoint.close()
+    with open(path, 'a') as f:
+        f.write('{"name": "b", "ke')
+
+    assert Checkpoint(path).keys == {'a': 'k2'}
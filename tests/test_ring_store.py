@@ -0,0 +1,50 @@
+import json
+
+from ring_store import HEAD_FILE, RingStore
+
+
+def push(ring, tmp_path, text):
+    source = tmp_path / f'{text}.gif'
+    source.write_text(text)
+    return ring.push_file(source)
+
+
+def contents(paths):
+    return [open(path).read() for path in paths]
+
+
+def test_slots_wrap_and_recycle_the_oldest(tmp_path):
+    ring = RingStore(tmp_path / 'recent', 3, 'recent{}.gif')
+    for text in 'abcde':
+        push(ring, tmp_path, text)
+
+    assert len(ring) == 3
+    assert contents(ring.recent_paths()) == ['e', 'd', 'c']
+    assert sorted(p.name for p in (tmp_path / 'recent').glob('*.gif')) == ['recent0.gif', 'recent1.gif', 'recent2.gif']
+    assert ring.recent(3) is None
+    with open(tmp_path / 'recent' / HEAD_FILE) as f:
+        head = json.load(f)
+    assert head['seq'] == 5 and head['count'] == 3
+    assert head['recent'] == [ring.slot_name(ring._slot(k)) for k in range(3)]
+
+
+def test_head_survives_a_restart(tmp_path):
+    ring = RingStore(tmp_path / 'recent', 3, 'recent{}.gif')
+    for text in 'abcd':
+        push(ring, tmp_path, text)
+
+    (tmp_path / 'recent' / 'recent9.gif.part').write_text('torn')  # Left by a push that was interrupted
+    reopened = RingStore(tmp_path / 'recent', 3, 'recent{}.gif')
+    assert contents(reopened.recent_paths()) == ['d', 'c', 'b']
+    assert not (tmp_path / 'recent' / 'recent9.gif.part').exists()
+    push(reopened, tmp_path, 'e')
+    assert contents(reopened.recent_paths()) == ['e', 'd', 'c']
+
+
+def test_push_dir_replaces_the_oldest_set(tmp_path):
+    ring = RingStore(tmp_path / 'sets', 2, 'set{}', first=1)
+    for text in 'abc':
+        ring.push_dir(lambda path, text=text: open(f'{path}/image00.jpg', 'w').write(text))
+
+    assert contents(f'{path}/image00.jpg' for path in ring.recent_paths()) == ['c', 'b']
+    assert sorted(p.name for p in (tmp_path / 'sets').iterdir()) == [HEAD_FILE, 'set1', 'set2']
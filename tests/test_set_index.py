@@ -0,0 +1,53 @@
+import json
+import threading
+
+from set_index import SetIndex
+
+
+def make_set(tmp_path, set_id):
+    set_dir = tmp_path / 'sets' / set_id
+    set_dir.mkdir(parents=True)
+    frames = []
+    for i in range(2):
+        frame = set_dir / f'image{i:02d}.jpg'
+        frame.write_bytes(b'jpeg')
+        frames.append(str(frame))
+    return set_dir, frames
+
+
+def test_manifest_round_trip(tmp_path):
+    (tmp_path / 'sets').mkdir()
+    manifest = str(tmp_path / 'sets.json')
+    index = SetIndex(tmp_path / 'sets', manifest)
+    for i, set_id in enumerate(('a', 'b', 'c')):
+        set_dir, frames = make_set(tmp_path, set_id)
+        index.add_set(set_id, set_dir, frames, 1000.0 + i)
+    index.set_gif('b', tmp_path / 'b.gif')
+
+    reloaded = SetIndex(tmp_path / 'sets', manifest)
+    assert [record['id'] for record in reloaded.recent(3)] == ['c', 'b', 'a']
+    assert reloaded.get('b')['gif'] == str(tmp_path / 'b.gif')
+    assert reloaded.get('a')['frames'] == index.get('a')['frames']
+
+
+def test_concurrent_saves(tmp_path):
+    # The burst writer, flusher, GIF callbacks and compactor all save at once
+    (tmp_path / 'sets').mkdir()
+    manifest = tmp_path / 'sets.json'
+    index = SetIndex(tmp_path / 'sets', str(manifest))
+    errors = []
+
+    def add(thread):
+        try:
+            for i in range(50):
+                index.add_set(f'{thread}-{i}', tmp_path / 'sets', [], float(i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add, args=(t,)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(json.loads(manifest.read_text())['sets']) == 400  # The last save had every set
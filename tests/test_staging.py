@@ -0,0 +1,81 @@
+import json
+import os
+
+from staging import DONE, Flusher, Journal
+
+
+def read_journal(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_failed_copy_drops_what_depends_on_it(tmp_path):
+    staged = tmp_path / 'staged'
+    staged.mkdir()
+    (staged / 'image00.jpg').write_bytes(b'jpeg')
+    (tmp_path / 'full').write_text('')  # Copies under a file fail, like a full or failing card
+    journal = Journal(tmp_path / 'sessions.journal')
+    flusher = Flusher(journal, interval=0.0).start()
+    finished = []
+
+    for set_id, target in (('bad', tmp_path / 'full' / 'bad'), ('good', tmp_path / 'card' / 'good')):
+        part = f'{set_id}/frames'
+        flusher.record(set_id, 'captured')
+        flusher.copy(staged / 'image00.jpg', target / 'image00.jpg', part=part)
+        flusher.record(set_id, 'persisted', part=part)
+        flusher.after(lambda set_id=set_id: finished.append(set_id), part=part)
+    flusher.close()
+
+    assert finished == ['good']
+    assert (tmp_path / 'card' / 'good' / 'image00.jpg').exists()
+    assert [(r['session'], r['state']) for r in read_journal(journal.path)] == [
+        ('bad', 'captured'), ('good', 'captured'), ('good', 'persisted')]
+    assert list(journal.unfinished()) == ['bad', 'good']  # Neither is done; 'bad' is left for the next start
+    assert flusher.stats()['dropped'] == 2
+    assert os.path.exists(staged / 'image00.jpg')
+
+
+def test_persisted_raw_frames_are_still_mapped(tmp_path):
+    import pygame
+
+    import raw_frames
+    from frame_cache import FrameCache
+
+    pygame.display.init()
+    try:
+        display = pygame.display.set_mode((64, 36))
+        staged = tmp_path / 'staged'
+        staged.mkdir()
+        jpeg = str(staged / 'image00.jpg')
+        pygame.image.save(pygame.Surface((64, 36)), jpeg)
+        raw_frames.write_frames([jpeg], [pygame.Surface((64, 36)).convert()], display)
+
+        flusher = Flusher(Journal(tmp_path / 'sessions.journal'), interval=0.0).start()
+        card = tmp_path / 'card'
+        for name in ('image00.64x36.raw', 'image00.jpg'):  # Raw frame first: the copy must not make it look stale
+            flusher.copy(staged / name, card / name)
+        flusher.close()
+
+        cache = FrameCache(budget_bytes=1024 * 1024)
+        cache.get(card / 'image00.jpg', (64, 36))
+        assert cache.stats()['mapped'] == 1
+    finally:
+        pygame.display.quit()
+
+
+def test_journal_replay_merges_records_and_skips_a_torn_line(tmp_path):
+    journal = Journal(tmp_path / 'sessions.journal')
+    journal.append([{'session': 'a', 'state': 'captured', 'frames': 4},
+                    {'session': 'b', 'state': 'captured'},
+                    {'session': 'a', 'state': 'persisted'},
+                    {'session': 'b', 'state': DONE}])
+    with open(journal.path, 'a') as f:
+        f.write('{"session": "c", "sta')  # A power cut mid-append
+
+    assert journal.load() == {'a': {'session': 'a', 'state': 'persisted', 'frames': 4},
+                              'b': {'session': 'b', 'state': DONE}}
+    assert list(journal.compact()) == ['a']
+    assert read_journal(journal.path) == [{'session': 'a', 'state': 'persisted', 'frames': 4}]
+
+    journal.append([{'session': 'a', 'state': DONE}])
+    assert journal.unfinished() == {}